@@ -0,0 +1 @@
+"""Performance suite of touchstone, run it with python -m perf"""
@@ -0,0 +1,386 @@
+"""Performance suite of touchstone
+
+Serves synthetic ripsaw documents from an in-process fake elasticsearch and
+runs touchstone_compare against it for every scenario, measuring wall time,
+round trips, bytes transferred and peak RSS. The numbers are compared
+against perf/baselines.json, any metric regressing past its tolerance
+fails the suite, as does an import of touchstone.compare slower than the
+cap of the baselines.
+
+Usage:
+  python -m perf [--scenario NAME ...] [--update] [scale options]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Measure the tree the suite ships with, installed or not
+sys.path.insert(0, os.path.join(_ROOT, 'src'))
+
+from tabulate import tabulate  # noqa: E402
+
+from touchstone.benchmarks.spec import load_spec, spec_path  # noqa: E402
+from . import datagen  # noqa: E402
+from .fake_es import FakeElasticsearch, serve  # noqa: E402
+
+
+_logger = logging.getLogger("touchstone")
+BASELINES = os.path.join(_ROOT, 'perf', 'baselines.json')
+
+# name: (benchmark, extra touchstone_compare arguments), {runs} standing for
+# the number of historical runs, the newest run being compared against them,
+# and {baseline} for the first run. Watches compare a run indexed once they
+# poll against the first run, and are measured until its verdict.
+SCENARIOS = {
+    'uperf': ('uperf', []),
+    'ycsb': ('ycsb', []),
+    'pgbench': ('pgbench', []),
+    'vegeta': ('vegeta', []),
+    'mb': ('mb', []),
+    'kubeburner': ('kubeburner', []),
+    'ycsb-statistics': ('ycsb', ['--statistics']),
+    'uperf-grouped': ('uperf', ['--group-identifiers']),
+    'uperf-history': ('uperf', ['--history', '{runs}']),
+    'uperf-changed': ('uperf', ['--baseline', '{baseline}',
+                                '--changed-only']),
+    'pgbench-samples': ('pgbench', ['--raw-samples']),
+    'uperf-watch': ('uperf', ['--baseline', '{baseline}', '--watch',
+                              '--watch-interval', '0.2', '-v']),
+}
+METRICS = ['wall_time_s', 'round_trips', 'bytes', 'peak_rss_kb']
+# Allowed growth of every metric over its baseline, as a fraction
+DEFAULT_TOLERANCES = {'wall_time_s': 0.5, 'round_trips': 0.0,
+                      'bytes': 0.1, 'peak_rss_kb': 0.25}
+DEFAULT_IMPORT_TIME_CAP_MS = 100.0
+
+
+def parse_args(args):
+    scale = datagen.Scale()
+    parser = argparse.ArgumentParser(
+        prog="python -m perf",
+        description="measure touchstone against stored baselines")
+    parser.add_argument(
+        '--scenario',
+        dest="scenarios",
+        help="scenarios to run (default: all of {})".format(
+            ", ".join(SCENARIOS)),
+        nargs='+',
+        choices=list(SCENARIOS),
+        metavar="scenario",
+        default=list(SCENARIOS))
+    parser.add_argument(
+        '--uuids',
+        dest="uuids",
+        help="runs to generate (default: {})".format(scale.uuids),
+        type=int,
+        default=scale.uuids)
+    parser.add_argument(
+        '--iterations',
+        dest="iterations",
+        help="iterations of every run (default: {})".format(
+            scale.iterations),
+        type=int,
+        default=scale.iterations)
+    parser.add_argument(
+        '--cardinality',
+        dest="cardinality",
+        help="values of every bucket (default: {})".format(
+            scale.cardinality),
+        type=int,
+        default=scale.cardinality)
+    parser.add_argument(
+        '--docs',
+        dest="docs",
+        help="documents per run, compute map and bucket combination "
+             "(default: {})".format(scale.docs),
+        type=int,
+        default=scale.docs)
+    parser.add_argument(
+        '--repeat',
+        dest="repeat",
+        help="measured runs per scenario, the fastest counts (default: 3)",
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--baselines',
+        dest="baselines",
+        help="baseline file (default: {})".format(
+            os.path.relpath(BASELINES)),
+        default=BASELINES)
+    parser.add_argument(
+        '--update',
+        dest="update",
+        help="store the measured numbers as the new baselines",
+        action="store_true")
+    return parser.parse_args(args)
+
+
+def _env():
+    env = dict(os.environ)
+    src = os.path.join(_ROOT, 'src')
+    env['PYTHONPATH'] = os.pathsep.join(
+        [src] + [path for path in [env.get('PYTHONPATH')] if path])
+    return env
+
+
+def measure_import_time(repeat):
+    """Cumulative import time of touchstone.compare in a fresh interpreter,
+    in milliseconds, the fastest of repeat runs"""
+    timings = []
+    for _ in range(repeat):
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import touchstone.compare'], env=_env(),
+            stderr=subprocess.PIPE, check=True,
+            universal_newlines=True).stderr
+        match = re.search(r'^import time:\s+\d+ \|\s+(\d+) \|\s+'
+                          r'touchstone\.compare$', stderr, re.MULTILINE)
+        timings.append(int(match.group(1)) / 1000.0)
+    return min(timings)
+
+
+def _records(output):
+    # Complete json records written so far, a partial last line left out
+    return [json.loads(line) for line in output.splitlines(True)
+            if line.endswith(b'\n')]
+
+
+def _check(command, returncode, stdout, stderr):
+    """Raise unless touchstone_compare ran through and wrote json records
+
+    1 only means metrics regressed for comparisons against a baseline,
+    for any other run it is as much a failure as an uncaught traceback.
+    """
+    regressions = '--baseline' in command or '--history' in command
+    failed = returncode not in ((0, 1) if regressions else (0,)) or \
+        b'Traceback (most recent call last)' in stderr
+    if not failed:
+        try:
+            failed = not _records(stdout)
+        except ValueError:
+            failed = True
+    if failed:
+        raise RuntimeError("{} failed with exit code {}:\n{}".format(
+            " ".join(command), returncode,
+            stderr.decode(errors='replace')))
+
+
+def _exit_code(status):
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) \
+        else -os.WTERMSIG(status)
+
+
+def _run_compare(command):
+    """Run touchstone_compare, returning its wall time and peak RSS"""
+    with tempfile.TemporaryFile() as stdout:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, env=_env(), stdout=stdout,
+                                   stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+        process.stderr.close()
+        stdout.seek(0)
+        _check(command, _exit_code(status), stdout.read(), stderr)
+    return wall_time, usage.ru_maxrss
+
+
+def _wait_for(process, output, done, timeout=60.0):
+    # Poll the output of a running process until done(output) holds
+    deadline = time.perf_counter() + timeout
+    while True:
+        output.seek(0)
+        if done(output.read()):
+            return
+        pid, status, _ = os.wait4(process.pid, os.WNOHANG)
+        if pid or time.perf_counter() > deadline:
+            process.kill()
+            raise RuntimeError("{} {}".format(
+                " ".join(process.args), "exited with code {}".format(
+                    _exit_code(status)) if pid else "timed out"))
+        time.sleep(0.005)
+
+
+def _run_watch(command, es, run, documents):
+    """Run touchstone_compare --watch until it compared a run indexed once
+    it started polling
+
+    Returns:
+      tuple: wall time until the verdict of the run, peak RSS, and the
+        round trips and bytes until the verdict
+    """
+    def verdict(output):
+        return any(record.get('verdict') in ('ok', 'regressed') and
+                   run in record.values() for record in _records(output))
+
+    with tempfile.TemporaryFile() as stdout, \
+            tempfile.TemporaryFile() as stderr:
+        es.reset_counters()
+        start = time.perf_counter()
+        process = subprocess.Popen(command, env=_env(), stdout=stdout,
+                                   stderr=stderr)
+        _wait_for(process, stderr, lambda output: b'Watching ' in output)
+        for index, index_documents in documents.items():
+            es.add(index, index_documents)
+        _wait_for(process, stdout, verdict)
+        wall_time = time.perf_counter() - start
+        round_trips, transferred = es.round_trips, es.bytes
+        process.send_signal(signal.SIGTERM)
+        _, status, usage = os.wait4(process.pid, 0)
+        stdout.seek(0)
+        stderr.seek(0)
+        _check(command, _exit_code(status), stdout.read(), stderr.read())
+    return wall_time, usage.ru_maxrss, round_trips, transferred
+
+
+def measure(scenario, scale, repeat):
+    """Measure one scenario against a freshly generated data set
+
+    Returns:
+      dict: the METRICS of the scenario
+    """
+    benchmark, extra = SCENARIOS[scenario]
+    spec = load_spec(spec_path(benchmark))
+    watching = '--watch' in extra
+    # Every measured watch, and its warm-up, gets a run of its own
+    generated = datagen.Scale(
+        uuids=scale.uuids + (repeat + 1 if watching else 0),
+        iterations=scale.iterations, cardinality=scale.cardinality,
+        docs=scale.docs)
+    runs = datagen.uuids(generated)
+    new_runs = {}
+    es = FakeElasticsearch()
+    for index, documents in datagen.generate(spec, 'elasticsearch', 'ripsaw',
+                                             generated).items():
+        for document in documents:
+            if document['uuid'] in runs[:scale.uuids]:
+                es.add(index, [document])
+            else:
+                new_runs.setdefault(document['uuid'], {}).setdefault(
+                    index, []).append(document)
+    runs, new_runs = runs[:scale.uuids], [
+        (run, new_runs[run]) for run in runs[scale.uuids:]]
+    extra = [arg.format(runs=len(runs) - 1, baseline=runs[0])
+             for arg in extra]
+    if '--history' in extra:
+        runs = runs[-1:]
+    elif watching:
+        runs = runs[:1]
+    server = serve(es)
+    try:
+        command = [sys.executable, '-m', 'touchstone.compare', benchmark,
+                   'elasticsearch', 'ripsaw', '-url',
+                   'http://127.0.0.1:{}'.format(server.server_address[1]),
+                   '-u'] + runs + ['-o', 'json', '--no-cache'] + extra
+        # The warm-up run fills the response memo of the fake elasticsearch
+        if watching:
+            _run_watch(command, es, *new_runs.pop(0))
+        else:
+            _run_compare(command)
+        wall_times = []
+        peak_rss = []
+        for _ in range(repeat):
+            if watching:
+                wall_time, rss, round_trips, transferred = _run_watch(
+                    command, es, *new_runs.pop(0))
+            else:
+                es.reset_counters()
+                wall_time, rss = _run_compare(command)
+                round_trips, transferred = es.round_trips, es.bytes
+            wall_times.append(wall_time)
+            peak_rss.append(rss)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {'wall_time_s': round(min(wall_times), 4),
+            'round_trips': round_trips, 'bytes': transferred,
+            'peak_rss_kb': min(peak_rss)}
+
+
+def compare_baselines(results, baselines):
+    """Judge every measured metric against its baseline
+
+    Returns:
+      list: [scenario, metric, baseline, current, change in percent,
+        verdict] rows
+    """
+    tolerances = dict(DEFAULT_TOLERANCES, **baselines.get('tolerances', {}))
+    rows = []
+    for scenario, metrics in results.items():
+        baseline = baselines.get('scenarios', {}).get(scenario, {})
+        for metric in METRICS:
+            current = metrics[metric]
+            if metric not in baseline:
+                rows.append([scenario, metric, None, current, None,
+                             'no_baseline'])
+                continue
+            base = baseline[metric]
+            change = (current - base) * 100.0 / base if base else 0.0
+            verdict = 'regression' if \
+                current > base * (1 + tolerances[metric]) else 'ok'
+            rows.append([scenario, metric, base, current, round(change, 1),
+                         verdict])
+    return rows
+
+
+def main(args):
+    args = parse_args(args)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format="%(message)s")
+    scale = datagen.Scale(uuids=args.uuids, iterations=args.iterations,
+                          cardinality=args.cardinality, docs=args.docs)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as baselines_file:
+            baselines = json.load(baselines_file)
+    if baselines.get('scale', scale.as_dict()) != scale.as_dict() and \
+            not args.update:
+        _logger.error("baselines were measured at scale {}, not {}".format(
+            baselines['scale'], scale.as_dict()))
+        return 2
+
+    import_time = measure_import_time(args.repeat)
+    results = {}
+    for scenario in args.scenarios:
+        _logger.info("Measuring {}".format(scenario))
+        results[scenario] = measure(scenario, scale, args.repeat)
+
+    if args.update:
+        scenarios = dict(baselines.get('scenarios', {}), **results)
+        baselines.update({
+            'scale': scale.as_dict(),
+            'tolerances': baselines.get('tolerances', DEFAULT_TOLERANCES),
+            'import_time_cap_ms': baselines.get('import_time_cap_ms',
+                                                DEFAULT_IMPORT_TIME_CAP_MS),
+            'scenarios': {name: scenarios[name] for name in sorted(scenarios)}
+        })
+        with open(args.baselines, 'w') as baselines_file:
+            json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+            baselines_file.write('\n')
+        _logger.info("Updated {}".format(args.baselines))
+
+    rows = compare_baselines(results, baselines)
+    cap = baselines.get('import_time_cap_ms', DEFAULT_IMPORT_TIME_CAP_MS)
+    rows.append(['import touchstone.compare', 'import_time_ms', cap,
+                 round(import_time, 1), None,
+                 'regression' if import_time > cap else 'ok'])
+    print(tabulate(rows, headers=['scenario', 'metric', 'baseline',
+                                  'current', 'change_pct', 'verdict'],
+                   tablefmt="pretty"))
+    regressions = [row for row in rows if row[-1] == 'regression']
+    if regressions:
+        _logger.error("{} metrics regressed".format(len(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+"""Synthetic ripsaw documents for any benchmark spec
+
+Documents are derived from the spec itself: every compute map of an index
+gets documents matching its filter, spread over every combination of its
+bucket values, with random values for its aggregated and collated fields.
+"""
+import itertools
+
+import numpy as np
+
+
+# Bucket whose values are the iterations of a run
+ITERATION_BUCKET = 'iteration'
+_BASE_TIMESTAMP = 1600000000
+
+
+class Scale:
+    """Size of a synthetic data set
+
+    Args:
+      uuids (int): runs to generate
+      iterations (int): values of the iteration bucket
+      cardinality (int): values of every other bucket
+      docs (int): documents per run, compute map and bucket combination
+    """
+
+    def __init__(self, uuids=2, iterations=3, cardinality=4, docs=2):
+        self.uuids = uuids
+        self.iterations = iterations
+        self.cardinality = cardinality
+        self.docs = docs
+
+    def as_dict(self):
+        return {'uuids': self.uuids, 'iterations': self.iterations,
+                'cardinality': self.cardinality, 'docs': self.docs}
+
+
+def uuids(scale):
+    return ["perf-{:04d}".format(n) for n in range(scale.uuids)]
+
+
+def _set(doc, field, value):
+    # Dotted fields are nested objects, e.g. data.OVERALL.Throughput(ops/sec)
+    parts = field.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _field(name):
+    return name[:-len('.keyword')] if name.endswith('.keyword') else name
+
+
+def _bucket_values(bucket, scale):
+    if _field(bucket) == ITERATION_BUCKET:
+        return list(range(scale.iterations))
+    if bucket.endswith('.keyword'):
+        return ["{}-{}".format(_field(bucket), n)
+                for n in range(scale.cardinality)]
+    return [2 ** (n + 6) for n in range(scale.cardinality)]
+
+
+def _compute_docs(search_map, compute, uuid, run, scale, rng):
+    combinations = list(itertools.product(
+        *[_bucket_values(bucket, scale) for bucket in compute['buckets']]))
+    fields = list(compute['aggregations']) + list(compute['collate'])
+    count = len(combinations) * scale.docs
+    # a run level offset so runs differ like real ones do
+    values = rng.lognormal(mean=3.0 + 0.01 * run, sigma=0.1,
+                           size=(count, len(fields)))
+    docs = []
+    for position in range(count):
+        doc = {}
+        for field in search_map['compare']:
+            _set(doc, field, 'perf')
+        _set(doc, 'uuid', uuid)
+        _set(doc, 'timestamp', _BASE_TIMESTAMP + run * 3600 + position)
+        for field, value in compute['filter'].items():
+            _set(doc, _field(field), value)
+        for field, excluded in compute.get('exclude', {}).items():
+            _set(doc, _field(field), excluded + 1 if
+                 isinstance(excluded, (int, float)) else 'included')
+        for bucket, value in zip(compute['buckets'],
+                                 combinations[position % len(combinations)]):
+            _set(doc, _field(bucket), value)
+        for field, value in zip(fields, values[position]):
+            _set(doc, field, float(value))
+        docs.append(doc)
+    return docs
+
+
+def _metadata_docs(metadata_map, uuid, scale):
+    docs = []
+    for pod in range(scale.cardinality):
+        doc = {'uuid': uuid}
+        _set(doc, metadata_map['element'], "pod-{}".format(pod))
+        for field in metadata_map['compare']:
+            _set(doc, field, "{}-{}".format(field.rsplit('.', 1)[-1], pod))
+        docs.append(doc)
+    return docs
+
+
+def generate(spec, source_type, harness, scale, seed=0):
+    """Generate the documents of every index of a benchmark spec
+
+    Args:
+      spec (dict): loaded benchmark spec, see touchstone.benchmarks.spec
+      source_type (str): database type of the spec to generate for
+      harness (str): harness of the spec to generate for
+      scale (:obj:`Scale`): size of the data set
+      seed (int): seed of the random values, so data sets are reproducible
+
+    Returns:
+      dict: {index: [document]}
+    """
+    rng = np.random.default_rng(seed)
+    indices = {}
+    for run, uuid in enumerate(uuids(scale)):
+        for index, metadata_map in \
+                spec[source_type].get('metadata', {}).items():
+            indices.setdefault(index, []).extend(
+                _metadata_docs(metadata_map, uuid, scale))
+        for index, search_map in spec[source_type][harness].items():
+            for compute in search_map['compute']:
+                indices.setdefault(index, []).extend(
+                    _compute_docs(search_map, compute, uuid, run, scale, rng))
+    return indices
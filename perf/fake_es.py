@@ -0,0 +1,492 @@
+"""In-process stand-in for the parts of the elasticsearch search API
+touchstone uses: _search and _msearch with filter_path, points in time
+with sort and search_after, bool/match/term/terms/exists/range queries,
+_source filtering, composite, terms, filter and top_hits buckets, the
+metric aggregations benchmark specs declare, the sibling pipeline
+aggregations of historical baselines and the bucket_script and
+bucket_selector aggregations of --changed-only.
+
+Responses are memoized per request, so once a warm-up run has been served
+the server answers from memory and timings are dominated by touchstone.
+"""
+import json
+import logging
+import operator
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+_logger = logging.getLogger("touchstone")
+
+_DEFAULT_PERCENTS = [1, 5, 25, 50, 75, 95, 99]
+_RANGE_OPERATORS = {'gt': operator.gt, 'gte': operator.ge,
+                    'lt': operator.lt, 'lte': operator.le}
+
+
+def _field_values(doc, field):
+    if field.endswith('.keyword'):
+        field = field[:-len('.keyword')]
+    value = doc
+    for part in field.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return []
+        value = value[part]
+    return value if isinstance(value, list) else [value]
+
+
+def _equals(a, b):
+    if isinstance(a, str) or isinstance(b, str):
+        return str(a) == str(b)
+    return a == b
+
+
+def _clauses(body, occur):
+    clauses = body.get(occur, [])
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def _matches(doc, query):
+    if not query:
+        return True
+    (kind, body), = query.items()
+    if kind == 'match_all':
+        return True
+    if kind == 'bool':
+        return all(_matches(doc, clause) for clause in
+                   _clauses(body, 'must') + _clauses(body, 'filter')) and \
+            not any(_matches(doc, clause)
+                    for clause in _clauses(body, 'must_not'))
+    if kind in ('match', 'term'):
+        (field, value), = body.items()
+        if isinstance(value, dict):
+            value = value.get('query', value.get('value'))
+        return any(_equals(x, value) for x in _field_values(doc, field))
+    if kind == 'terms':
+        (field, values), = body.items()
+        return any(_equals(x, value) for x in _field_values(doc, field)
+                   for value in values)
+    if kind == 'exists':
+        return any(value is not None
+                   for value in _field_values(doc, body['field']))
+    if kind == 'range':
+        (field, bounds), = body.items()
+        return any(value is not None and
+                   all(_RANGE_OPERATORS[bound](value, limit)
+                       for bound, limit in bounds.items()
+                       if bound in _RANGE_OPERATORS)
+                   for value in _field_values(doc, field))
+    raise ValueError("unsupported query {}".format(kind))
+
+
+def _numbers(docs, field):
+    return [float(value) for doc in docs
+            for value in _field_values(doc, field)
+            if isinstance(value, (int, float)) and
+            not isinstance(value, bool)]
+
+
+def _filter_source(source, spec):
+    if spec is None or spec is True:
+        return source
+    if spec is False:
+        return None
+    includes = spec.get('includes') if isinstance(spec, dict) else spec
+    if isinstance(includes, str):
+        includes = [includes]
+    if not includes:
+        return source
+
+    def _walk(d, prefix):
+        out = {}
+        for key, value in d.items():
+            path = prefix + key
+            if any(path == i or path.startswith(i + '.') for i in includes):
+                out[key] = value
+            elif isinstance(value, dict) and \
+                    any(i.startswith(path + '.') for i in includes):
+                out[key] = _walk(value, path + '.')
+        return out
+    return _walk(source, '')
+
+
+def _resolve_path(bucket, path):
+    parts = path.split('>')
+    value = bucket
+    for part in parts[:-1]:
+        value = value[part]
+    last = parts[-1]
+    if last == '_count':
+        return value['doc_count']
+    if '[' in last:
+        name, key = last[:-1].split('[', 1)
+        return value[name]['values'].get(key)
+    return value[last].get('value')
+
+
+def _metric(kind, body, docs):
+    values = _numbers(docs, body['field'])
+    if kind == 'percentiles':
+        return {'values': {
+            str(float(percent)):
+                float(np.percentile(values, percent)) if values else None
+            for percent in body.get('percents', _DEFAULT_PERCENTS)}}
+    if kind == 'value_count':
+        return {'value': len(values)}
+    if kind == 'sum':
+        return {'value': float(sum(values))}
+    if not values:
+        return {'value': None}
+    return {'value': float({'avg': np.mean, 'max': np.max,
+                            'min': np.min}[kind](values))}
+
+
+def _pipeline(kind, body, out):
+    name, _, path = body['buckets_path'].partition('>')
+    values = [value for value in
+              (_resolve_path(bucket, path) for bucket in out[name]['buckets'])
+              if value is not None]
+    if kind == 'extended_stats_bucket':
+        if not values:
+            return {'count': 0, 'min': None, 'max': None, 'avg': None,
+                    'sum': 0.0, 'std_deviation': None}
+        return {'count': len(values), 'min': min(values),
+                'max': max(values), 'avg': float(np.mean(values)),
+                'sum': float(sum(values)),
+                'std_deviation': float(np.std(values))}
+    return {'values': {
+        str(float(percent)):
+            float(np.percentile(values, percent, method='lower'))
+            if values else None
+        for percent in body.get('percents', _DEFAULT_PERCENTS)}}
+
+
+def _painless(script, params):
+    # The arithmetic and boolean subset of painless touchstone sends
+    expression = script.replace('params.', '')
+    for painless, python in (('Math.abs', 'abs'), ('Math.max', 'max'),
+                             ('||', ' or '), ('&&', ' and ')):
+        expression = expression.replace(painless, python)
+    return eval(expression, {'__builtins__': {}, 'abs': abs, 'max': max},
+                dict(params))
+
+
+def _bucket_pipeline(kind, body, out):
+    params = {var: _resolve_path(out, path)
+              for var, path in body['buckets_path'].items()}
+    if body.get('gap_policy') == 'insert_zeros':
+        params = {var: 0.0 if value is None else value
+                  for var, value in params.items()}
+    elif any(value is None for value in params.values()):
+        # skipped, which keeps the bucket
+        return None if kind == 'bucket_script' else True
+    script = body['script']
+    if isinstance(script, dict):
+        script = script['source']
+    result = _painless(script, params)
+    if kind == 'bucket_script':
+        return {'value': float(result)}
+    return bool(result)
+
+
+def _select(buckets, sub):
+    # Drop the buckets a bucket_selector rejected, and its verdicts
+    selectors = [name for name, spec in sub.items()
+                 if 'bucket_selector' in spec]
+    if not selectors:
+        return buckets
+    return [bucket for bucket in buckets
+            if all([bucket.pop(name) for name in selectors])]
+
+
+def _composite_key(doc, sources):
+    key = []
+    for source in sources:
+        (name, definition), = source.items()
+        values = _field_values(doc, definition['terms']['field'])
+        if not values:
+            return None
+        key.append((name, values[0]))
+    return tuple(key)
+
+
+def _sort_key(key):
+    # numbers sort before strings, like elasticsearch keyword/long mixes
+    return [(isinstance(value, str), value) for _, value in key]
+
+
+def _aggregate(docs, aggs, index):
+    out = {}
+    pipelines = []
+    for name, spec in aggs.items():
+        sub = spec.get('aggs', spec.get('aggregations', {}))
+        (kind, body), = ((k, v) for k, v in spec.items()
+                         if k not in ('aggs', 'aggregations', 'meta'))
+        if kind == 'composite':
+            groups = {}
+            for doc in docs:
+                key = _composite_key(doc['_source'], body['sources'])
+                if key is not None:
+                    groups.setdefault(key, []).append(doc)
+            keys = sorted(groups, key=_sort_key)
+            if body.get('after'):
+                after = _sort_key(tuple(
+                    (source_name, body['after'][source_name])
+                    for source_name in (next(iter(source))
+                                        for source in body['sources'])))
+                keys = [key for key in keys if _sort_key(key) > after]
+            buckets = []
+            for key in keys[:body.get('size', 10)]:
+                bucket = {'key': dict(key), 'doc_count': len(groups[key])}
+                bucket.update(_aggregate(groups[key], sub, index))
+                buckets.append(bucket)
+            out[name] = {'buckets': _select(buckets, sub)}
+            # The after key is the last bucket before any was selected
+            if buckets:
+                out[name]['after_key'] = buckets[-1]['key']
+        elif kind == 'terms':
+            groups = {}
+            for doc in docs:
+                for value in _field_values(doc['_source'], body['field']):
+                    groups.setdefault(value, []).append(doc)
+            buckets = []
+            for key, group in sorted(groups.items(),
+                                     key=lambda item: (-len(item[1]),
+                                                       str(item[0]))):
+                bucket = {'key': key, 'doc_count': len(group)}
+                bucket.update(_aggregate(group, sub, index))
+                buckets.append(bucket)
+            if body.get('order'):
+                (order_by, direction), = body['order'].items()
+
+                def _order(bucket):
+                    value = _resolve_path(bucket, order_by)
+                    return (value is not None, value)
+                buckets.sort(key=_order, reverse=direction == 'desc')
+            out[name] = {'buckets': _select(buckets[:body.get('size', 10)],
+                                            sub)}
+        elif kind == 'filter':
+            matched = [doc for doc in docs if _matches(doc['_source'], body)]
+            out[name] = {'doc_count': len(matched)}
+            out[name].update(_aggregate(matched, sub, index))
+        elif kind == 'top_hits':
+            out[name] = {'hits': {'hits': [
+                {'_index': index, '_id': doc['_id'],
+                 '_source': _filter_source(doc['_source'],
+                                           body.get('_source'))}
+                for doc in docs[:body.get('size', 3)]]}}
+        elif kind in ('avg', 'max', 'min', 'sum', 'value_count',
+                      'percentiles'):
+            out[name] = _metric(kind, body, [doc['_source']
+                                             for doc in docs])
+        elif kind in ('extended_stats_bucket', 'percentiles_bucket',
+                      'bucket_script', 'bucket_selector'):
+            pipelines.append((name, kind, body))
+        else:
+            raise ValueError("unsupported aggregation {}".format(kind))
+    # Pipelines read their siblings, in the order they were declared
+    for name, kind, body in pipelines:
+        if kind in ('bucket_script', 'bucket_selector'):
+            result = _bucket_pipeline(kind, body, out)
+            if result is not None:
+                out[name] = result
+        else:
+            out[name] = _pipeline(kind, body, out)
+    return out
+
+
+def _doc_sort_key(doc, sort):
+    key = []
+    for clause in sort:
+        field, order = (clause, 'asc') if isinstance(clause, str) else \
+            next(iter(clause.items()))
+        if isinstance(order, dict):
+            order = order.get('order', 'asc')
+        if order != 'asc':
+            raise ValueError("only ascending sorts are supported")
+        if field in ('_shard_doc', '_doc'):
+            key.append(int(doc['_id']))
+        else:
+            values = _field_values(doc['_source'], field)
+            key.append(values[0] if values else None)
+    return key
+
+
+def _filter_path(obj, paths):
+    def _keep(value, patterns):
+        if any(not pattern for pattern in patterns):
+            return value
+        if isinstance(value, list):
+            return [kept for kept in (_keep(item, patterns)
+                                      for item in value)
+                    if kept is not None]
+        if not isinstance(value, dict):
+            return None
+        out = {}
+        for key, child in value.items():
+            sub = [pattern[1:] for pattern in patterns
+                   if pattern[0] in (key, '*')]
+            if sub:
+                kept = _keep(child, sub)
+                if kept not in (None, {}, []):
+                    out[key] = kept
+        return out
+    return _keep(obj, [path.split('.') for path in paths.split(',')])
+
+
+class FakeElasticsearch:
+    """Documents of every index, searched the way elasticsearch would
+
+    Attributes:
+      round_trips (int): HTTP requests served
+      bytes (int): request and response body bytes transferred
+    """
+
+    def __init__(self):
+        self._indices = {}
+        self._pits = {}
+        self._memo = {}
+        self._lock = threading.Lock()
+        self.round_trips = 0
+        self.bytes = 0
+
+    def add(self, index, documents):
+        docs = self._indices.setdefault(index, [])
+        for document in documents:
+            docs.append({'_id': str(len(docs)), '_source': document})
+        self._memo.clear()
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+            self.bytes = 0
+
+    def _count(self, size):
+        with self._lock:
+            self.round_trips += 1
+            self.bytes += size
+
+    def search(self, index, body):
+        key = json.dumps([index, body], sort_keys=True)
+        if key not in self._memo:
+            self._memo[key] = self._search(index, body)
+        # callers may filter the response, never hand out the memo itself
+        return json.loads(self._memo[key])
+
+    def open_point_in_time(self, index):
+        pit_id = "pit-{}".format(len(self._pits))
+        self._pits[pit_id] = index
+        return pit_id
+
+    def _search(self, index, body):
+        if 'pit' in body:
+            index = self._pits[body['pit']['id']]
+        docs = [doc for name in index.split(',')
+                for doc in self._indices.get(name, [])
+                if _matches(doc['_source'], body.get('query'))]
+        if body.get('sort'):
+            docs.sort(key=lambda doc: _doc_sort_key(doc, body['sort']))
+            if body.get('search_after'):
+                docs = [doc for doc in docs
+                        if _doc_sort_key(doc, body['sort']) >
+                        body['search_after']]
+        hits = []
+        for doc in docs[:body.get('size', 10)]:
+            hit = {'_index': index, '_id': doc['_id'],
+                   '_source': _filter_source(doc['_source'],
+                                             body.get('_source'))}
+            if body.get('sort'):
+                hit['sort'] = _doc_sort_key(doc, body['sort'])
+            hits.append(hit)
+        response = {'took': 1, 'timed_out': False, 'hits': {'hits': hits}}
+        if 'pit' in body:
+            response['pit_id'] = body['pit']['id']
+        if body.get('aggs'):
+            response['aggregations'] = _aggregate(docs, body['aggs'], index)
+        return json.dumps(response)
+
+    def handle(self, method, path, params, payload):
+        """Answer one HTTP request, returning (status, response dict)"""
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            return 200, {'version': {'number': '7.17.0'},
+                         'tagline': 'You Know, for Search'}
+        if parts[-1] == '_pit' and method == 'POST':
+            return 200, {'id': self.open_point_in_time(parts[0])}
+        if parts[-1] == '_pit':
+            self._pits.pop(json.loads(payload)['id'], None)
+            return 200, {'succeeded': True, 'num_freed': 1}
+        if parts[-1] == '_search':
+            # searches of a point in time name no index
+            response = self.search(parts[0] if len(parts) > 1 else None,
+                                   json.loads(payload) if payload else {})
+        elif parts[-1] == '_msearch':
+            lines = [json.loads(line) for line in payload.splitlines()
+                     if line.strip()]
+            responses = []
+            for header, body in zip(lines[::2], lines[1::2]):
+                response = self.search(header['index'], body)
+                response['status'] = 200
+                responses.append(response)
+            response = {'took': 1, 'responses': responses}
+        else:
+            return 404, {'error': {'type': 'not_found', 'reason': path},
+                         'status': 404}
+        if 'filter_path' in params:
+            response = _filter_path(response, params['filter_path'])
+        return 200, response
+
+
+def _handler(es):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _answer(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = self.rfile.read(length) if length else b''
+            params = {key: values[0]
+                      for key, values in parse_qs(url.query).items()}
+            try:
+                status, response = es.handle(self.command, url.path, params,
+                                             payload.decode())
+            except Exception as error:
+                _logger.exception("fake elasticsearch failed")
+                status, response = 400, {
+                    'error': {'type': 'fake_es_exception',
+                              'reason': repr(error)}, 'status': 400}
+            data = json.dumps(response).encode()
+            es._count(len(payload) + len(data))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = _answer
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return Handler
+
+
+def serve(es, port=0):
+    """Serve es on localhost from a daemon thread
+
+    Returns:
+      :obj:`ThreadingHTTPServer`: call shutdown() to stop it, its url is
+        http://127.0.0.1:<server_address[1]>
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _handler(es))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,74 @@
+import logging
+
+from ..utils.lib import iter_bucket_rows
+
+
+_logger = logging.getLogger("touchstone")
+
+# Identifier the historical baseline is reported under
+HISTORY = 'history'
+# Statistics of a metric over the historical runs, in output order
+_STATISTICS = ['runs', 'mean', 'stddev', 'min', 'p50', 'p90', 'max']
+
+
+def _map_leaves(d, depth, function):
+    if depth == 0:
+        return {key: function(value) for key, value in d.items()}
+    return {name: {value: _map_leaves(child, depth - 1, function)
+                   for value, child in bucket_values.items()}
+            for name, bucket_values in d.items()}
+
+
+def history_results(distribution, buckets):
+    """Turn a distribution dict into the results of the HISTORY identifier,
+    the mean of every metric over the historical runs"""
+    return _map_leaves(distribution, len(buckets),
+                       lambda stats: {HISTORY: stats['mean']})
+
+
+class Distribution:
+    """Distribution of every metric of one compute map over historical runs
+
+    Args:
+      columns (list): filter and bucket names
+      runs (list): identifiers of the historical runs
+      paths (list): filter and bucket values of every row
+      metrics (list): metric of every row
+      statistics (list): dict of the _STATISTICS of every row
+    """
+
+    baseline = HISTORY
+
+    def __init__(self, columns, runs, paths, metrics, statistics):
+        self.columns = columns
+        self.runs = runs
+        self.paths = paths
+        self.metrics = metrics
+        self.statistics = statistics
+
+    @classmethod
+    def from_results(cls, compute, buckets, distribution, runs):
+        paths = []
+        metrics = []
+        statistics = []
+        prefix = tuple(compute['filter'].values())
+        for bucket_values, metric, stats in \
+                iter_bucket_rows(distribution, len(buckets)):
+            paths.append(prefix + bucket_values)
+            metrics.append(metric)
+            statistics.append(stats)
+        return cls(list(compute['filter']) + list(buckets), runs, paths,
+                   metrics, statistics)
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def header(self):
+        return self.columns + ["key"] + _STATISTICS
+
+    def rows(self):
+        """Yield every row as a flat list matching header()"""
+        for path, metric, stats in \
+                zip(self.paths, self.metrics, self.statistics):
+            yield list(path) + [metric] + [stats.get(statistic)
+                                           for statistic in _STATISTICS]
@@ -0,0 +1,196 @@
+from fnmatch import fnmatch
+import logging
+
+import numpy as np
+
+
+_logger = logging.getLogger("touchstone")
+
+# Substrings of metric names, matched case insensitively. Latencies are
+# checked first so e.g. "p95_latency" never counts as a throughput.
+_LOWER_IS_BETTER = ('latency', 'ltcy')
+_HIGHER_IS_BETTER = ('throughput', 'ops/sec', 'norm_byte', 'norm_ops',
+                     'requests_per_second', 'rps', 'tps', 'bytes_in',
+                     'bytes_out', 'transactions')
+
+REGRESSION = 'regression'
+IMPROVEMENT = 'improvement'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+NO_MATCH = 'no_match'
+
+# Metrics already warned about lacking a direction
+_UNDIRECTED = set()
+
+
+def direction(metric, overrides=()):
+    """Return 1 if higher values of metric are better, -1 if lower values
+    are, and 0 when it is unknown
+
+    Args:
+      metric (str): value name, e.g. avg(norm_ltcy)
+      overrides (list): (glob pattern, direction) pairs a spec declares,
+        the last pattern matching metric wins over its name
+    """
+    declared = None
+    for pattern, value in overrides:
+        if fnmatch(metric, pattern):
+            declared = value
+    if declared is not None:
+        return declared
+    metric = metric.lower()
+    if any(pattern in metric for pattern in _LOWER_IS_BETTER):
+        return -1
+    if any(pattern in metric for pattern in _HIGHER_IS_BETTER):
+        return 1
+    return 0
+
+
+def metric_directions(metrics, overrides=()):
+    """Direction of every metric, see :func:`direction`
+
+    Metrics without one are only reported as changed, never as regressed,
+    so each of them is warned about once.
+
+    Returns:
+      :obj:`numpy.ndarray`: 1, -1 or 0 per metric
+    """
+    directions = np.array([direction(metric, overrides)
+                           for metric in metrics], dtype=float)
+    for metric, value in zip(metrics, directions):
+        if not value and metric not in _UNDIRECTED:
+            _UNDIRECTED.add(metric)
+            _logger.warning(
+                "Whether higher or lower values of {} are better is unknown, "
+                "it is never reported as a regression. Declare it in "
+                "lower_is_better or higher_is_better of the compute map."
+                .format(metric))
+    return directions
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class Thresholds:
+    """Allowed change in percent per metric
+
+    Args:
+      default (float): threshold of metrics without an override
+      overrides (list): (glob pattern, threshold) pairs, the last pattern
+        matching a metric wins
+    """
+
+    def __init__(self, default=5.0, overrides=None):
+        self.default = default
+        self.overrides = overrides or []
+
+    def threshold(self, metric):
+        threshold = self.default
+        for pattern, value in self.overrides:
+            if fnmatch(metric, pattern):
+                threshold = value
+        return threshold
+
+
+class Comparison:
+    """Deltas of every candidate against the baseline for one compute map
+
+    Values are held in arrays with a row per (bucket path, metric) and a
+    column per candidate.
+    """
+
+    def __init__(self, columns, identifier, baseline, candidates, paths,
+                 metrics, baseline_values, values, thresholds, directions):
+        self.columns = columns
+        self.identifier = identifier
+        self.baseline = baseline
+        self.candidates = candidates
+        self.paths = paths
+        self.metrics = metrics
+        self.baseline_values = baseline_values
+        self.values = values
+        self.thresholds = thresholds
+        self.directions = directions
+        self.delta = values - baseline_values[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.percent = np.where(
+                self.delta == 0, 0.0,
+                self.delta * 100 / np.abs(baseline_values)[:, None])
+        directions = directions[:, None]
+        score = directions * self.percent
+        limit = thresholds[:, None]
+        self.verdicts = np.select(
+            [np.isnan(self.delta), score < -limit, score > limit,
+             (directions == 0) & (np.abs(self.percent) > limit)],
+            [NO_MATCH, REGRESSION, IMPROVEMENT, CHANGED], UNCHANGED)
+
+    def __len__(self):
+        return self.verdicts.size
+
+    @property
+    def regressions(self):
+        return int(np.count_nonzero(self.verdicts == REGRESSION))
+
+    def header(self):
+        return self.columns + ["key", "baseline", self.identifier,
+                               "baseline_value", "value", "delta",
+                               "delta_pct", "threshold_pct", "verdict"]
+
+    def rows(self):
+        """Yield every row as a flat list matching header()
+
+        Missing values are None.
+        """
+        def _value(value):
+            value = float(value)
+            return None if np.isnan(value) else value
+
+        for row, (path, metric) in enumerate(zip(self.paths, self.metrics)):
+            for column, candidate in enumerate(self.candidates):
+                yield list(path) + [
+                    metric, self.baseline, candidate,
+                    _value(self.baseline_values[row]),
+                    _value(self.values[row, column]),
+                    _value(self.delta[row, column]),
+                    _value(self.percent[row, column]),
+                    float(self.thresholds[row]),
+                    str(self.verdicts[row, column])]
+
+
+def compare_records(records, baseline, identifiers, thresholds,
+                    directions=()):
+    """Compare every identifier of a record set against the baseline
+
+    Args:
+      records (:obj:`RecordSet`): results of one compute map
+      baseline (str): identifier the others are compared against
+      identifiers (list): every identifier of the run
+      thresholds (:obj:`Thresholds`): allowed change per metric
+      directions (list): (glob pattern, direction) pairs the compute map
+        declares, see :func:`direction`
+
+    Returns:
+      :obj:`Comparison`
+    """
+    candidates = [identifier for identifier in identifiers
+                  if identifier != baseline]
+    columns = {identifier: column
+               for column, identifier in enumerate([baseline] + candidates)}
+    groups = {}
+    rows = [groups.setdefault((path, metric), len(groups))
+            for path, metric in zip(records.paths, records.metrics)]
+    matrix = np.full((len(groups), len(columns)), np.nan)
+    matrix[rows, [columns[identifier]
+                  for identifier in records.identifiers]] = \
+        [_to_float(value) for value in records.values]
+    paths = [path for path, _ in groups]
+    metrics = [metric for _, metric in groups]
+    return Comparison(records.columns, records.identifier, baseline,
+                      candidates, paths, metrics, matrix[:, 0], matrix[:, 1:],
+                      np.array([thresholds.threshold(metric)
+                                for metric in metrics], dtype=float),
+                      metric_directions(metrics, directions))
@@ -0,0 +1,275 @@
+import logging
+import math
+
+import numpy as np
+
+from .regression import metric_directions, REGRESSION, IMPROVEMENT, \
+    CHANGED, UNCHANGED, NO_MATCH
+
+
+_logger = logging.getLogger("touchstone")
+
+NOISY = 'noisy'
+BASELINE = 'baseline'
+TOO_FEW_SAMPLES = 'too_few_samples'
+
+_BETACF_ITERATIONS = 200
+_TINY = 1e-300
+# values drawn at once by the bootstrap
+_BOOTSTRAP_CHUNK = 2 ** 21
+
+
+def _betacf(a, b, x):
+    """Continued fraction of the incomplete beta function (modified Lentz),
+    evaluated for whole arrays at once"""
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = np.ones_like(x)
+    d = 1.0 - qab * x / qap
+    d = np.where(np.abs(d) < _TINY, _TINY, d)
+    d = 1.0 / d
+    h = d
+    for m in range(1, _BETACF_ITERATIONS + 1):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)),
+                   -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1.0 + aa * d
+            d = np.where(np.abs(d) < _TINY, _TINY, d)
+            c = 1.0 + aa / c
+            c = np.where(np.abs(c) < _TINY, _TINY, c)
+            d = 1.0 / d
+            h = h * d * c
+    return h
+
+
+def _betainc(a, b, x):
+    """Regularized incomplete beta function I_x(a, b) of arrays"""
+    lgamma = np.vectorize(math.lgamma, otypes=[float])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        front = np.exp(lgamma(a + b) - lgamma(a) - lgamma(b) +
+                       a * np.log(x) + b * np.log1p(-x))
+        # the continued fraction converges quickly below this point only
+        direct = x < (a + 1.0) / (a + b + 2.0)
+        result = np.where(direct,
+                          front * _betacf(a, b, x) / a,
+                          1.0 - front * _betacf(b, a, 1.0 - x) / b)
+    result = np.where(x <= 0, 0.0, result)
+    return np.where(x >= 1, 1.0, result)
+
+
+def welch_pvalues(mean1, var1, n1, mean2, var2, n2):
+    """Two sided p-values of Welch's t-test, element wise"""
+    se1 = var1 / n1
+    se2 = var2 / n2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (mean2 - mean1) / np.sqrt(se1 + se2)
+        df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        p = _betainc(df / 2.0, np.full_like(df, 0.5), df / (df + t ** 2))
+    # Without any variance the samples either match or are told apart
+    constant = (se1 + se2) == 0
+    return np.where(constant, np.where(mean1 == mean2, 1.0, 0.0), p)
+
+
+def mannwhitney_pvalue(sample1, sample2):
+    """Two sided p-value of the Mann-Whitney U test, using the normal
+    approximation with tie correction"""
+    n1 = len(sample1)
+    n2 = len(sample2)
+    values = np.concatenate([sample1, sample2])
+    _, inverse, counts = np.unique(values, return_inverse=True,
+                                   return_counts=True)
+    # average rank of every distinct value, ties sharing their mean rank
+    ranks = (np.cumsum(counts) - (counts - 1) / 2.0)[inverse]
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    n = n1 + n2
+    ties = (counts ** 3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12.0 * ((n + 1) - ties))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2.0) / sigma
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def bootstrap_means(samples, counts, resamples, rng):
+    """Means of resamples drawn with replacement from every sample
+
+    Rows are resampled in chunks so the drawn values never take more than
+    a few tens of megabytes.
+
+    Args:
+      samples (:obj:`numpy.ndarray`): one padded sample per row
+      counts (:obj:`numpy.ndarray`): number of values in every row
+      resamples (int): resamples per row
+      rng (:obj:`numpy.random.Generator`): source of randomness
+
+    Returns:
+      :obj:`numpy.ndarray`: a row of resampled means per sample
+    """
+    width = samples.shape[1]
+    means = np.empty((len(samples), resamples))
+    chunk = max(1, _BOOTSTRAP_CHUNK // max(1, resamples * width))
+    # the padding columns of short samples are not part of the resample
+    mask = np.arange(width)[None, None, :] < counts[:, None, None]
+    for start in range(0, len(samples), chunk):
+        rows = slice(start, start + chunk)
+        picks = (rng.random((len(samples[rows]), resamples, width)) *
+                 counts[rows, None, None]).astype(int)
+        drawn = np.take_along_axis(samples[rows, None, :], picks, axis=2)
+        means[rows] = np.where(mask[rows], drawn, 0.0).sum(axis=2) / \
+            counts[rows, None]
+    return means
+
+
+class Statistics:
+    """Summary statistics of the samples of every identifier, and their tests
+    against the baseline, for one compute map
+
+    Samples are the values of a metric across one bucket, e.g. iteration.
+    """
+
+    def __init__(self, columns, identifier, baseline, keys, identifiers,
+                 counts, means, stddevs, ci_low, ci_high, welch, mannwhitney,
+                 verdicts):
+        self.columns = columns
+        self.identifier = identifier
+        self.baseline = baseline
+        self.keys = keys
+        self.identifiers = identifiers
+        self.counts = counts
+        self.means = means
+        self.stddevs = stddevs
+        self.ci_low = ci_low
+        self.ci_high = ci_high
+        self.welch = welch
+        self.mannwhitney = mannwhitney
+        self.verdicts = verdicts
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def regressions(self):
+        return int(np.count_nonzero(self.verdicts == REGRESSION))
+
+    def header(self):
+        return self.columns + ["key", self.identifier, "samples", "mean",
+                               "stddev", "cv_pct", "ci_low", "ci_high",
+                               "welch_p", "mannwhitney_p", "verdict"]
+
+    def rows(self):
+        """Yield every row as a flat list matching header()
+
+        Missing values are None.
+        """
+        def _value(value):
+            value = float(value)
+            return None if np.isnan(value) else value
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cvs = self.stddevs * 100 / np.abs(self.means)
+        for row, (path, metric) in enumerate(self.keys):
+            yield list(path) + [
+                metric, self.identifiers[row], int(self.counts[row]),
+                _value(self.means[row]), _value(self.stddevs[row]),
+                _value(cvs[row]), _value(self.ci_low[row]),
+                _value(self.ci_high[row]), _value(self.welch[row]),
+                _value(self.mannwhitney[row]), str(self.verdicts[row])]
+
+
+def summarize_records(records, sample_bucket, baseline, identifiers,
+                      thresholds, max_cv=10.0, alpha=0.05, resamples=2000,
+                      confidence=0.95, seed=0, directions=()):
+    """Aggregate the samples of a record set across sample_bucket
+
+    Args:
+      records (:obj:`RecordSet`): results of one compute map
+      sample_bucket (str): bucket whose values are samples of the same run
+      baseline (str): identifier the others are tested against
+      identifiers (list): every identifier of the run
+      thresholds (:obj:`Thresholds`): allowed change of the mean per metric
+      max_cv (float): coefficient of variation in percent above which a
+        run is too noisy to be judged
+      alpha (float): significance level of the Welch test
+      resamples (int): bootstrap resamples per sample
+      confidence (float): level of the bootstrap confidence interval
+      seed (int): seed of the bootstrap, so reruns agree
+      directions (list): (glob pattern, direction) pairs the compute map
+        declares, see :func:`~touchstone.analysis.regression.direction`
+
+    Returns:
+      :obj:`Statistics`, or None if sample_bucket is not a bucket of records
+    """
+    if sample_bucket not in records.columns:
+        return None
+    position = records.columns.index(sample_bucket)
+    columns = [column for column in records.columns
+               if column != sample_bucket]
+    order = {identifier: i for i, identifier in enumerate(identifiers)}
+    groups = {}
+    for path, metric, identifier, value in \
+            zip(records.paths, records.metrics, records.identifiers,
+                records.values):
+        key = (path[:position] + path[position + 1:], metric)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        groups.setdefault(key, {}).setdefault(identifier, []).append(value)
+    keys = []
+    row_identifiers = []
+    samples = []
+    for key, by_identifier in groups.items():
+        for identifier in sorted(by_identifier, key=order.get):
+            keys.append(key)
+            row_identifiers.append(identifier)
+            samples.append(by_identifier[identifier])
+    counts = np.array([len(sample) for sample in samples])
+    width = counts.max() if len(counts) else 0
+    padded = np.full((len(samples), width), np.nan)
+    for row, sample in enumerate(samples):
+        padded[row, :len(sample)] = sample
+    means = np.nanmean(padded, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variances = np.nansum((padded - means[:, None]) ** 2, axis=1) / \
+            (counts - 1)
+    variances = np.where(counts > 1, variances, np.nan)
+    stddevs = np.sqrt(variances)
+    boot = bootstrap_means(np.nan_to_num(padded), counts, resamples,
+                           np.random.default_rng(seed))
+    tail = (1 - confidence) / 2 * 100
+    ci_low, ci_high = np.percentile(boot, [tail, 100 - tail], axis=1)
+
+    # Every row is tested against the baseline row of the same key
+    base_row = {}
+    for row, (key, identifier) in enumerate(zip(keys, row_identifiers)):
+        if identifier == baseline:
+            base_row[key] = row
+    base = np.array([base_row.get(key, -1) for key in keys])
+    has_base = (base >= 0) & (np.array(row_identifiers) != baseline)
+    b = np.where(has_base, base, 0)
+    welch = np.where(has_base,
+                     welch_pvalues(means[b], variances[b], counts[b],
+                                   means, variances, counts), np.nan)
+    mannwhitney = np.full(len(keys), np.nan)
+    for row in np.flatnonzero(has_base & (counts > 1) & (counts[b] > 1)):
+        mannwhitney[row] = mannwhitney_pvalue(samples[b[row]], samples[row])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = (means - means[b]) * 100 / np.abs(means[b])
+        cv = stddevs * 100 / np.abs(means)
+    directions = metric_directions([metric for _, metric in keys],
+                                   directions)
+    limit = np.array([thresholds.threshold(metric) for _, metric in keys])
+    score = directions * percent
+    significant = welch < alpha
+    verdicts = np.select(
+        [np.array(row_identifiers) == baseline, ~has_base,
+         (counts < 2) | (counts[b] < 2), (cv > max_cv) | (cv[b] > max_cv),
+         significant & (score < -limit), significant & (score > limit),
+         significant & (directions == 0) & (np.abs(percent) > limit)],
+        [BASELINE, NO_MATCH, TOO_FEW_SAMPLES, NOISY, REGRESSION,
+         IMPROVEMENT, CHANGED], UNCHANGED)
+    return Statistics(columns, records.identifier, baseline, keys,
+                      row_identifiers, counts, means, stddevs, ci_low,
+                      ci_high, welch, mannwhitney, verdicts)
@@ -2,16 +2,38 @@ from importlib import import_module
 import logging
 import traceback
 
-from . base_benchmark import BenchmarkBaseClass ## noqa
+from . base_benchmark import BenchmarkBaseClass, SpecBenchmark ## noqa
+from . spec import SpecError, load_spec ## noqa
 
 
 _logger = logging.getLogger("touchstone")
 
+# Benchmarks touchstone ships, by name: (module, class). grab only imports
+# the module of the benchmark asked for. Their queries are described by the
+# spec files in specs/, any other spec file can be passed by path instead.
+BENCHMARKS = {
+    'uperf': ('uperf', 'Uperf'),
+    'ycsb': ('ycsb', 'Ycsb'),
+    'pgbench': ('pgbench', 'Pgbench'),
+    'vegeta': ('vegeta', 'Vegeta'),
+    'mb': ('mb', 'Mb'),
+    'kubeburner': ('kubeburner', 'Kubeburner'),
+}
+
+
+def is_spec_file(benchmark_input_type):
+    return benchmark_input_type.endswith('.json')
+
 
 def grab(benchmark_input_type, *args, **kwargs):
+    if is_spec_file(benchmark_input_type):
+        _logger.debug("Creating a benchmark instance from a spec file")
+        return SpecBenchmark(*args, spec_file=benchmark_input_type, **kwargs)
     try:
         _logger.debug("Grabbing the right benchmark instance")
-        if '.' in benchmark_input_type:
+        if benchmark_input_type in BENCHMARKS:
+            mod_name, class_name = BENCHMARKS[benchmark_input_type]
+        elif '.' in benchmark_input_type:
             mod_name, class_name = benchmark_input_type.rsplit('.', 1)
         else:
             mod_name = benchmark_input_type
@@ -1,6 +1,8 @@
 from abc import ABCMeta, abstractmethod
 import logging
 
+from .spec import load_spec, SpecError
+
 
 _logger = logging.getLogger("touchstone")
 
@@ -26,3 +28,70 @@ class BenchmarkBaseClass(metaclass=ABCMeta): # noqa
     @abstractmethod
     def emit_indices(self):
         pass
+
+
+class SpecBenchmark(BenchmarkBaseClass):
+    """A benchmark defined by a spec file, see :func:`load_spec`
+
+    Args:
+      source_type (str): database type the results are stored in
+      harness_type (str): harness that ran the benchmark
+      spec_file (str): path of the spec, defaults to the spec_file of the
+        class
+    """
+
+    spec_file = None
+
+    def _build_search(self):
+        _logger.debug("Building search array from {}".format(
+            self._spec_file))
+        try:
+            return self._search_dict[self._source_type][self._harness_type]
+        except KeyError:
+            raise SpecError("{} has no {} results for harness {}".format(
+                self._spec_file, self._source_type, self._harness_type))
+
+    def _build_search_metadata(self):
+        return self._search_dict[self._source_type].get("metadata", {})
+
+    def _build_compare_keys(self):
+        _logger.debug("Building compare map")
+        return {index: self._search_map[index]['compare']
+                for index in self._search_map}
+
+    def _build_compute(self):
+        _logger.debug("Building compute map")
+        return {index: self._search_map[index]['compute']
+                for index in self._search_map}
+
+    def __init__(self, source_type=None, harness_type=None, spec_file=None):
+        _logger.debug("Initializing {} instance".format(
+            type(self).__name__))
+        BenchmarkBaseClass.__init__(self, source_type=source_type,
+                                    harness_type=harness_type)
+        self._spec_file = spec_file or self.spec_file
+        self._search_dict = load_spec(self._spec_file)
+        self._search_map = self._build_search()
+        self._search_map_metadata = self._build_search_metadata()
+        self._compute_map = self._build_compute()
+        self._compare_map = self._build_compare_keys()
+        _logger.debug("Finished initializing {} instance".format(
+            type(self).__name__))
+
+    def emit_compute_map(self):
+        _logger.debug("Emitting built compute map ")
+        _logger.info("Compute map is {} in the database \
+                     {}".format(self._compute_map, self._source_type))
+        return self._compute_map
+
+    def emit_compare_map(self):
+        _logger.debug("Emitting built compare map ")
+        _logger.info("compare map is {} in the database \
+                     {}".format(self._compare_map, self._source_type))
+        return self._compare_map
+
+    def emit_indices(self):
+        return self._search_map.keys()
+
+    def emit_metadata_search_map(self):
+        return self._search_map_metadata
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+from functools import lru_cache
+
+
+_logger = logging.getLogger("touchstone")
+
+# Directory of the specs of the benchmarks touchstone ships
+SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'specs')
+
+# Percents elasticsearch computes when a percentiles aggregation names none
+DEFAULT_PERCENTS = [1, 5, 25, 50, 75, 95, 99]
+
+_COMPUTE_KEYS = {'filter', 'exclude', 'buckets', 'aggregations', 'collate',
+                 'lower_is_better', 'higher_is_better'}
+_REQUIRED_COMPUTE_KEYS = {'filter', 'buckets', 'aggregations'}
+
+
+class SpecError(ValueError):
+    """A benchmark spec is malformed"""
+
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(item, str)
+                                           for item in value)
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+def _check(condition, where, message):
+    if not condition:
+        raise SpecError("{}: {}".format(where, message))
+
+
+def _validate_aggregations(aggregations, where):
+    _check(isinstance(aggregations, dict), where,
+           "expected a dict of field to aggregation list")
+    for field, agg_list in aggregations.items():
+        _where = "{}.{}".format(where, field)
+        _check(isinstance(agg_list, list) and agg_list, _where,
+               "expected a non empty list of aggregations")
+        for position, aggs in enumerate(agg_list):
+            _agg_where = "{}[{}]".format(_where, position)
+            if isinstance(aggs, str):
+                continue
+            _check(isinstance(aggs, dict) and aggs, _agg_where,
+                   "expected an aggregation name or a dict of aggregation "
+                   "name to parameters")
+            for agg_type, params in aggs.items():
+                _check(isinstance(params, dict), _agg_where,
+                       "parameters of {} must be a dict".format(agg_type))
+                if 'percents' in params:
+                    _check(isinstance(params['percents'], list) and
+                           all(isinstance(percent, (int, float))
+                               for percent in params['percents']),
+                           _agg_where, "percents must be a list of numbers")
+
+
+def _validate_compute(compute, where):
+    _check(isinstance(compute, dict), where, "expected a dict")
+    unknown = set(compute) - _COMPUTE_KEYS
+    _check(not unknown, where, "unknown keys {}".format(sorted(unknown)))
+    missing = _REQUIRED_COMPUTE_KEYS - set(compute)
+    _check(not missing, where, "missing keys {}".format(sorted(missing)))
+    for key in ('filter', 'exclude'):
+        if key in compute:
+            _check(isinstance(compute[key], dict) and
+                   all(_is_scalar(value) for value in compute[key].values()),
+                   "{}.{}".format(where, key),
+                   "expected a dict of field to value")
+    _check(_is_str_list(compute['buckets']), where + ".buckets",
+           "expected a list of field names")
+    _validate_aggregations(compute['aggregations'], where + ".aggregations")
+    _check(_is_str_list(compute.get('collate', [])), where + ".collate",
+           "expected a list of field names")
+    for key in ('lower_is_better', 'higher_is_better'):
+        _check(_is_str_list(compute.get(key, [])),
+               "{}.{}".format(where, key),
+               "expected a list of value name patterns")
+
+
+def validate_spec(spec, where='spec'):
+    """Check a benchmark spec has the layout touchstone expects
+
+    A spec maps database type to harness to index, every index holding a
+    compare list and a list of compute dicts. The reserved harness metadata
+    maps metadata indices to their element and compare list.
+
+    Raises:
+      SpecError: naming the first malformed entry
+    """
+    _check(isinstance(spec, dict) and spec, where,
+           "expected a dict of database type to harnesses")
+    for source_type, harnesses in spec.items():
+        _where = "{}.{}".format(where, source_type)
+        _check(isinstance(harnesses, dict), _where,
+               "expected a dict of harness to indices")
+        for harness, indices in harnesses.items():
+            _harness_where = "{}.{}".format(_where, harness)
+            _check(isinstance(indices, dict), _harness_where,
+                   "expected a dict of index to search map")
+            for index, search_map in indices.items():
+                _index_where = "{}.{}".format(_harness_where, index)
+                _check(isinstance(search_map, dict), _index_where,
+                       "expected a dict")
+                _check(_is_str_list(search_map.get('compare')),
+                       _index_where + ".compare",
+                       "expected a list of field names")
+                if harness == 'metadata':
+                    _check(isinstance(search_map.get('element'), str),
+                           _index_where + ".element",
+                           "expected a field name")
+                    continue
+                _check(isinstance(search_map.get('compute'), list),
+                       _index_where + ".compute",
+                       "expected a list of compute dicts")
+                for position, compute in \
+                        enumerate(search_map['compute']):
+                    _validate_compute(compute, "{}.compute[{}]".format(
+                        _index_where, position))
+
+
+class QueryTemplate(dict):
+    """A compiled, read only compute map
+
+    Behaves like the compute dict it was compiled from, and additionally
+    carries what every database would otherwise derive from it per query.
+    Templates hash and compare by their JSON, so they can key
+    result caches and group the requests of a batch.
+
+    Attributes:
+      key (str): JSON of the compute map, in declaration order since
+        that is the order results come out in
+      bucket_fields (tuple): (bucket name, field) of every bucket
+      bucket_names (tuple): names results are bucketed under
+      metrics (tuple): (aggregation name, type, field, parameters) of every
+        aggregation, in declaration order
+      aggregation_names (tuple): names of the metrics
+      value_names (tuple): names of the values every bucket yields, one
+        per percent for percentiles, e.g. 90.0percentiles(norm_ltcy)
+      directions (tuple): (glob pattern, direction) of the value names
+        declared lower (-1) or higher (1) is better
+    """
+
+    def __init__(self, compute):
+        dict.__init__(self, compute)
+        self.key = json.dumps(compute)
+        self.bucket_fields = tuple((str(field.split('.')[0]), str(field))
+                                   for field in compute['buckets'])
+        self.bucket_names = tuple(name for name, _ in self.bucket_fields)
+        metrics = []
+        for field, agg_list in compute['aggregations'].items():
+            for aggs in agg_list:
+                if isinstance(aggs, str):
+                    aggs = {aggs: {}}
+                for agg_type, params in aggs.items():
+                    metrics.append(("{}({})".format(agg_type, field),
+                                    agg_type, field, params))
+        self.metrics = tuple(metrics)
+        self.aggregation_names = tuple(name for name, _, _, _ in metrics)
+        value_names = []
+        for name, agg_type, _, params in metrics:
+            if agg_type == 'percentiles':
+                value_names.extend("{}{}".format(float(percent), name)
+                                   for percent in
+                                   params.get('percents', DEFAULT_PERCENTS))
+            else:
+                value_names.append(name)
+        self.value_names = tuple(value_names)
+        self.directions = tuple(
+            [(pattern, -1) for pattern in compute.get('lower_is_better', [])] +
+            [(pattern, 1) for pattern in compute.get('higher_is_better', [])])
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        if isinstance(other, QueryTemplate):
+            return self.key == other.key
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        return QueryTemplate, (dict(self),)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("QueryTemplate is read only")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+# Compiled templates by key, so equal compute maps share one template
+_TEMPLATES = {}
+
+
+def compile_compute(compute):
+    """Compile a validated compute dict, once per distinct map
+
+    Returns:
+      :obj:`QueryTemplate`
+    """
+    if isinstance(compute, QueryTemplate):
+        return compute
+    key = json.dumps(compute)
+    if key not in _TEMPLATES:
+        _TEMPLATES[key] = QueryTemplate(compute)
+    return _TEMPLATES[key]
+
+
+def _compile(spec):
+    for harnesses in spec.values():
+        for harness, indices in harnesses.items():
+            if harness == 'metadata':
+                continue
+            for search_map in indices.values():
+                search_map['compute'] = [compile_compute(compute) for
+                                         compute in search_map['compute']]
+    return spec
+
+
+def spec_path(name):
+    """Path of the spec of a benchmark touchstone ships"""
+    return os.path.join(SPEC_DIR, name + '.json')
+
+
+@lru_cache(maxsize=64)
+def _load(path, version):
+    _logger.debug("Loading benchmark spec {}".format(path))
+    try:
+        with open(path) as spec_file:
+            spec = json.load(spec_file)
+    except ValueError as error:
+        raise SpecError("{}: {}".format(path, error))
+    validate_spec(spec, where=os.path.basename(path))
+    return _compile(spec)
+
+
+def load_spec(path):
+    """Load, validate and compile a benchmark spec file
+
+    Every compute dict is compiled into a :obj:`QueryTemplate`. Files are
+    loaded again only once their modification time or size changes, so a
+    long running daemon picks up edited specs.
+
+    Args:
+      path (str): path of a JSON spec file
+
+    Returns:
+      dict: {database type: {harness: {index: search map}}}
+
+    Raises:
+      SpecError: if the spec is malformed
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _load(path, (stat.st_mtime_ns, stat.st_size))
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 import argparse
+import os
+import signal
 import sys
+import time
+from functools import partial
 import logging
 import json
-import yaml
-from tabulate import tabulate
 
 from touchstone import __version__
 from . import benchmarks
 from . import databases
-from .utils.lib import print_metadata_dict, compare_dict, \
-    mergedicts, dfs_list_dict
+from . import writers
+from .analysis.history import HISTORY, Distribution, history_results
+from .utils import profile
+from .utils.lib import run_concurrently
+from .utils.records import RecordSet
 
 __author__ = "aakarshg"
 __copyright__ = "aakarshg"
@@ -19,16 +24,27 @@ __license__ = "mit"
 _logger = logging.getLogger("touchstone")
 
 
-def parse_args(args):
+def _metric_threshold(value):
+    pattern, _, threshold = value.rpartition('=')
+    try:
+        return pattern, float(threshold)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected PATTERN=PERCENT, got {}".format(value))
+
+
+def parse_args(args, parser_class=argparse.ArgumentParser):
     """Parse command line parameters
 
     Args:
       args ([str]): command line parameters as list of strings
+      parser_class (type): :obj:`argparse.ArgumentParser` or a subclass,
+        e.g. one raising instead of exiting on errors
 
     Returns:
       :obj:`argparse.Namespace`: command line parameters namespace
     """
-    parser = argparse.ArgumentParser(
+    parser = parser_class(
         description="compare results from benchmarks")
     parser.add_argument(
         "--version",
@@ -36,15 +52,15 @@ def parse_args(args):
         version="touchstone {ver}".format(ver=__version__))
     parser.add_argument(
         dest="benchmark",
-        help="which type of benchmark to compare",
+        help="which type of benchmark to compare, one of {} or the path of "
+             "a JSON benchmark spec".format(", ".join(benchmarks.BENCHMARKS)),
         type=str,
-        choices=['uperf', 'ycsb', 'pgbench', 'vegeta', 'mb', 'kubeburner'],
         metavar="benchmark")
     parser.add_argument(
         dest="database",
         help="the type of database data is stored in",
         type=str,
-        choices=['elasticsearch'],
+        choices=list(databases.DATABASES),
         metavar="database")
     parser.add_argument(
         dest="harness",
@@ -68,18 +84,19 @@ def parse_args(args):
     parser.add_argument(
         '-o', '--output',
         dest="output",
-        help="How should touchstone output the result",
+        help="How should touchstone output the result, json is written as "
+             "one record per line and yaml as a stream of documents",
         type=str,
         choices=['json', 'yaml', 'csv'])
     parser.add_argument(
         '-input-file',
         dest="input_file",
         help="Input config file for metadata",
-        type=argparse.FileType('r', encoding='utf-8'))
+        type=str)
     parser.add_argument(
         '-output-file',
         dest="output_file",
-        help="Redirect output of json/csv/yaml to file",
+        help="Redirect output to file",
         type=argparse.FileType('w'))
     parser.add_argument(
         '-url', '--connection-url',
@@ -87,6 +104,172 @@ def parse_args(args):
         help="the database connection strings in the same order as the uuids",
         type=str,
         nargs='+')
+    parser.add_argument(
+        '--pool-size',
+        dest="pool_size",
+        help="connections kept alive per database url(default: 10)",
+        type=int,
+        default=10)
+    parser.add_argument(
+        '-j', '--jobs',
+        dest="jobs",
+        help="number of queries to run concurrently(default: 1)",
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--group-identifiers',
+        dest="group_identifiers",
+        help="fetch all identifiers of a compute map in one query, "
+             "bucketed by identifier on the database",
+        action="store_true")
+    parser.add_argument(
+        '--no-cache',
+        dest="no_cache",
+        help="neither read nor store results in the local result cache",
+        action="store_true")
+    parser.add_argument(
+        '--refresh',
+        dest="refresh",
+        help="query the database again and refresh the local result cache",
+        action="store_true")
+    parser.add_argument(
+        '--comparison',
+        dest="comparison",
+        help="keep the results and identifiers of this comparison in a "
+             "file, later runs adding identifiers with -u only query those",
+        type=str,
+        metavar="path")
+    parser.add_argument(
+        '--baseline',
+        dest="baseline",
+        help="identifier the others are compared against, exits non-zero "
+             "when any of them regressed",
+        type=str)
+    parser.add_argument(
+        '--threshold',
+        dest="threshold",
+        help="change in percent tolerated before a metric counts as "
+             "regressed(default: 5.0)",
+        type=float,
+        default=5.0)
+    parser.add_argument(
+        '--metric-threshold',
+        dest="metric_thresholds",
+        help="threshold of the metrics matching a glob pattern, e.g. "
+             "'*ltcy*=10', can be repeated",
+        type=_metric_threshold,
+        action="append",
+        default=[])
+    parser.add_argument(
+        '--changed-only',
+        dest="changed_only",
+        help="have the database compare every identifier against the "
+             "baseline and only fetch the buckets where a metric changed "
+             "past its threshold",
+        action="store_true")
+    parser.add_argument(
+        '--raw-samples',
+        dest="raw_samples",
+        help="stream every matching document and aggregate it locally, "
+             "for exact percentiles instead of elasticsearch's estimates",
+        action="store_true")
+    parser.add_argument(
+        '--sample-chunk-size',
+        dest="sample_chunk_size",
+        help="documents fetched per round trip with --raw-samples"
+             "(default: 5000)",
+        type=int,
+        default=5000)
+    parser.add_argument(
+        '--history',
+        dest="history",
+        help="compare against the distribution of this many most recent "
+             "runs whose compare fields match the first identifier's",
+        type=int)
+    parser.add_argument(
+        '--history-fields',
+        dest="history_fields",
+        help="compare fields historical runs have to match(default: all "
+             "of them but uuid and the identifier)",
+        type=str,
+        nargs='+')
+    parser.add_argument(
+        '--history-timestamp',
+        dest="history_timestamp",
+        help="field telling which runs are the most recent, and for "
+             "--watch which are new(default: timestamp)",
+        type=str,
+        default="timestamp")
+    parser.add_argument(
+        '--statistics',
+        dest="statistics",
+        help="summarize the samples of every identifier across the sample "
+             "bucket and test them against the baseline",
+        action="store_true")
+    parser.add_argument(
+        '--sample-bucket',
+        dest="sample_bucket",
+        help="bucket whose values are repeated samples of a run"
+             "(default: iteration)",
+        type=str,
+        default="iteration")
+    parser.add_argument(
+        '--max-cv',
+        dest="max_cv",
+        help="coefficient of variation in percent above which a run is "
+             "reported as noisy(default: 10.0)",
+        type=float,
+        default=10.0)
+    parser.add_argument(
+        '--alpha',
+        dest="alpha",
+        help="significance level of the Welch test(default: 0.05)",
+        type=float,
+        default=0.05)
+    parser.add_argument(
+        '--bootstrap',
+        dest="bootstrap",
+        help="resamples drawn for the confidence intervals(default: 2000)",
+        type=int,
+        default=2000)
+    parser.add_argument(
+        '--watch',
+        dest="watch",
+        help="keep polling the benchmark's indices and compare every new "
+             "run against the baselines once its documents stop changing, "
+             "written as json records each closed by a verdict record",
+        action="store_true")
+    parser.add_argument(
+        '--watch-interval',
+        dest="watch_interval",
+        help="seconds between two polls of --watch(default: 60)",
+        type=float,
+        default=60.0)
+    parser.add_argument(
+        '--server',
+        dest="server",
+        help="forward the comparison to a running touchstone serve daemon, "
+             "comparing here when none answers",
+        action="store_true")
+    parser.add_argument(
+        '--server-address',
+        dest="server_address",
+        help="unix socket path or http://127.0.0.1:PORT url of the daemon"
+             "(default: its default socket)",
+        type=str)
+    parser.add_argument(
+        '--profile',
+        dest="profile",
+        help="time database queries and the stages of the run, and print "
+             "a summary to stderr",
+        action="store_true")
+    parser.add_argument(
+        '--profile-trace',
+        dest="profile_trace",
+        help="also write the profile to this file as a Chrome trace, to "
+             "be opened in chrome://tracing or Perfetto",
+        type=str,
+        metavar="path")
     parser.add_argument(
         "-v",
         "--verbose",
@@ -101,7 +284,63 @@ def parse_args(args):
         help="set loglevel to DEBUG",
         action="store_const",
         const=logging.DEBUG)
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+    if benchmarks.is_spec_file(args.benchmark):
+        try:
+            benchmarks.load_spec(args.benchmark)
+        except (OSError, benchmarks.SpecError) as error:
+            parser.error(str(error))
+    elif args.benchmark not in benchmarks.BENCHMARKS:
+        parser.error("unknown benchmark {}, expected one of {} or a JSON "
+                     "spec file".format(args.benchmark,
+                                        ", ".join(benchmarks.BENCHMARKS)))
+    if args.input_file not in (None, '-') and \
+            not os.path.isfile(args.input_file):
+        parser.error("can't open input file {}".format(args.input_file))
+    for feature, supported in databases.FEATURES.items():
+        if getattr(args, feature) and args.database not in supported:
+            parser.error("--{} is not available with the {} database".format(
+                feature.replace('_', '-'), args.database))
+    if args.history and not args.baseline:
+        args.baseline = HISTORY
+    if args.profile_trace:
+        args.profile = True
+    if args.raw_samples and (args.changed_only or args.group_identifiers):
+        parser.error("--raw-samples cannot be combined with --changed-only "
+                     "or --group-identifiers")
+    if args.changed_only:
+        if args.history or args.statistics:
+            parser.error("--changed-only cannot be combined with --history "
+                         "or --statistics")
+        if not args.baseline:
+            parser.error("--changed-only needs a --baseline")
+        if len(set(args.conn_url or [])) > 1:
+            parser.error("--changed-only needs every identifier in the "
+                         "same database")
+    if args.server and (args.watch or args.profile or args.comparison):
+        parser.error("--server cannot be combined with --watch, --profile "
+                     "or --comparison")
+    if args.comparison:
+        if args.watch:
+            parser.error("--comparison cannot be combined with --watch")
+        # The identifiers and baseline may come from the stored comparison
+        args.uuid = args.uuid or []
+        return args
+    if args.watch:
+        if not args.baseline:
+            parser.error("--watch needs a --baseline or --history")
+        if args.output not in (None, 'json'):
+            parser.error("--watch only writes json records")
+        args.output = 'json'
+        # With --history every new run is compared on its own
+        args.uuid = args.uuid or []
+    elif not args.uuid:
+        parser.error("no identifiers to compare, give them with -u")
+    if args.baseline and args.baseline not in args.uuid and \
+            not (args.history and args.baseline == HISTORY):
+        parser.error("baseline {} is not one of the compared "
+                     "identifiers".format(args.baseline))
+    return args
 
 
 def setup_logging(loglevel):
@@ -111,7 +350,7 @@ def setup_logging(loglevel):
       loglevel (int): minimum loglevel for emitting messages
     """
     logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
-    logging.basicConfig(level=loglevel, stream=sys.stdout,
+    logging.basicConfig(level=loglevel, stream=sys.stderr,
                         format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
 
 
@@ -125,87 +364,310 @@ def update(dict1, dict2):
     return copy
 
 
-def main(args):
-    """Main entry point allowing external calls
+def collapse_metadata(metadata):
+    """Fold the elements (e.g. pods) whose metadata is identical into one
 
     Args:
-      args ([str]): command line parameter list
+      metadata (dict): {where: {field: value}}
+
+    Returns:
+      dict: {where: {field: value, 'count': elements}}, where being the
+        first of the elements sharing the fields, elements without any
+        metadata left out
     """
-    args = parse_args(args)
-    setup_logging(args.loglevel)
-    print_csv = False
-    csv_header_metadata = "uuid, where, field, value"
-    metadata_json = dict()
-    main_json = dict()
-    compare_uuid_dict_metadata = dict()
-    compare_header_footer = "{}{}".format(("=" * 89), ("=" * 89))
-    compare_output = compare_header_footer
+    collapsed = {}
+    fingerprints = {}
+    for where, fields in metadata.items():
+        if not fields:
+            continue
+        fingerprint = json.dumps(sorted(fields.items()), default=str)
+        if fingerprint in fingerprints:
+            collapsed[fingerprints[fingerprint]]['count'] += 1
+        else:
+            fingerprints[fingerprint] = where
+            collapsed[where] = dict(fields, count=1)
+    return collapsed
+
+
+def _profiled(stage, index, requests, task):
+    with profile.span(stage, 'batch', index=index, requests=len(requests)):
+        return task()
+
+
+def _metadata_batch(database, conn_url, requests):
+    database_instance = databases.grab(database, conn_url=conn_url)
+    return database_instance.emit_compare_metadata_dicts(requests)
+
+
+def _compare_batch(database, conn_url, identifier, requests):
+    database_instance = databases.grab(database, conn_url=conn_url)
+    return database_instance.emit_compare_dicts(requests,
+                                                identifier=identifier)
+
+
+def _compute_batch(database, conn_url, identifier, group_identifiers,
+                   requests):
+    database_instance = databases.grab(database, conn_url=conn_url)
+    return database_instance.emit_compute_dicts(requests,
+                                                identifier=identifier,
+                                                group_identifiers=group_identifiers) # noqa
+
+
+def _samples_batch(database, conn_url, identifier, chunk_size, requests):
+    database_instance = databases.grab(database, conn_url=conn_url)
+    return database_instance.emit_sample_dicts(requests,
+                                               identifier=identifier,
+                                               chunk_size=chunk_size)
+
+
+def _changed_batch(database, conn_url, identifier, baseline, threshold,
+                   requests):
+    database_instance = databases.grab(database, conn_url=conn_url)
+    return database_instance.emit_changed_dicts(requests, baseline,
+                                                threshold,
+                                                identifier=identifier)
+
+
+def fetch_history(args, database_instance, benchmark_instance, index,
+                  compare_uuid_dict):
+    """Select the historical runs of an index and compute the distribution
+    of their metrics
+
+    Runs are selected by the values of the first identifier's compare
+    fields, the identifiers being compared are never part of the history.
+
+    Returns:
+      dict: (distribution :obj:`ComputeResult`, runs) per compute map
+        position, empty when no run matched
+    """
+    candidate = args.uuid[0]
+    fields = args.history_fields or \
+        [key for key in benchmark_instance.emit_compare_map()[index]
+         if key not in ('uuid', args.identifier)]
+    match = {}
+    for field in fields:
+        value = compare_uuid_dict.get(field, {}).get(candidate)
+        if value is not None:
+            match[field] = value
+    runs = database_instance.emit_history_identifiers(
+        index, match, identifier=args.identifier, exclude=args.uuid,
+        size=args.history, timestamp=args.history_timestamp)
+    if not runs:
+        _logger.warning("No historical runs of {} match {}".format(
+            index, match))
+        return {}
+    _logger.info("Historical baseline of {}: {}".format(index,
+                                                        ", ".join(runs)))
+    compute_maps = benchmark_instance.emit_compute_map()[index]
+    distributions = database_instance.emit_history_dicts(
+        [(index, compute) for compute in compute_maps], runs,
+        identifier=args.identifier)
+    return {compute_index: (distribution, runs)
+            for compute_index, distribution in enumerate(distributions)}
+
+
+def plan_queries(args, benchmark_instance, metadata_search_map, cache=None):
+    """Plan every database query of a compare run
+
+    Queries are batched per stage, index and connection url so that each
+    batch costs the database a single round trip.
+
+    Args:
+      args (:obj:`argparse.Namespace`): parsed command line parameters
+      benchmark_instance: benchmark the queries are built for
+      metadata_search_map (dict): metadata indices and their compare map
+      cache (:obj:`ResultCache`): cache consulted before querying, if any
+
+    Returns:
+      list: (keys, callable) pairs, the callable runs one batch and returns
+        a result per key, a key being (stage, index, compute position,
+        uuid position)
+    """
+    batches = {}
+    for uuid_index, uuid in enumerate(args.uuid):
+        conn_url = args.conn_url[uuid_index]
+        for index in metadata_search_map.keys():
+            keys, requests = batches.setdefault(('metadata', None, conn_url),
+                                                ([], []))
+            keys.append(('metadata', index, None, uuid_index))
+            requests.append((index, uuid, metadata_search_map[index]))
+    compare_map = benchmark_instance.emit_compare_map()
+    compute_map = benchmark_instance.emit_compute_map()
+    for index in benchmark_instance.emit_indices():
+        for uuid_index, uuid in enumerate(args.uuid):
+            conn_url = args.conn_url[uuid_index]
+            keys, requests = batches.setdefault(('compare', index, conn_url),
+                                                ([], []))
+            keys.append(('compare', index, None, uuid_index))
+            requests.append((index, uuid, compare_map))
+        for compute_index, compute in enumerate(compute_map[index]):
+            for uuid_index, uuid in enumerate(args.uuid):
+                conn_url = args.conn_url[uuid_index]
+                keys, requests = \
+                    batches.setdefault(('compute', index, conn_url), ([], []))
+                keys.append(('compute', index, compute_index, uuid_index))
+                requests.append((index, uuid, compute))
+    if args.changed_only:
+        from .analysis.regression import Thresholds
+        threshold = Thresholds(args.threshold,
+                               args.metric_thresholds).threshold
+    query_plan = []
+    for (stage, index, conn_url), (keys, requests) in batches.items():
+        identifier = args.identifier
+        if stage == 'metadata':
+            # metadata is always looked up by uuid
+            identifier = 'uuid'
+            run_batch = partial(_metadata_batch, args.database, conn_url)
+        elif stage == 'compare':
+            run_batch = partial(_compare_batch, args.database, conn_url,
+                                identifier)
+        elif args.changed_only:
+            run_batch = partial(_changed_batch, args.database, conn_url,
+                                identifier, args.baseline, threshold)
+        elif args.raw_samples:
+            run_batch = partial(_samples_batch, args.database, conn_url,
+                                identifier, args.sample_chunk_size)
+        else:
+            run_batch = partial(_compute_batch, args.database, conn_url,
+                                identifier, args.group_identifiers)
+        # What changed depends on every identifier of the batch, which the
+        # cache does not key on
+        if cache and not (stage == 'compute' and args.changed_only):
+            # Exact aggregations are cached apart from elasticsearch's
+            kind = 'samples' if stage == 'compute' and args.raw_samples \
+                else stage
+            task = partial(cache.fetch, kind, conn_url, identifier, requests,
+                           run_batch)
+        else:
+            task = partial(run_batch, requests)
+        if profile.enabled():
+            task = partial(_profiled, stage, index, requests, task)
+        query_plan.append((keys, task))
+    return query_plan
+
+
+def extend_comparison(args, store):
+    """Put the identifiers of a stored comparison in front of the new ones
+
+    Their connection urls and the baseline are taken from the store too,
+    unless given again.
+
+    Raises:
+      ValueError: if the stored comparison is of another benchmark,
+        database, harness or identifier key, or lacks a url or baseline
+    """
+    settings = store.settings()
+    for name in ('benchmark', 'database', 'harness', 'identifier'):
+        if settings.get(name, getattr(args, name)) != getattr(args, name):
+            raise ValueError("{} compares {} {}, not {}".format(
+                args.comparison, name, settings[name],
+                getattr(args, name)))
+    stored = dict(zip(settings.get('uuid', []),
+                      settings.get('conn_url', [])))
+    new = [uuid for uuid in args.uuid if uuid not in stored]
+    conn_urls = args.conn_url or settings.get('conn_url', [])[:1]
+    if new and not conn_urls:
+        raise ValueError("no -url for {}".format(", ".join(new)))
+    if new and len(conn_urls) < len(new):
+        conn_urls = [conn_urls[0]] * len(new)
+    args.uuid = list(stored) + new
+    args.conn_url = list(stored.values()) + conn_urls[:len(new)]
+    if not args.uuid:
+        raise ValueError("{} holds no identifiers yet, give them with "
+                         "-u".format(args.comparison))
+    args.baseline = args.baseline or settings.get('baseline')
+    if args.baseline and args.baseline not in args.uuid and \
+            not (args.history and args.baseline == HISTORY):
+        raise ValueError("baseline {} is not one of the compared "
+                         "identifiers".format(args.baseline))
+    if new:
+        _logger.info("Adding {} to {}".format(", ".join(new),
+                                              args.comparison))
+
+
+def save_comparison(args, store):
+    store.save({'benchmark': args.benchmark, 'database': args.database,
+                'harness': args.harness, 'identifier': args.identifier,
+                'uuid': args.uuid, 'conn_url': args.conn_url,
+                'baseline': args.baseline})
+
+
+def prepare(args):
+    """Instantiate what a comparison runs on from its parsed arguments
+
+    Returns:
+      tuple: (database instance, benchmark instance, metadata search map)
+    """
+    if len(args.conn_url) < len(args.uuid):
+        args.conn_url = [args.conn_url[0]] * len(args.uuid)
+    database_instance = databases.grab(args.database,
+                                       conn_url=args.conn_url[0])
     _logger.debug("Instantiating the benchmark instance")
     benchmark_instance = benchmarks.grab(args.benchmark,
-                                         source_type=args.database,
+                                         source_type=database_instance.source_type or args.database, # noqa
                                          harness_type=args.harness)
-    if len(args.conn_url) < len(args.uuid):
-        args.conn_url = [args.conn_url[0]] * len(args.uuid)
-    if args.output == "csv":
-        print_csv = True
-        printed_header = False
-        printed_csv_header = False
-    if args.input_file:
-        config_file_metadata = json.load(args.input_file)
-    if args.output_file:
-        output_file = args.output_file
+    # Set metadata search map based on existence of config file
+    if args.input_file == '-':
+        metadata_search_map = json.load(sys.stdin)["metadata"]
+    elif args.input_file:
+        with open(args.input_file, encoding='utf-8') as input_file:
+            metadata_search_map = json.load(input_file)["metadata"]
     else:
-        output_file = sys.stdout
+        metadata_search_map = benchmark_instance.emit_metadata_search_map()
+    return database_instance, benchmark_instance, metadata_search_map
+
+
+def _identifiers(args):
+    identifiers = list(args.uuid)
+    if args.history:
+        identifiers.append(HISTORY)
+    return identifiers
+
+
+def run_comparison(args, database_instance, benchmark_instance,
+                   metadata_search_map, writer, cache=None):
+    """Fetch the results of every identifier and hand them to the writer,
+    compared against the baseline if any
+
+    Returns:
+      int: number of metrics that regressed against the baseline
+    """
+    identifiers = _identifiers(args)
+    with profile.span('plan'):
+        query_plan = plan_queries(args, benchmark_instance,
+                                  metadata_search_map, cache)
+    # Batches run in plan order, each result is handed to the writer and
+    # dropped as soon as the index or compute spec it belongs to is complete
+    batches = zip([keys for keys, _ in query_plan],
+                  run_concurrently([task for _, task in query_plan],
+                                   args.jobs))
+    results = {}
+    regressions = 0
+    if args.baseline or args.statistics:
+        # numpy is only imported when results are analysed
+        from .analysis.regression import Thresholds, compare_records
+        from .analysis.statistics import summarize_records
+        thresholds = Thresholds(args.threshold, args.metric_thresholds)
+
+    def _result(key):
+        with profile.span('fetch', stage=key[0]):
+            while key not in results:
+                keys, batch_results = next(batches)
+                results.update(zip(keys, batch_results))
+            return results.pop(key)
+
     # Indices from metadata map
     for uuid_index, uuid in enumerate(args.uuid):
-        super_header = "\n{} UUID: {} {}".format(("=" * 67), uuid, ("=" * 67))
-        compare_uuid_dict_metadata[uuid] = {}
-        # Create database connection instance
-        database_instance = databases.grab(args.database,
-                                           conn_url=args.conn_url[uuid_index])
-        # Set metadata search map based on existence of config file
-        if args.input_file:
-            metadata_search_map = config_file_metadata["metadata"]
-        else:
-            metadata_search_map = benchmark_instance.emit_metadata_search_map()
         index_dict = {}
         for index in metadata_search_map.keys():
-            tmp_dict = {}
-            # Adding emit_compare_metadata_dict to elasticsearch class
-            database_instance.emit_compare_metadata_dict(uuid=uuid,
-            compare_map=metadata_search_map[index],
-                        index=index,
-                        input_dict=tmp_dict)  # noqa
-            compare_uuid_dict_metadata[uuid] = tmp_dict
+            tmp_dict = _result(('metadata', index, None, uuid_index))
             index_dict = update(tmp_dict, index_dict)
-        stockpile_metadata = {}
-        stockpile_metadata["where"] = []
-        for where in index_dict.keys():
-            # Skip if there is no associated metadata
-            if not index_dict[where].items():
-                continue
-            stockpile_metadata["where"].append(where)
-            for k, v in index_dict[where].items():
-                if k not in stockpile_metadata:
-                    stockpile_metadata[k] = []
-                stockpile_metadata[k].append(v)
+        # Pods of a cluster mostly run on identical hardware
+        index_dict = collapse_metadata(index_dict)
         # Check that metadata exists to be printed
-        if stockpile_metadata["where"]:
-            if args.output not in ["json", "yaml", "csv"]:
-                print(super_header)
-                print(tabulate(stockpile_metadata,
-                               headers="keys", tablefmt="pretty"))
-            elif args.output in ["csv"]:
-                # Print to output file if argument present
-                if not printed_csv_header:
-                    output_file.write(csv_header_metadata + "\n")
-                    printed_csv_header = True
-                print_metadata_dict(uuid, compare_uuid_dict_metadata[uuid],
-                                    output_file)
-            elif args.output in ["json", "yaml"]:
-                metadata_json = dict(mergedicts(
-                                     metadata_json,
-                                     compare_uuid_dict_metadata))
+        if index_dict:
+            with profile.span('write', 'output'):
+                writer.write_metadata(uuid, index_dict)
 
     # Indices from entered harness (ex: ripsaw)
     for index in benchmark_instance.emit_indices():
@@ -213,105 +675,217 @@ def main(args):
         for key in benchmark_instance.emit_compare_map()[index]:
             compare_uuid_dict[key] = {}
         for uuid_index, uuid in enumerate(args.uuid):
-            # Create database connection instance
-            database_instance = \
-                databases.grab(args.database,
-                               conn_url=args.conn_url[uuid_index])
-            # Add method emit_compare_dict to the elasticsearch class
-            compare_uuid_dict = \
-                database_instance.emit_compare_dict(uuid=uuid,
-                                                    compare_map=benchmark_instance.emit_compare_map(), # noqa
-                                                    index=index,
-                                                    input_dict=compare_uuid_dict, # noqa
-                                                    identifier=args.identifier)
-        compute_uuid_dict = {}
-        for compute in benchmark_instance.emit_compute_map()[index]:
-            current_compute_dict = {}
-            compute_aggs_set = []
+            for key, value in _result(('compare', index, None,
+                                       uuid_index)).items():
+                compare_uuid_dict[key].update(value)
+        with profile.span('write', 'output'):
+            writer.write_compare(index, compare_uuid_dict)
+        history = {}
+        if args.history:
+            with profile.span('history', index=index):
+                history = fetch_history(args, database_instance,
+                                        benchmark_instance, index,
+                                        compare_uuid_dict)
+        for compute_index, compute in \
+                enumerate(benchmark_instance.emit_compute_map()[index]):
+            compute_results = []
             for uuid_index, uuid in enumerate(args.uuid):
-                # Create database connection instance
-                database_instance = \
-                    databases.grab(args.database,
-                                   conn_url=args.conn_url[uuid_index])
-                # Add method emit_compute_dict to the elasticsearch class
-                catch = \
-                    database_instance.emit_compute_dict(uuid=uuid,
-                                                        compute_map=compute, # noqa
-                                                        index=index,
-                                                        input_dict=compute_uuid_dict, # noqa
-                                                        identifier=args.identifier) # noqa
-                if catch != {}:
-                    current_compute_dict = \
-                        dfs_list_dict(list(compute['filter'].items()),
-                                      compute_uuid_dict,
-                                      len(compute['filter']), catch)
-                    compute_uuid_dict = \
-                        dict(mergedicts(compute_uuid_dict, current_compute_dict)) # noqa
-                    compute_aggs_set = \
-                        compute_aggs_set + database_instance._aggs_list
-                    compute_uuid_dict = \
-                        dict(mergedicts(compute_uuid_dict, catch))
-            compute_aggs_set = set(compute_aggs_set)
-            compute_buckets = database_instance._bucket_list
-        if args.output in ["json", "yaml"]:
-            main_json = dict(mergedicts(main_json, compute_uuid_dict))
-        else:
-            # Stdout
-            for key in benchmark_instance.emit_compare_map()[index]:
-                _message = "{:50} |".format(key)
-                for uuid in args.uuid:
-                    _message += \
-                        " {0:<60} |".format(compare_uuid_dict[key][uuid])
-                compare_output += "\n{}".format(_message)
-            for compute in benchmark_instance.emit_compute_map()[index]:
-                # If not csv, format bucket header
-                if not print_csv:
-                    _compute_header = "{:50} |".format("bucket_name")
-                    _compute_value = "{:50} |".format("bucket_value")
+                result = _result(('compute', index, compute_index,
+                                  uuid_index))
+                if result.values:
+                    compute_results.append(result.values)
+            with profile.span('records', index=index) as stats:
+                distribution, runs = history.get(compute_index, (None, None))
+                if distribution is not None and distribution.values:
+                    compute_results.append(
+                        history_results(distribution.values,
+                                        distribution.buckets))
                 else:
-                    _compute_header = ""
-                    _compute_value = ""
-                # Format filter output with values in compute map
-                for key, value in compute['filter'].items():
-                    if not print_csv:
-                        _compute_header += " {:20} |".format(key)
-                        _compute_value += " {:20} |".format(value)
-                    else:
-                        _compute_header += "{}, ".format(key)
-                        _compute_value += "{}, ".format(value)
-                # If csv, gather values from buckets in compute map
-                if print_csv:
-                    for key in compute_buckets:
-                        _compute_header += "{}, ".format(key)
-                    _compute_header += "key, {}, value".format(args.identifier)
-                    if not printed_header:
-                        output_file.write(_compute_header + "\n")
-                        printed_header = True
-                compare_dict(compute_uuid_dict, args.identifier,
-                             compute_aggs_set, _compute_value,
-                             compute_buckets, args.uuid, _compute_header,
-                             max_level=2 * len(compute_buckets),
-                             output_file=output_file, csv=print_csv)
-    if args.output == "json":
-        if metadata_json:
-            output_file.write(json.dumps(metadata_json, indent=4))
-        output_file.write(json.dumps(main_json, indent=4))
-    elif args.output == "yaml":
-        if metadata_json:
-            output_file.write(yaml.dump(metadata_json, allow_unicode=True))
-        output_file.write(yaml.dump(main_json, allow_unicode=True))
-    elif args.output == "csv":
-        pass
+                    distribution = None
+                records = RecordSet.from_results(compute, result.buckets,
+                                                 args.identifier,
+                                                 compute_results, identifiers)
+                if stats is not None:
+                    stats['records'] = len(records)
+            if records:
+                with profile.span('write', 'output'):
+                    writer.write_compute(index, compute, records)
+                    if distribution:
+                        writer.write_distribution(
+                            index, compute,
+                            Distribution.from_results(compute,
+                                                      distribution.buckets,
+                                                      distribution.values,
+                                                      runs))
+                comparison = None
+                with profile.span('analysis', index=index):
+                    if args.statistics:
+                        comparison = summarize_records(
+                            records, args.sample_bucket,
+                            args.baseline or args.uuid[0], identifiers,
+                            thresholds, max_cv=args.max_cv, alpha=args.alpha,
+                            resamples=args.bootstrap,
+                            directions=compute.directions)
+                    if comparison is None and args.baseline:
+                        comparison = compare_records(
+                            records, args.baseline, identifiers, thresholds,
+                            directions=compute.directions)
+                if comparison is not None:
+                    if args.baseline:
+                        regressions += comparison.regressions
+                    with profile.span('write', 'output'):
+                        writer.write_comparison(index, compute, comparison)
+    return regressions
+
+
+def watch(args, database_instance, benchmark_instance, metadata_search_map,
+          cache=None):
+    """Compare every new run against the baselines until interrupted
+
+    The indices of the benchmark are polled for runs with documents at or
+    after a cursor. A run is compared once none of its documents were
+    indexed between two polls, and again should more of them show up,
+    each comparison closed by a verdict record. Runs indexed before the
+    watch started are left alone.
+    """
+    indices = benchmark_instance.emit_indices()
+    baselines = list(args.uuid)
+    conn_urls = list(args.conn_url[:len(baselines)])
+
+    def poll(since):
+        with profile.span('poll'):
+            return database_instance.emit_new_identifiers(
+                indices, since=since, identifier=args.identifier,
+                exclude=baselines, timestamp=args.history_timestamp)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    cursor, _ = poll(None)
+    compared = dict(poll(cursor)[1]) if cursor is not None else {}
+    pending = {}
+    _logger.info("Watching {} for new runs every {} seconds".format(
+        ", ".join(indices), args.watch_interval))
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            latest, runs = poll(cursor)
+            for run, run_latest in runs:
+                if compared.get(run) == run_latest:
+                    continue
+                if pending.get(run) != run_latest:
+                    # Still being indexed
+                    pending[run] = run_latest
+                    continue
+                del pending[run]
+                compared[run] = run_latest
+                _logger.info("Comparing new run {}".format(run))
+                run_args = argparse.Namespace(**vars(args))
+                run_args.uuid = baselines + [run]
+                run_args.conn_url = conn_urls + [args.conn_url[0]]
+                writer = writers.grab('json', output_file=args.output_file,
+                                      identifier=args.identifier,
+                                      uuids=_identifiers(run_args))
+                regressions = run_comparison(run_args, database_instance,
+                                             benchmark_instance,
+                                             metadata_search_map, writer,
+                                             cache)
+                writer.write_verdict(run, args.baseline, regressions)
+                writer.close()
+            # The cursor never moves past a run still being indexed
+            if pending:
+                cursor = min(pending.values())
+            elif latest is not None:
+                cursor = latest
+            compared = {run: run_latest for run, run_latest
+                        in compared.items() if run_latest >= cursor}
+    except KeyboardInterrupt:
+        _logger.info("Stopped watching")
+
+
+def main(args):
+    """Main entry point allowing external calls
+
+    Args:
+      args ([str]): command line parameter list
+
+    Returns:
+      int: 1 if a baseline was given and any metric regressed, else 0
+    """
+    argv = list(args)
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    if args.server:
+        from .serve import forward
+        returncode = forward(args, argv)
+        if returncode is not None:
+            return returncode
+    profiler = profile.enable() if args.profile else None
+    with profile.span('setup'):
+        store = None
+        if args.comparison:
+            from .databases.cache import ComparisonStore
+            store = ComparisonStore(args.comparison, refresh=args.refresh)
+            try:
+                extend_comparison(args, store)
+            except ValueError as error:
+                _logger.error(error)
+                store.close()
+                return 2
+        # Every worker may hold a connection, size the pools accordingly
+        databases.configure_clients(pool_size=max(args.pool_size, args.jobs))
+        database_instance, benchmark_instance, metadata_search_map = \
+            prepare(args)
+        writer = None
+        if not args.watch:
+            writer = writers.grab(args.output or "table",
+                                  output_file=args.output_file,
+                                  identifier=args.identifier,
+                                  uuids=_identifiers(args))
+        cache = None
+        if not args.no_cache and database_instance.cache_results:
+            from .databases.cache import ResultCache
+            cache = ResultCache(refresh=args.refresh)
+        if args.watch:
+            # Baseline results are fetched once for every run compared
+            from .databases.cache import MemoryCache
+            cache = MemoryCache(args.uuid, cache)
+        if store:
+            store.cache = cache
+            cache = store
+    regressions = 0
+    if args.watch:
+        watch(args, database_instance, benchmark_instance,
+              metadata_search_map, cache)
     else:
-        compare_output += "\n" + compare_header_footer
-        print(compare_output)
+        regressions = run_comparison(args, database_instance,
+                                     benchmark_instance, metadata_search_map,
+                                     writer, cache)
+        with profile.span('close', 'output'):
+            writer.close()
+        if store:
+            save_comparison(args, store)
+    if cache:
+        cache.close()
+    databases.close_clients()
+    if profiler:
+        profile.disable()
+        print(profiler.format_summary(), file=sys.stderr)
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
     _logger.info("Script ends here")
+    if regressions:
+        _logger.error("{} metrics regressed against {}".format(
+            regressions, args.baseline))
+        return 1
+    return 0
 
 
 def render():
     """Entry point for console_scripts
     """
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
 
 
 if __name__ == "__main__":
@@ -1,17 +1,75 @@
 from importlib import import_module
 import logging
+import threading
 import traceback
 
-from . base_database import DatabaseBaseClass ## noqa
+from . base_database import ComputeResult, DatabaseBaseClass ## noqa
 
 
 _logger = logging.getLogger("touchstone")
 
+# Databases touchstone ships, by name: (module, class). grab only imports
+# the module of the database asked for, and with it its client library.
+DATABASES = {
+    'elasticsearch': ('elasticsearch', 'Elasticsearch'),
+    'file': ('file', 'File'),
+}
+
+# Options of touchstone_compare, by destination, that need more than the
+# queries every database answers, with the databases implementing them
+FEATURES = {
+    'changed_only': ('elasticsearch',),
+    'history': ('elasticsearch',),
+    'watch': ('elasticsearch',),
+}
+
+# Clients are shared by every database instance talking to the same url so a
+# whole compare run reuses one connection pool (and one handshake) per cluster
+_client_registry = {}
+_client_lock = threading.Lock()
+_client_options = {}
+
+
+def configure_clients(**kwargs):
+    """Set the options handed to client factories, e.g. pool_size
+
+    Only clients created after this call pick up the new options.
+    """
+    _client_options.update(kwargs)
+
+
+def get_client(conn_url, factory):
+    """Return the shared client for conn_url, creating it on first use
+
+    Args:
+      conn_url (str): connection string of the database
+      factory (callable): called as factory(conn_url, **options) to build
+        a new pooled client when none is registered for conn_url yet
+    """
+    with _client_lock:
+        if conn_url not in _client_registry:
+            _logger.debug("Creating pooled client for {}".format(conn_url))
+            _client_registry[conn_url] = factory(conn_url, **_client_options)
+        return _client_registry[conn_url]
+
+
+def close_clients():
+    """Close and forget every registered client"""
+    with _client_lock:
+        for conn_url, client in _client_registry.items():
+            _logger.debug("Closing pooled client for {}".format(conn_url))
+            close = getattr(client, 'close', None)
+            if close:
+                close()
+        _client_registry.clear()
+
 
 def grab(database_input_type, *args, **kwargs):
 
     try:
-        if '.' in database_input_type:
+        if database_input_type in DATABASES:
+            module_name, class_name = DATABASES[database_input_type]
+        elif '.' in database_input_type:
             module_name, class_name = database_input_type.rsplit('.', 1)
         else:
             module_name = database_input_type
@@ -5,7 +5,36 @@ import logging
 _logger = logging.getLogger("touchstone")
 
 
+class ComputeResult:
+    """Result of one compute query, self-contained so database instances
+    keep no state between queries
+
+    Args:
+      values (dict): {bucket name: {bucket value: ... {value name:
+        {identifier: value}}}}, nested once per bucket
+      buckets (tuple): bucket names, outermost first
+      aggregations (tuple): names of the values of every bucket
+    """
+
+    __slots__ = ('values', 'buckets', 'aggregations')
+
+    def __init__(self, values, buckets, aggregations):
+        self.values = values
+        self.buckets = buckets
+        self.aggregations = aggregations
+
+    def __repr__(self):
+        return "ComputeResult(buckets={}, aggregations={})".format(
+            self.buckets, self.aggregations)
+
+
 class DatabaseBaseClass(metaclass=ABCMeta): # noqa
+    # Database type benchmarks build their search maps for, None meaning
+    # the database's own type
+    source_type = None
+    # Whether results are worth keeping in the local result cache
+    cache_results = False
+
     def __init__(self, conn_url=None):
         _logger.debug("Initializing DatabaseBaseClass instance")
         if conn_url:
@@ -20,3 +49,40 @@ class DatabaseBaseClass(metaclass=ABCMeta): # noqa
     @abstractmethod
     def emit_compare_dict(self):
         pass
+
+    def emit_changed_dicts(self, requests, baseline, threshold,
+                           identifier=None):
+        raise NotImplementedError(
+            "{} does not support comparing on the database".format(
+                self.__class__.__name__))
+
+    def emit_sample_dicts(self, requests, identifier=None, chunk_size=None):
+        raise NotImplementedError(
+            "{} does not support raw samples".format(
+                self.__class__.__name__))
+
+    def emit_history_identifiers(self, index, match, identifier=None,
+                                 exclude=(), size=20, timestamp=None):
+        raise NotImplementedError(
+            "{} does not support historical baselines".format(
+                self.__class__.__name__))
+
+    def emit_history_dicts(self, requests, uuids, identifier=None):
+        raise NotImplementedError(
+            "{} does not support historical baselines".format(
+                self.__class__.__name__))
+
+    def emit_new_identifiers(self, indices, since=None, identifier=None,
+                             exclude=(), size=100, timestamp=None):
+        raise NotImplementedError(
+            "{} does not support watching for new runs".format(
+                self.__class__.__name__))
+
+    def access_nested_field(self, d, fields):
+        tmp_dict = d
+        for field in fields.split("."):
+            if field in tmp_dict:
+                tmp_dict = tmp_dict[field]
+            else:
+                return None
+        return tmp_dict
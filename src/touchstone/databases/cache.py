@@ -0,0 +1,356 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from .base_database import ComputeResult
+
+
+_logger = logging.getLogger("touchstone")
+
+# Results of these identifiers never change once the harness indexed them,
+# any other identifier (e.g. cluster_name) can pick up new runs over time
+_IMMUTABLE_IDENTIFIERS = ('uuid',)
+_DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+_DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Bumped whenever the shape of cached results changes, so stale entries
+# are never handed out
+_FORMAT = 4
+
+
+def default_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'touchstone', 'results.sqlite')
+
+
+def _is_empty(kind, result):
+    if kind in ('compute', 'samples'):
+        return not result.values
+    if kind == 'compare':
+        return not any(result.values())
+    return not result
+
+
+def _encode(result):
+    # JSON keeps neither tuples nor the type of object keys (bucket values
+    # are often numbers), so containers are tagged, e.g. a dict becomes
+    # {"d": [[key, value], ...]}
+    if isinstance(result, ComputeResult):
+        return {'c': [_encode(result.values), _encode(result.buckets),
+                      _encode(result.aggregations)]}
+    if isinstance(result, dict):
+        return {'d': [[_encode(key), _encode(value)]
+                      for key, value in result.items()]}
+    if isinstance(result, tuple):
+        return {'t': [_encode(item) for item in result]}
+    if isinstance(result, list):
+        return [_encode(item) for item in result]
+    return result
+
+
+def _decode(payload):
+    if isinstance(payload, list):
+        return [_decode(item) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+    (tag, items), = payload.items()
+    if tag == 'd':
+        return {_decode(key): _decode(value) for key, value in items}
+    if tag == 't':
+        return tuple(_decode(item) for item in items)
+    return ComputeResult(*(_decode(item) for item in items))
+
+
+def _url_hash(conn_url):
+    return hashlib.sha256(str(conn_url).encode()).hexdigest()
+
+
+def _result_key(kind, conn_url, index, identifier, value, spec):
+    # Compiled query templates carry their serialized form already
+    spec_json = getattr(spec, 'key', None) or \
+        json.dumps(spec, sort_keys=True, default=str)
+    spec_hash = hashlib.sha256(spec_json.encode()).hexdigest()
+    return hashlib.sha256(json.dumps([_FORMAT, kind, conn_url, index,
+                                      identifier, str(value),
+                                      spec_hash]).encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of query results of immutable benchmark runs
+
+    Entries are keyed by (kind, conn_url, index, identifier, value, spec
+    hash) and evicted once older than max_age seconds, or least recently
+    used first once the cache grows past max_size bytes. Results are kept
+    as JSON, so reading a cache or comparison file never runs code, and
+    connection urls, which may carry credentials, only as hashes. Only the
+    user may read the file.
+    """
+
+    # Identifier keys whose results are kept, None for every key
+    identifiers = _IMMUTABLE_IDENTIFIERS
+
+    def __init__(self, path=None, max_age=_DEFAULT_MAX_AGE,
+                 max_size=_DEFAULT_MAX_SIZE, refresh=False):
+        self._path = path or default_cache_path()
+        self._max_age = max_age
+        self._max_size = max_size
+        self._refresh = refresh
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(self._path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if path is None:
+            # makedirs leaves the mode of an existing directory alone
+            os.chmod(directory, 0o700)
+        _logger.debug("Opening result cache {}".format(self._path))
+        os.close(os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(self._path, 0o600)
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        columns = [row[1] for row in
+                   self._conn.execute("PRAGMA table_info(results)")]
+        if 'conn_url' in columns:
+            # Written before urls were hashed, its entries may hold
+            # credentials and are out of reach of the current keys anyway
+            self._conn.execute("DROP TABLE results")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                           "key TEXT PRIMARY KEY, url_hash TEXT, "
+                           "idx TEXT, identifier TEXT, value TEXT, "
+                           "created REAL, accessed REAL, size INTEGER, "
+                           "payload BLOB)")
+        self._conn.commit()
+
+    def _key(self, kind, conn_url, index, identifier, value, spec):
+        return _result_key(kind, conn_url, index, identifier, value, spec)
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM results "
+                                     "WHERE key = ? AND created >= ?",
+                                     (key, time.time() - self._max_age)
+                                     ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET accessed = ? "
+                               "WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return _decode(json.loads(row[0]))
+
+    def _put(self, key, conn_url, index, identifier, value, result):
+        payload = json.dumps(_encode(result)).encode()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES "
+                               "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, _url_hash(conn_url), index, identifier,
+                                str(value), now, now, len(payload), payload))
+            self._conn.commit()
+
+    def fetch(self, kind, conn_url, identifier, requests, run_batch):
+        """Return a result per request, only querying the uncached ones
+
+        Args:
+          kind (str): 'compute', 'samples', 'compare' or 'metadata'
+          conn_url (str): connection string the requests are sent to
+          identifier (str): identifier key the values are matched on
+          requests ([tuple]): (index, value, spec) of every query
+          run_batch (callable): runs a list of requests against the
+            database and returns a result per request
+        """
+        if self.identifiers is not None and \
+                identifier not in self.identifiers:
+            with self._lock:
+                self.misses += len(requests)
+            return run_batch(requests)
+        keys = [self._key(kind, conn_url, index, identifier, value, spec)
+                for index, value, spec in requests]
+        results = [None] * len(requests)
+        missing = []
+        for position, key in enumerate(keys):
+            if not self._refresh:
+                results[position] = self._get(key)
+            if results[position] is None:
+                missing.append(position)
+        with self._lock:
+            self.hits += len(requests) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            fetched = run_batch([requests[position] for position in missing])
+            for position, result in zip(missing, fetched):
+                results[position] = result
+                # An empty result may just be a run that is not indexed yet
+                if not _is_empty(kind, result):
+                    index, value, _ = requests[position]
+                    self._put(keys[position], conn_url, index, identifier,
+                              value, result)
+        return results
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until
+        the cache fits in max_size"""
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE created < ?",
+                               (time.time() - self._max_age,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) "
+                                       "FROM results").fetchone()[0]
+            if total > self._max_size:
+                rows = self._conn.execute("SELECT key, size FROM results "
+                                          "ORDER BY accessed").fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self._max_size:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM results WHERE key = ?",
+                                       evicted)
+            self._conn.commit()
+
+    def close(self):
+        self.evict()
+        _logger.info("Result cache: {} hits, {} misses".format(self.hits,
+                                                               self.misses))
+        self._conn.close()
+
+
+class ComparisonStore(ResultCache):
+    """Results of every identifier of one comparison, kept in a file of
+    its own
+
+    Unlike the result cache, results of any identifier key are kept and
+    never expire, so a comparison can be extended with new identifiers by
+    querying only those. The identifiers compared, their connection urls
+    and the baseline are stored along.
+
+    Args:
+      path (str): file of the comparison
+      refresh (bool): query every result again
+
+    Attributes:
+      cache (:obj:`ResultCache`): cache the results missing from the
+        comparison are fetched through, if any
+    """
+
+    identifiers = None
+
+    def __init__(self, path, refresh=False):
+        super().__init__(path=os.path.abspath(path), max_age=float('inf'),
+                         refresh=refresh)
+        self.cache = None
+        self._conn.execute("CREATE TABLE IF NOT EXISTS comparison ("
+                           "name TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def settings(self):
+        """The stored settings, e.g. benchmark, uuid or baseline"""
+        with self._lock:
+            rows = self._conn.execute("SELECT name, value FROM comparison"
+                                      ).fetchall()
+        return {name: json.loads(value) for name, value in rows}
+
+    def save(self, settings):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO comparison "
+                                   "VALUES (?, ?)",
+                                   [(name, json.dumps(value)) for
+                                    name, value in settings.items()])
+            self._conn.commit()
+
+    def fetch(self, kind, conn_url, identifier, requests, run_batch):
+        """Return a result per request, see :meth:`ResultCache.fetch`"""
+        if self.cache:
+            run_batch = partial(self.cache.fetch, kind, conn_url,
+                                identifier, run_batch=run_batch)
+        return super().fetch(kind, conn_url, identifier, requests,
+                             run_batch)
+
+    def evict(self):
+        # Results of a comparison go with its file
+        pass
+
+    def close(self):
+        _logger.info("Comparison {}: {} results reused, {} queried".format(
+            self._path, self.hits, self.misses))
+        self._conn.close()
+        if self.cache:
+            self.cache.close()
+
+
+class MemoryCache:
+    """In-memory LRU cache of query results of immutable benchmark runs,
+    e.g. the baselines a watch compares every new run against
+
+    Results are kept pickled, so callers can never alter them, and only
+    for identifiers the result cache deems immutable. Every other request
+    goes through the result cache, if any, or straight to the database.
+
+    Args:
+      values (list): identifier values whose results are kept, None for
+        every value
+      cache (:obj:`ResultCache`): cache of everything else, if any
+      max_entries (int): results kept, the least recently used dropped
+        first, None for no limit
+    """
+
+    def __init__(self, values=None, cache=None, max_entries=None):
+        self._values = None if values is None else set(values)
+        self._cache = cache
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.hits = 0
+
+    def _keeps(self, identifier, value):
+        return identifier in _IMMUTABLE_IDENTIFIERS and \
+            (self._values is None or value in self._values)
+
+    def entries(self):
+        return len(self._results)
+
+    def fetch(self, kind, conn_url, identifier, requests, run_batch):
+        """Return a result per request, see :meth:`ResultCache.fetch`"""
+        keys = [_result_key(kind, conn_url, index, identifier, value, spec)
+                if self._keeps(identifier, value) else None
+                for index, value, spec in requests]
+        results = [None] * len(requests)
+        missing = []
+        with self._lock:
+            for position, key in enumerate(keys):
+                if key in self._results:
+                    self._results.move_to_end(key)
+                    results[position] = pickle.loads(self._results[key])
+                else:
+                    missing.append(position)
+            self.hits += len(requests) - len(missing)
+        if missing:
+            batch = [requests[position] for position in missing]
+            if self._cache:
+                fetched = self._cache.fetch(kind, conn_url, identifier,
+                                            batch, run_batch)
+            else:
+                fetched = run_batch(batch)
+            for position, result in zip(missing, fetched):
+                results[position] = result
+                if keys[position] is None or _is_empty(kind, result):
+                    continue
+                payload = pickle.dumps(result,
+                                       protocol=pickle.HIGHEST_PROTOCOL)
+                with self._lock:
+                    self._results[keys[position]] = payload
+                    if self._max_entries is not None:
+                        while len(self._results) > self._max_entries:
+                            self._results.popitem(last=False)
+        return results
+
+    def close(self):
+        _logger.info("Memory cache: {} hits".format(self.hits))
+        if self._cache:
+            self._cache.close()
@@ -1,190 +1,865 @@
 import logging
 import elasticsearch
-import elasticsearch_dsl
 import json
-import copy
-from elasticsearch_dsl import Search
+from functools import lru_cache
+from elasticsearch.serializer import JSONSerializer
 
 
-from . import DatabaseBaseClass
+from . import ComputeResult, DatabaseBaseClass, get_client
+from ..benchmarks.spec import DEFAULT_PERCENTS
+from ..utils import profile
 from ..utils.lib import get
 
 
 _logger = logging.getLogger("touchstone")
 
+# Names of the aggregations wrapping the bucket tree of a compute search
+_BUCKETS_AGG = '_buckets'
+_IDENTIFIER_AGG = '_by_identifier'
+_FIRST_HIT_AGG = '_first_hit'
+_LATEST_AGG = '_latest'
+_CHANGED_AGG = '_changed'
+_ELEMENT_AGG = '_element'
+_FIELD_AGG = '_field'
+# Percentiles of the historical distribution of every metric
+_HISTORY_PERCENTS = [50.0, 90.0]
+# Number of bucket combinations fetched per composite aggregation page
+_COMPOSITE_PAGE_SIZE = 1000
+# Parts of a search response touchstone reads, everything else is dropped
+# by elasticsearch before it goes on the wire
+_FILTER_PATH = ['took', 'hits.hits._id', 'hits.hits._source', 'aggregations',
+                'error', 'status']
+_MSEARCH_FILTER_PATH = ['responses.' + path for path in _FILTER_PATH]
+_SAMPLE_FILTER_PATH = ['pit_id', 'hits.hits._source', 'hits.hits.sort',
+                       'error', 'status']
+# How long a point in time is kept open between two pages of samples
+_PIT_KEEP_ALIVE = '1m'
+
+
+class _ProfiledSerializer(JSONSerializer):
+    """Times the JSON encoding of requests and decoding of responses,
+    counting their bytes in the search they belong to"""
+
+    def dumps(self, data):
+        with profile.span('encode', 'json') as stats:
+            payload = JSONSerializer.dumps(self, data)
+            stats['bytes'] = len(payload)
+        profile.note(request_bytes=len(payload))
+        return payload
+
+    def loads(self, s):
+        profile.note(response_bytes=len(s))
+        with profile.span('decode', 'json', bytes=len(s)):
+            return JSONSerializer.loads(self, s)
+
+
+def _new_client(conn_url, pool_size=10):
+    _logger.debug("Creating connection object")
+    options = {}
+    if profile.enabled():
+        options['serializer'] = _ProfiledSerializer()
+    # urllib3 keeps up to pool_size keep-alive connections per host
+    return elasticsearch.Elasticsearch([str(conn_url)],
+                                       send_get_body_as='POST',
+                                       maxsize=pool_size, **options)
+
+
+def _response_stats(raw):
+    # Counters of a search response for the profile
+    aggregations = raw.get('aggregations', {})
+    buckets = aggregations.get(_BUCKETS_AGG,
+                               aggregations.get(_IDENTIFIER_AGG, {}))
+    return {'took_ms': raw.get('took', 0),
+            'hits': len(raw.get('hits', {}).get('hits', [])),
+            'buckets': len(buckets.get('buckets', []))}
+
+
+# The parts of a search body that only depend on the query template are
+# built once per template, then shared, unmodified, by every search using it
+
+@lru_cache(maxsize=256)
+def _filter_clauses(search_map):
+    clauses = {'filter': [{'term': {str(key): str(value)}}
+                          for key, value in search_map['filter'].items()]}
+    if search_map.get('exclude'):
+        clauses['must_not'] = [{'match': {key: value}} for key, value
+                               in search_map['exclude'].items()]
+    return clauses
+
+
+def _query(match, search_map):
+    return {'bool': dict(_filter_clauses(search_map), must=[match])}
+
+
+def _collate_aggs(search_map):
+    # The first document of every bucket, for the collate keys of the bucket
+    if not search_map['collate']:
+        return {}
+    return {_FIRST_HIT_AGG: {'top_hits': {
+        'size': 1, '_source': {'includes': list(search_map['collate'])}}}}
+
+
+def _composite(search_map, identifier=None):
+    # A composite aggregation pages through every bucket combination
+    # instead of silently truncating each level to the top 10 terms
+    sources = [{name: {'terms': {'field': field}}}
+               for name, field in search_map.bucket_fields]
+    if identifier:
+        sources.insert(0, {_IDENTIFIER_AGG: {'terms': {'field': identifier}}})
+    return {'sources': sources, 'size': _COMPOSITE_PAGE_SIZE}
+
+
+@lru_cache(maxsize=256)
+def _compute_aggs(search_map, identifier=None):
+    aggs = {name: {agg_type: dict(params, field=field)}
+            for name, agg_type, field, params in search_map.metrics}
+    aggs.update(_collate_aggs(search_map))
+    return {'composite': _composite(search_map, identifier), 'aggs': aggs}
+
+
+@lru_cache(maxsize=256)
+def _changed_metrics(search_map):
+    # Internal names keep buckets_path free of the dots and brackets
+    # metric names may hold
+    aggs = {}
+    names = []
+    paths = []
+    for agg_name, agg_type, field, params in search_map.metrics:
+        name = "_m{}".format(len(names))
+        aggs[name] = {agg_type: dict(params, field=field)}
+        names.append((name, agg_name))
+        if agg_type == 'percentiles':
+            for percent in params.get('percents', DEFAULT_PERCENTS):
+                paths.append(("{}{}".format(float(percent), agg_name),
+                              "{}[{}]".format(name, float(percent))))
+        else:
+            paths.append((agg_name, name))
+    return aggs, tuple(names), tuple(paths)
+
+
+def _excess_script(paths, baseline, candidate, threshold):
+    """bucket_script yielding how far the largest change of candidate
+    against baseline exceeds its threshold, positive meaning changed
+
+    A change exceeds threshold percent when
+    |candidate - baseline| * 100 > threshold * |baseline|, which also holds
+    for any change of a zero baseline. Missing values count as zeros, so
+    buckets lacking either identifier are kept.
+    """
+    buckets_path = {}
+    script = None
+    for position, (value_name, path) in enumerate(paths):
+        buckets_path["b{}".format(position)] = \
+            "{}>{}".format(baseline, path)
+        buckets_path["c{}".format(position)] = \
+            "{}>{}".format(candidate, path)
+        term = "Math.abs(params.c{0} - params.b{0}) * 100 - " \
+            "{1!r} * Math.abs(params.b{0})".format(
+                position, float(threshold(value_name)))
+        script = term if script is None else \
+            "Math.max({}, {})".format(script, term)
+    return {'bucket_script': {'buckets_path': buckets_path,
+                              'script': script,
+                              'gap_policy': 'insert_zeros'}}
+
+
+@lru_cache(maxsize=256)
+def _history_metrics(search_map):
+    # Internal names keep buckets_path free of the dots and brackets
+    # metric names may hold
+    metrics = []
+    outputs = []
+    for agg_name, agg_type, key, params in search_map.metrics:
+        name = "_m{}".format(len(metrics))
+        metrics.append((name, agg_type, dict(params, field=key)))
+        if agg_type == 'percentiles':
+            for percent in params.get('percents', DEFAULT_PERCENTS):
+                outputs.append(("{}{}".format(float(percent), agg_name),
+                                "{}[{}]".format(name, float(percent))))
+        else:
+            outputs.append((agg_name, name))
+    # Collated values of a run are averaged over its documents
+    for collate_key in search_map['collate']:
+        name = "_m{}".format(len(metrics))
+        metrics.append((name, 'avg', {'field': collate_key}))
+        outputs.append((str(collate_key), name))
+    return tuple(metrics), tuple(outputs)
+
 
 class Elasticsearch(DatabaseBaseClass):
 
+    cache_results = True
+
     def _create_conn_object(self):
-        _logger.debug("Creating connection object")
-        es = elasticsearch.Elasticsearch([str(self._conn_url)],
-                                         send_get_body_as='POST')
-        return es
+        _logger.debug("Fetching pooled connection object")
+        return get_client(str(self._conn_url), _new_client)
 
     def __init__(self, conn_url=None):
         _logger.debug("Initializing Elasticsearch object")
         DatabaseBaseClass.__init__(self, conn_url=conn_url)
         self._conn_object = self._create_conn_object()
-        self._possible_bucket_keys = {}
-        self._bucket_list = []
-        self._aggs_list = []
         _logger.debug("Finished Initializing Elasticsearch object")
 
-    def _clean_dict(self, _input_dict, _list_buckets, level, aggs, uuid,
-                    _first_hit, _collate_list):
-        _curr_level = level + 1
+    def _clean_leaf(self, _input_dict, search_map, uuid):
         _output_dict = {}
-        if _curr_level <= len(_list_buckets):
-            _output_dict[_list_buckets[level]] = {}
-            for _bucket in _input_dict[_list_buckets[level]]['buckets']:
-                _real_key = _bucket['key']
-                _output_dict[_list_buckets[level]][_real_key] = {}
-                _output_dict[_list_buckets[level]][_real_key] = \
-                    self._clean_dict(_bucket, _list_buckets, _curr_level, aggs,
-                                     uuid, _first_hit, _collate_list)
-        else:
-            # this is the last level
-            _output_dict = {}
-            for _aggs in aggs:
-                if 'values' in _input_dict[_aggs]:
-                    # where values is a dictionary
-                    self._remove_aggs.append(_aggs)
-                    for value in _input_dict[_aggs]['values'].keys():
-                        _agg_str = value + str(_aggs)
-                        self._aggs_list.append(_agg_str)
-                        _output_dict[_agg_str] = {}
-                        _output_dict[_agg_str][uuid] = \
-                            _input_dict[_aggs]['values'][value]
-                else:
-                    _output_dict[_aggs] = {}
-                    _output_dict[_aggs][uuid] = _input_dict[_aggs]['value']
-            # Now do the lowest level compare
-            for _collate_key in _collate_list:
-                _output_dict[str(_collate_key)] = {}
-                try:
-                    _output_dict[str(_collate_key)][uuid] = \
-                        get(_first_hit, _collate_key)
-                except BaseException:  # replace with keynotfoundexception
-                    _logger.debug("key not exists" + str(_collate_key))
-                    pass
+        for _aggs in search_map.aggregation_names:
+            if 'values' in _input_dict[_aggs]:
+                # where values is a dictionary
+                for value, result in _input_dict[_aggs]['values'].items():
+                    _output_dict[value + _aggs] = {uuid: result}
+            else:
+                _output_dict[_aggs] = {uuid: _input_dict[_aggs]['value']}
+        # Now do the lowest level compare, from the first hit of the bucket
+        _hits = _input_dict.get(_FIRST_HIT_AGG, {}).get('hits', {})
+        _first_hit = _hits['hits'][0].get('_source', {}) \
+            if _hits.get('hits') else {}
+        for _collate_key in search_map['collate']:
+            _output_dict[str(_collate_key)] = {}
+            try:
+                _output_dict[str(_collate_key)][uuid] = \
+                    get(_first_hit, _collate_key)
+            except BaseException:  # replace with keynotfoundexception
+                _logger.debug("key not exists" + str(_collate_key))
+                pass
+        return _output_dict
+
+    def _clean_dict(self, _buckets, search_map, uuid, _output_dict):
+        # Nest every composite bucket as
+        # {bucket name: {bucket value: ... {leaf}}} into _output_dict
+        for _bucket in _buckets:
+            _level_dict = _output_dict
+            for _bucket_name in search_map.bucket_names:
+                _level_dict = _level_dict.setdefault(_bucket_name, {})
+                _level_dict = \
+                    _level_dict.setdefault(_bucket['key'][_bucket_name], {})
+            _level_dict.update(self._clean_leaf(_bucket, search_map, uuid))
         return _output_dict
 
-    def _build_values_dict(self, search_map, index, uuid, input_dict,
-                           identifier):
-        _temp_dict = {}
-        buckets = search_map['buckets']
-        aggregations = search_map['aggregations']
-        collate = search_map['collate']
-        filters = search_map['filter']
-        _logger.debug("Initializing search object")
+    def _iter_pages(self, index, body, response, filtered=False):
+        # Hand out the composite bucket pages one at a time, fetching the
+        # next one only once the previous page has been consumed. Pages a
+        # bucket_selector filtered may be short before the last one, they
+        # end at the first page without an after_key instead.
+        while True:
+            # filter_path drops the buckets altogether when none matched
+            page = response.get('aggregations', {}).get(_BUCKETS_AGG, {})
+            page.setdefault('buckets', [])
+            yield page
+            if 'after_key' not in page or (
+                    not filtered and
+                    len(page['buckets']) < _COMPOSITE_PAGE_SIZE):
+                return
+            _logger.debug("Fetching composite page after {}".format(
+                page['after_key']))
+            buckets_agg = body['aggs'][_BUCKETS_AGG]
+            composite = dict(buckets_agg['composite'],
+                             after=page['after_key'])
+            body = dict(body, size=0,
+                        aggs={_BUCKETS_AGG: dict(buckets_agg,
+                                                 composite=composite)})
+            body.pop('_source', None)
+            response = self._execute(index, body)
+
+    def _check_response(self, raw):
+        if raw.get('error', False):
+            raise elasticsearch.TransportError(raw.get('status', 'N/A'),
+                                               raw['error']['type'],
+                                               raw['error'])
+        # filter_path drops the hits object altogether when nothing matched
+        raw.setdefault('hits', {'hits': []})
+        return raw
+
+    def _execute(self, index, body, filter_path=_FILTER_PATH):
+        # Searches of a point in time name no index
+        index = None if index is None else str(index)
+        with profile.span('search', 'elasticsearch', index=index) as stats:
+            raw = self._conn_object.search(index=index, body=body,
+                                           filter_path=filter_path)
+            if stats is not None:
+                stats.update(_response_stats(raw))
+        return self._check_response(raw)
+
+    def _msearch(self, searches):
+        """Send (index, body) searches in one _msearch, returning the plain
+        response dict of every search"""
+        _logger.debug("Sending {} searches in one _msearch".format(
+            len(searches)))
+        lines = []
+        for index, body in searches:
+            lines.append({'index': str(index)})
+            lines.append(body)
+        with profile.span('msearch', 'elasticsearch',
+                          searches=len(searches)) as stats:
+            raw = self._conn_object.msearch(body=lines,
+                                            filter_path=_MSEARCH_FILTER_PATH)
+            if stats is not None:
+                for response in raw['responses']:
+                    for key, value in _response_stats(response).items():
+                        stats[key] = stats.get(key, 0) + value
+        return [self._check_response(r) for r in raw['responses']]
+
+    def _build_values_search(self, search_map, index, uuid, identifier):
+        _logger.debug("Initializing search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        body = {'query': _query({'match': {_identifier: str(uuid)}},
+                                search_map),
+                'aggs': {_BUCKETS_AGG: _compute_aggs(search_map)},
+                'size': 0, 'track_total_hits': False}
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Built the following query: \
+                            {}".format(json.dumps(body, indent=4)))
+        return index, body
+
+    def _build_grouped_values_search(self, search_map, index, uuids,
+                                     identifier):
+        _logger.debug("Initializing grouped search body")
         _identifier = identifier + ".keyword"  # append .keyword
-        s = Search(using=self._conn_object,
-                   index=str(index)).query("match", **{str(_identifier):
-                                                       str(uuid)})
-        for key, value in filters.items():
-            s = s.filter("term", **{str(key): str(value)})
-        if 'exclude' in search_map:
-            for key, value in search_map['exclude'].items():
-                s = s.exclude('match', **{key: value})
-        _logger.debug("Building query")
-        _first_bucket = str(buckets[0].split('.')[0])
-        self._bucket_list.append(_first_bucket)
-        x = s.aggs.bucket(_first_bucket, 'terms', field=str(buckets[0]))
-        _logger.debug("Building buckets")
-        for bucket_name in buckets[1:]:
-            _curr_bucket = bucket_name.split('.')[0]
-            self._bucket_list.append(_curr_bucket)
-            x = x.bucket(_curr_bucket, 'terms', field=bucket_name)
-        _logger.debug("Finished adding buckets to query")
-        _logger.debug("Adding aggregations to query")
-        for key, agg_list in aggregations.items():
-            for aggs in agg_list:
-                if isinstance(aggs, str):
-                    _temp_agg_str = "{}({})".format(aggs, key)
-                    x = x.metric(_temp_agg_str, aggs, field=key)
-                    self._aggs_list.append(_temp_agg_str)
-                elif isinstance(aggs, dict):
-                    for dict_key, dict_value in aggs.items():
-                        _temp_agg_str = "{}({})".format(dict_key, key)
-                        for nested_dict_key, nested_dict_value in dict_value.items(): # noqa
-                            x = x.metric(_temp_agg_str, dict_key, field=key,
-                                         **{nested_dict_key: nested_dict_value}) # noqa
-                        self._aggs_list.append(_temp_agg_str)
-        _logger.debug("Finished adding aggregations to query")
-        _logger.debug("Built the following query: \
-                        {}".format(json.dumps(s.to_dict(), indent=4)))
-        response = s.execute()
+        body = {'query': _query({'terms': {_identifier: list(uuids)}},
+                                search_map),
+                # Composite buckets keyed by identifier first, then the
+                # bucket list
+                'aggs': {_BUCKETS_AGG: _compute_aggs(search_map,
+                                                     _identifier)},
+                'size': 0, 'track_total_hits': False}
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Built the following query: \
+                            {}".format(json.dumps(body, indent=4)))
+        return index, body
+
+    def _build_values_output(self, search, response, search_map, uuid):
         _logger.debug("Succesfully executed the search query")
-        _temp_dict_throw = response.aggregations.__dict__['_d_']
-        _temp_dict = copy.deepcopy(_temp_dict_throw)
-        self._remove_aggs = []
-        if len(response.hits.hits) == 0:
-            return {}
-        _output_dict = self._clean_dict(_temp_dict, self._bucket_list,
-                                        0, copy.deepcopy(self._aggs_list),
-                                        uuid,
-                                        response.hits.hits[0].__dict__['_d_']['_source'], # noqa
-                                        collate)
-        self._remove_aggs = set(self._remove_aggs)
-        for element in self._remove_aggs:
-            self._aggs_list.remove(element)
-        _logger.debug("output compute dictionary with summaries is: {}\
-                        ".format(json.dumps(_output_dict, indent=4)))
-        return _output_dict
+        _output_dict = {}
+        for page in self._iter_pages(*search, response):
+            self._clean_dict(page['buckets'], search_map, uuid, _output_dict)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("output compute dictionary with summaries is: {}\
+                            ".format(json.dumps(_output_dict, indent=4)))
+        return ComputeResult(_output_dict, search_map.bucket_names,
+                             search_map.value_names)
 
-    def _build_compare_dict(self, compare_map, index, uuid, input_dict,
-                            identifier):
-        _logger.debug("Initializing search object")
+    def _build_grouped_values_output(self, search, response, search_map,
+                                     uuids):
+        _logger.debug("Succesfully executed the grouped search query")
+        _output_dicts = {uuid: {} for uuid in uuids}
+        for page in self._iter_pages(*search, response):
+            # Split the page by identifier, keeping the order of the buckets
+            _pages = {}
+            for _bucket in page['buckets']:
+                _uuid = str(_bucket['key'][_IDENTIFIER_AGG])
+                _pages.setdefault(_uuid, []).append(_bucket)
+            for _uuid, _buckets in _pages.items():
+                if _uuid in _output_dicts:
+                    self._clean_dict(_buckets, search_map, _uuid,
+                                     _output_dicts[_uuid])
+        return [ComputeResult(_output_dicts[uuid], search_map.bucket_names,
+                              search_map.value_names) for uuid in uuids]
+
+    def _build_changed_search(self, search_map, index, uuids, baseline,
+                              threshold, identifier):
+        _logger.debug("Initializing changed search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        aggs, _, paths = _changed_metrics(search_map)
+        # Every bucket holds the metrics of each identifier, how far the
+        # candidates changed past their thresholds, and is dropped by
+        # elasticsearch when none of them did
+        aggs = dict(aggs, **_collate_aggs(search_map))
+        bucket_aggs = {}
+        for position, uuid in enumerate(uuids):
+            bucket_aggs["_id{}".format(position)] = {
+                'filter': {'term': {_identifier: uuid}}, 'aggs': aggs}
+        excess = {}
+        for position, uuid in enumerate(uuids):
+            if uuid != baseline and paths:
+                name = "_excess{}".format(position)
+                bucket_aggs[name] = _excess_script(
+                    paths, "_id{}".format(uuids.index(baseline)),
+                    "_id{}".format(position), threshold)
+                excess["e{}".format(position)] = name
+        if excess:
+            bucket_aggs[_CHANGED_AGG] = {'bucket_selector': {
+                'buckets_path': excess,
+                'script': " || ".join("params.{} > 0".format(var)
+                                      for var in excess)}}
+        body = {'query': _query({'terms': {_identifier: list(uuids)}},
+                                search_map),
+                'aggs': {_BUCKETS_AGG: {'composite': _composite(search_map),
+                                        'aggs': bucket_aggs}},
+                'size': 0, 'track_total_hits': False}
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Built the following query: \
+                            {}".format(json.dumps(body, indent=4)))
+        return index, body
+
+    def _build_changed_output(self, search, response, search_map, uuids):
+        _logger.debug("Succesfully executed the changed search query")
+        _, names, _ = _changed_metrics(search_map)
+        _output_dicts = {uuid: {} for uuid in uuids}
+        for page in self._iter_pages(*search, response, filtered=True):
+            for _bucket in page['buckets']:
+                for position, uuid in enumerate(uuids):
+                    _id_bucket = _bucket["_id{}".format(position)]
+                    if not _id_bucket['doc_count']:
+                        continue
+                    _leaf = {agg_name: _id_bucket[name]
+                             for name, agg_name in names}
+                    _leaf['key'] = _bucket['key']
+                    if _FIRST_HIT_AGG in _id_bucket:
+                        _leaf[_FIRST_HIT_AGG] = _id_bucket[_FIRST_HIT_AGG]
+                    self._clean_dict([_leaf], search_map, uuid,
+                                     _output_dicts[uuid])
+        return [ComputeResult(_output_dicts[uuid], search_map.bucket_names,
+                              search_map.value_names) for uuid in uuids]
+
+    def _build_values_dict(self, search_map, index, uuid, identifier):
+        search = self._build_values_search(search_map, index, uuid,
+                                           identifier)
+        response = self._execute(*search)
+        return self._build_values_output(search, response, search_map, uuid)
+
+    def _iter_samples(self, pit, body, chunk_size):
+        # Page through every matching document of the point in time, in
+        # index order, a chunk of _source dicts at a time. pit holds the
+        # latest id of the point in time, which elasticsearch may change.
+        body = dict(body, size=chunk_size, sort=[{'_shard_doc': 'asc'}],
+                    track_total_hits=False)
+        while True:
+            body['pit'] = {'id': pit['id'], 'keep_alive': _PIT_KEEP_ALIVE}
+            response = self._execute(None, body,
+                                     filter_path=_SAMPLE_FILTER_PATH)
+            pit['id'] = response.get('pit_id', pit['id'])
+            hits = response['hits']['hits']
+            if hits:
+                yield [hit.get('_source', {}) for hit in hits]
+            if len(hits) < chunk_size:
+                return
+            body = dict(body, search_after=hits[-1]['sort'])
+
+    def _build_sample_dict(self, pit, search_map, uuid, identifier,
+                           chunk_size):
+        from .samples import SampleAggregator, sample_fields
         _identifier = identifier + ".keyword"  # append .keyword
-        s = Search(using=self._conn_object,
-                   index=str(index)).query("match", **{str(_identifier):
-                                                       str(uuid)})
-        response = s.execute()
-        if len(response.hits.hits) > 0:
+        body = {'query': _query({'match': {_identifier: str(uuid)}},
+                                search_map),
+                '_source': {'includes': sample_fields(search_map)}}
+        aggregator = SampleAggregator(search_map)
+        for chunk in self._iter_samples(pit, body, chunk_size):
+            aggregator.add(chunk)
+        _logger.debug("Aggregated {} samples of {}".format(aggregator.samples,
+                                                           uuid))
+        _output_dict = {}
+        self._clean_dict(aggregator.buckets(first_hit=_FIRST_HIT_AGG),
+                         search_map, uuid, _output_dict)
+        return ComputeResult(_output_dict, search_map.bucket_names,
+                             search_map.value_names)
+
+    def emit_sample_dicts(self, requests, identifier='uuid',
+                          chunk_size=5000):
+        """Compute exact aggregations from every matching document
+
+        Instead of aggregating on elasticsearch, every document of a
+        request is streamed from a point in time with search_after, only
+        its bucket, aggregated and collated fields, and aggregated a chunk
+        at a time. Percentiles are exact rather than TDigest estimates,
+        while memory is bounded by the chunk size and the values
+        percentiles need. Requests on the same index share one point in
+        time.
+
+        Args:
+          requests ([tuple]): (index, uuid, compute_map) of every query
+          identifier (str): identifier key the uuids are matched on
+          chunk_size (int): documents fetched per round trip
+
+        Returns:
+          list: the :obj:`ComputeResult` of every request
+        """
+        positions = {}
+        for position, (index, _, _) in enumerate(requests):
+            positions.setdefault(str(index), []).append(position)
+        results = [None] * len(requests)
+        for index, index_positions in positions.items():
+            _logger.debug("Opening a point in time of {}".format(index))
+            pit = self._conn_object.open_point_in_time(
+                index=index, keep_alive=_PIT_KEEP_ALIVE)
+            try:
+                for position in index_positions:
+                    _, uuid, search_map = requests[position]
+                    results[position] = self._build_sample_dict(
+                        pit, search_map, uuid, identifier, chunk_size)
+            finally:
+                self._conn_object.close_point_in_time(body={'id': pit['id']})
+        return results
+
+    def _build_compare_search(self, compare_map, index, uuid, identifier):
+        _logger.debug("Initializing search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        # Only the compare keys of the first hit are read
+        return index, {'query': {'match': {_identifier: str(uuid)}},
+                       'size': 1, 'track_total_hits': False,
+                       '_source': {'includes': list(compare_map)}}
+
+    def _build_compare_output(self, response, compare_map, uuid, input_dict):
+        if len(response['hits']['hits']) > 0:
             for compare_key in compare_map:
-                temp_value = get(response.hits.hits[0]['_source'],
+                temp_value = get(response['hits']['hits'][0]['_source'],
                                  str(compare_key))
-                if isinstance(temp_value, elasticsearch_dsl.utils.AttrList):
+                if isinstance(temp_value, list):
                     input_dict[compare_key][uuid] = temp_value[0]
                 else:
                     input_dict[compare_key][uuid] = temp_value
-        _logger.debug("output compare dictionary with summaries is: {}\
-                        ".format(json.dumps(input_dict, indent=4)))
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("output compare dictionary with summaries is: {}\
+                            ".format(json.dumps(input_dict, indent=4)))
         return input_dict
 
+    def _build_compare_dict(self, compare_map, index, uuid, input_dict,
+                            identifier):
+        response = self._execute(*self._build_compare_search(compare_map,
+                                                             index, uuid,
+                                                             identifier))
+        return self._build_compare_output(response, compare_map, uuid,
+                                          input_dict)
+
     def emit_compute_dict(self, uuid=None, compute_map=None, index=None,
                           input_dict=None, identifier=None):
-        return self._build_values_dict(compute_map, index, uuid, input_dict,
-                                       identifier)
+        return self._build_values_dict(compute_map, index, uuid, identifier)
+
+    def emit_compute_dicts(self, requests, identifier=None,
+                           group_identifiers=False):
+        """Run a batch of compute queries in a single _msearch round trip
+
+        Args:
+          requests ([tuple]): (index, uuid, compute_map) of every query
+          identifier (str): identifier key the uuids are matched on
+          group_identifiers (bool): send one search per index and compute
+            map, bucketing on the identifier, instead of one per uuid
+
+        Returns:
+          list: the :obj:`ComputeResult` of every request
+        """
+        if group_identifiers:
+            return self._emit_grouped_compute_dicts(requests, identifier)
+        searches = [self._build_values_search(compute_map, index, uuid,
+                                              identifier)
+                    for index, uuid, compute_map in requests]
+        return [self._build_values_output(search, response, compute_map,
+                                          uuid)
+                for (index, uuid, compute_map), search, response
+                in zip(requests, searches, self._msearch(searches))]
+
+    def _emit_grouped_compute_dicts(self, requests, identifier):
+        groups = {}
+        for position, (index, uuid, compute_map) in enumerate(requests):
+            group_key = (index, compute_map)
+            if group_key not in groups:
+                groups[group_key] = (compute_map, [], [])
+            groups[group_key][1].append(str(uuid))
+            groups[group_key][2].append(position)
+        searches = [self._build_grouped_values_search(compute_map, index,
+                                                      uuids, identifier)
+                    for (index, _), (compute_map, uuids, _)
+                    in groups.items()]
+        results = [None] * len(requests)
+        for (compute_map, uuids, positions), search, response in \
+                zip(groups.values(), searches, self._msearch(searches)):
+            for position, result in \
+                    zip(positions,
+                        self._build_grouped_values_output(search, response,
+                                                          compute_map,
+                                                          uuids)):
+                results[position] = result
+        return results
+
+    def emit_changed_dicts(self, requests, baseline, threshold,
+                           identifier='uuid'):
+        """Run a batch of compute queries, comparing the identifiers on
+        elasticsearch and only fetching the buckets that changed
+
+        One search per index and compute map buckets the metrics of every
+        identifier, bucket_script aggregations weigh the change of each
+        candidate against its threshold and a bucket_selector drops the
+        buckets where no metric changed past it.
+
+        Args:
+          requests ([tuple]): (index, uuid, compute_map) of every query
+          baseline (str): identifier the others are compared against
+          threshold (callable): allowed change in percent of a value name
+          identifier (str): identifier key the uuids are matched on
+
+        Returns:
+          list: the :obj:`ComputeResult` of every request, holding the
+            changed buckets only
+        """
+        groups = {}
+        for position, (index, uuid, compute_map) in enumerate(requests):
+            group_key = (index, compute_map)
+            if group_key not in groups:
+                groups[group_key] = (compute_map, [], [])
+            groups[group_key][1].append(str(uuid))
+            groups[group_key][2].append(position)
+        searches = [self._build_changed_search(compute_map, index, uuids,
+                                               str(baseline), threshold,
+                                               identifier)
+                    for (index, _), (compute_map, uuids, _)
+                    in groups.items()]
+        results = [None] * len(requests)
+        for (compute_map, uuids, positions), search, response in \
+                zip(groups.values(), searches, self._msearch(searches)):
+            for position, result in \
+                    zip(positions,
+                        self._build_changed_output(search, response,
+                                                   compute_map, uuids)):
+                results[position] = result
+        return results
+
+    def _build_history_selection_search(self, index, match, identifier,
+                                        exclude, size, timestamp):
+        _logger.debug("Initializing history selection search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        query = {'filter': [{'match': {str(key): value}}
+                            for key, value in match.items()]}
+        if exclude:
+            query['must_not'] = [{'terms': {_identifier: list(exclude)}}]
+        # The most recent runs are the identifiers with the latest documents
+        return index, {
+            'query': {'bool': query},
+            'aggs': {_IDENTIFIER_AGG: {
+                'terms': {'field': _identifier, 'size': size,
+                          'order': {_LATEST_AGG: 'desc'}},
+                'aggs': {_LATEST_AGG: {'max': {'field': timestamp}}}}},
+            'size': 0, 'track_total_hits': False}
+
+    def emit_history_identifiers(self, index, match, identifier='uuid',
+                                 exclude=(), size=20, timestamp='timestamp'):
+        """Find the most recent runs matching the given field values
+
+        Args:
+          index (str): index to look for runs in
+          match (dict): values the compare fields of a run must have
+          identifier (str): identifier key the runs are told apart by
+          exclude (list): identifiers never selected, e.g. the candidates
+          size (int): number of runs to select
+          timestamp (str): field ordering the runs
+
+        Returns:
+          list: identifiers of the selected runs, most recent first
+        """
+        response = self._execute(*self._build_history_selection_search(
+            index, match, identifier, exclude, size, timestamp))
+        return [str(_bucket['key']) for _bucket in
+                response['aggregations'][_IDENTIFIER_AGG]['buckets']]
+
+    def _build_new_identifiers_search(self, indices, since, identifier,
+                                      exclude, size, timestamp):
+        _logger.debug("Initializing new identifiers search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        query = {}
+        if since is not None:
+            query['filter'] = [{'range': {timestamp: {'gte': since}}}]
+        if exclude:
+            query['must_not'] = [{'terms': {_identifier: list(exclude)}}]
+        # Oldest runs first, so a backlog is worked through in order
+        return ','.join(indices), {
+            'query': {'bool': query},
+            'aggs': {
+                _LATEST_AGG: {'max': {'field': timestamp}},
+                _IDENTIFIER_AGG: {
+                    'terms': {'field': _identifier, 'size': size,
+                              'order': {_LATEST_AGG: 'asc'}},
+                    'aggs': {_LATEST_AGG: {'max': {'field': timestamp}}}}},
+            'size': 0, 'track_total_hits': False}
+
+    def emit_new_identifiers(self, indices, since=None, identifier='uuid',
+                             exclude=(), size=100, timestamp='timestamp'):
+        """Find the runs with documents indexed at or after a cursor
+
+        A single terms aggregation over every index, cheap enough to be
+        polled. Timestamps are handed back as numbers, epoch milliseconds
+        for date fields, which range queries accept as is.
+
+        Args:
+          indices (list): indices to look for runs in
+          since (float): cursor, only documents with a timestamp at or
+            after it count, None for every document
+          identifier (str): identifier key the runs are told apart by
+          exclude (list): identifiers never returned, e.g. the baselines
+          size (int): most runs returned
+          timestamp (str): field telling when a document was indexed
+
+        Returns:
+          tuple: (latest timestamp of any matching document, [(identifier,
+            its latest timestamp)] oldest first), the timestamp None when
+            nothing matched
+        """
+        response = self._execute(*self._build_new_identifiers_search(
+            indices, since, identifier, exclude, size, timestamp))
+        aggregations = response.get('aggregations', {})
+        runs = [(str(_bucket['key']), _bucket[_LATEST_AGG]['value'])
+                for _bucket in
+                aggregations.get(_IDENTIFIER_AGG, {}).get('buckets', [])]
+        return aggregations.get(_LATEST_AGG, {}).get('value'), runs
+
+    def _build_history_search(self, search_map, index, uuids, identifier):
+        _logger.debug("Initializing history search body")
+        _identifier = identifier + ".keyword"  # append .keyword
+        # Every bucket holds the metrics of each run, and their
+        # distribution over the runs as sibling pipeline aggregations
+        metrics, outputs = _history_metrics(search_map)
+        aggs = {_IDENTIFIER_AGG: {
+            'terms': {'field': _identifier, 'size': len(uuids)},
+            'aggs': {name: {agg_type: params}
+                     for name, agg_type, params in metrics}}}
+        for position, (_, path) in enumerate(outputs):
+            path = "{}>{}".format(_IDENTIFIER_AGG, path)
+            aggs["_stats{}".format(position)] = {
+                'extended_stats_bucket': {'buckets_path': path}}
+            aggs["_percentiles{}".format(position)] = {
+                'percentiles_bucket': {'buckets_path': path,
+                                       'percents': _HISTORY_PERCENTS}}
+        body = {'query': _query({'terms': {_identifier: list(uuids)}},
+                                search_map),
+                'aggs': {_BUCKETS_AGG: {'composite': _composite(search_map),
+                                        'aggs': aggs}},
+                'size': 0, 'track_total_hits': False}
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("Built the following query: \
+                            {}".format(json.dumps(body, indent=4)))
+        return index, body
+
+    def _build_history_output(self, search, response, search_map):
+        outputs = [output for output, _ in _history_metrics(search_map)[1]]
+        _output_dict = {}
+        for page in self._iter_pages(*search, response):
+            for _bucket in page['buckets']:
+                _level_dict = _output_dict
+                for _bucket_name in search_map.bucket_names:
+                    _level_dict = _level_dict.setdefault(_bucket_name, {})
+                    _level_dict = _level_dict.setdefault(
+                        _bucket['key'][_bucket_name], {})
+                for position, output in enumerate(outputs):
+                    stats = _bucket["_stats{}".format(position)]
+                    if not stats['count']:
+                        continue
+                    percentiles = \
+                        _bucket["_percentiles{}".format(position)]['values']
+                    _level_dict[output] = {
+                        'runs': stats['count'], 'mean': stats['avg'],
+                        'stddev': stats['std_deviation'],
+                        'min': stats['min'], 'max': stats['max']}
+                    for percent in _HISTORY_PERCENTS:
+                        _level_dict[output]["p{:g}".format(percent)] = \
+                            percentiles[str(percent)]
+        return ComputeResult(_output_dict, search_map.bucket_names,
+                             tuple(outputs))
+
+    def emit_history_dicts(self, requests, uuids, identifier='uuid'):
+        """Compute the distribution of every metric over historical runs
+
+        All compute maps go to elasticsearch in one _msearch, each of them
+        aggregated over all runs in a single search.
+
+        Args:
+          requests ([tuple]): (index, compute_map) of every query
+          uuids (list): identifiers of the historical runs
+          identifier (str): identifier key the uuids are matched on
+
+        Returns:
+          list: the :obj:`ComputeResult` of every request, its values
+            nested like a compute result with {metric: statistics} leaves
+        """
+        searches = [self._build_history_search(compute_map, index,
+                                               list(uuids), identifier)
+                    for index, compute_map in requests]
+        return [self._build_history_output(search, response, compute_map)
+                for (_, compute_map), search, response
+                in zip(requests, searches, self._msearch(searches))]
 
     def emit_compare_dict(self, uuid=None, compare_map=None, index=None,
                           input_dict=None, identifier=None):
         return self._build_compare_dict(compare_map[index], index, uuid,
                                         input_dict, identifier)
 
+    def emit_compare_dicts(self, requests, identifier=None):
+        """Run a batch of compare queries in a single _msearch round trip
+
+        Args:
+          requests ([tuple]): (index, uuid, compare_map) of every query,
+            compare_map being the benchmark's map of all indices
+          identifier (str): identifier key the uuids are matched on
+
+        Returns:
+          list: the compare dict emit_compare_dict returns, per request
+        """
+        searches = [self._build_compare_search(compare_map[index], index,
+                                               uuid, identifier)
+                    for index, uuid, compare_map in requests]
+        results = []
+        for (index, uuid, compare_map), response in \
+                zip(requests, self._msearch(searches)):
+            input_dict = {}
+            for key in compare_map[index]:
+                input_dict[key] = {}
+            results.append(self._build_compare_output(response,
+                                                      compare_map[index],
+                                                      uuid, input_dict))
+        return results
+
+    def _build_metadata_search(self, compare_map, index, uuid):
+        _logger.debug("Initializing metadata search body")
+        # Every element (e.g. pod) is a composite bucket, paged through so
+        # none is missed on large clusters, holding the first document of
+        # the element that has each compare field, as fields may be spread
+        # over several documents
+        element = compare_map["element"] + ".keyword"  # append .keyword
+        fields = {
+            _FIELD_AGG + str(position): {
+                'filter': {'exists': {'field': compare}},
+                'aggs': {_FIRST_HIT_AGG: {'top_hits': {
+                    'size': 1, '_source': {'includes': [compare]}}}}}
+            for position, compare in enumerate(compare_map["compare"])}
+        return index, {
+            'query': {'match': {"uuid.keyword": uuid}},
+            'aggs': {_BUCKETS_AGG: {
+                'composite': {
+                    'sources': [{_ELEMENT_AGG: {'terms': {'field': element}}}],
+                    'size': _COMPOSITE_PAGE_SIZE},
+                'aggs': fields}},
+            'size': 0, 'track_total_hits': False}
+
+    def _build_metadata_output(self, search, response, compare_map,
+                               input_dict):
+        for page in self._iter_pages(*search, response):
+            for _bucket in page['buckets']:
+                compare_by = _bucket['key'][_ELEMENT_AGG]
+                if compare_by not in input_dict:
+                    input_dict[compare_by] = {}
+                for position, compare in enumerate(compare_map["compare"]):
+                    hits = _bucket[_FIELD_AGG + str(position)][
+                        _FIRST_HIT_AGG]['hits']['hits']
+                    if not hits:
+                        continue
+                    value = self.access_nested_field(
+                        hits[0].get('_source', {}), compare)
+                    if value:
+                        input_dict[compare_by][compare] = value
+        return input_dict
+
     def emit_compare_metadata_dict(self, uuid=None, compare_map=None,
                                    index=None, input_dict=None):
-        _logger.debug("Initializing metadata search object")
-        s = Search(using=self._conn_object,
-                   index=index).query("match", **{"uuid.keyword": uuid})
-        response = s.execute()
-        for hit in response.hits.hits:
-            compare_by = self.access_nested_field(hit['_source'],
-                                                  compare_map["element"])
-            if compare_by not in input_dict:
-                input_dict[compare_by] = {}
-            for compare in compare_map["compare"]:
-                value = self.access_nested_field(hit['_source'], compare)
-                if value:
-                    input_dict[compare_by][compare] = \
-                        hit['_source']["value"][compare] = value
-        return input_dict
+        search = self._build_metadata_search(compare_map, index, uuid)
+        return self._build_metadata_output(search, self._execute(*search),
+                                           compare_map, input_dict)
 
-    def access_nested_field(self, d, fields):
-        tmp_dict = d
-        for field in fields.split("."):
-            if field in tmp_dict:
-                tmp_dict = tmp_dict[field]
-            else:
-                return None
-        return tmp_dict
+    def emit_compare_metadata_dicts(self, requests):
+        """Run a batch of metadata queries in a single _msearch round trip
+
+        Args:
+          requests ([tuple]): (index, uuid, compare_map) of every query
+
+        Returns:
+          list: the dict emit_compare_metadata_dict fills in, per request
+        """
+        searches = [self._build_metadata_search(compare_map, index, uuid)
+                    for index, uuid, compare_map in requests]
+        return [self._build_metadata_output(search, response, compare_map, {})
+                for (index, uuid, compare_map), search, response
+                in zip(requests, searches, self._msearch(searches))]
@@ -0,0 +1,346 @@
+import fnmatch
+import gzip
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from . import ComputeResult, DatabaseBaseClass, get_client
+from ..benchmarks.spec import DEFAULT_PERCENTS
+from ..utils.lib import get
+
+
+_logger = logging.getLogger("touchstone")
+
+_EXTENSIONS = ('.json', '.jsonl', '.ndjson', '.json.gz', '.jsonl.gz',
+               '.ndjson.gz')
+
+
+def _open(file_path):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    return open(file_path, encoding='utf-8')
+
+
+def _index_name(file_path):
+    name = os.path.basename(file_path)
+    for extension in _EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def _load_store(conn_url, **kwargs):
+    path = conn_url[len('file://'):] if conn_url.startswith('file://') \
+        else conn_url
+    if os.path.isdir(path):
+        file_paths = sorted(os.path.join(path, name)
+                            for name in os.listdir(path)
+                            if name.endswith(_EXTENSIONS))
+    else:
+        file_paths = [path]
+    indices = {}
+    for file_path in file_paths:
+        _logger.debug("Loading documents from {}".format(file_path))
+        with _open(file_path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                doc = json.loads(line)
+                index = _index_name(file_path)
+                # Exported search hits carry their index next to _source
+                if '_source' in doc:
+                    index = doc.get('_index', index)
+                    doc = doc['_source']
+                indices.setdefault(index, []).append(doc)
+    return _DocumentStore(indices)
+
+
+def _field(doc, field):
+    # documents hold the raw value of what elasticsearch maps as .keyword
+    if field.endswith('.keyword'):
+        field = field[:-len('.keyword')]
+    try:
+        value = get(doc, field)
+    except (KeyError, TypeError):
+        return None
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _factorize(values):
+    # Sorted keys like a composite aggregation, unless the keys mix types
+    try:
+        return np.unique(values, return_inverse=True)
+    except TypeError:
+        keys = {}
+        codes = np.empty(len(values), dtype=np.intp)
+        for position, value in enumerate(values):
+            codes[position] = keys.setdefault(value, len(keys))
+        return np.array(list(keys), dtype=object), codes
+
+
+class _DocumentStore:
+    """Result documents per index with lazily built columns"""
+
+    def __init__(self, indices):
+        self._indices = indices
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def documents(self, index):
+        docs = []
+        for pattern in str(index).split(','):
+            for name in sorted(fnmatch.filter(self._indices, pattern)):
+                docs.extend(self._indices[name])
+        return docs
+
+    def column(self, index, field):
+        """Values of field in every document of index, None where absent"""
+        key = (index, field, 'object')
+        with self._lock:
+            if key not in self._columns:
+                docs = self.documents(index)
+                column = np.empty(len(docs), dtype=object)
+                column[:] = [_field(doc, field) for doc in docs]
+                self._columns[key] = column
+            return self._columns[key]
+
+    def numeric_column(self, index, field):
+        """Numeric values of field as floats, NaN where absent"""
+        key = (index, field, 'float')
+        with self._lock:
+            cached = self._columns.get(key)
+        if cached is None:
+            cached = np.array([float(value) if _is_number(value) else np.nan
+                               for value in self.column(index, field)],
+                              dtype=float)
+            with self._lock:
+                self._columns[key] = cached
+        return cached
+
+    def string_column(self, index, field):
+        key = (index, field, 'str')
+        with self._lock:
+            cached = self._columns.get(key)
+        if cached is None:
+            cached = np.array([None if value is None else str(value)
+                               for value in self.column(index, field)],
+                              dtype=object)
+            with self._lock:
+                self._columns[key] = cached
+        return cached
+
+    def matches(self, index, field, value):
+        """Mask of the documents of index whose field equals value"""
+        if _is_number(value):
+            return self.numeric_column(index, field) == float(value)
+        return self.string_column(index, field) == str(value)
+
+
+class File(DatabaseBaseClass):
+    """Offline database reading exported result documents
+
+    conn_url is a JSON-lines file or a directory of them, one document or
+    exported search hit (with _index and _source) per line. Plain documents
+    belong to the index named after their file.
+    """
+
+    # The documents are exported from elasticsearch, so benchmarks describe
+    # them with their elasticsearch search maps
+    source_type = 'elasticsearch'
+
+    def __init__(self, conn_url=None):
+        _logger.debug("Initializing File object")
+        DatabaseBaseClass.__init__(self, conn_url=conn_url)
+        self._store = get_client(str(self._conn_url), _load_store)
+        _logger.debug("Finished Initializing File object")
+
+    def _select(self, index, identifier, uuid, search_map=None):
+        mask = self._store.matches(index, identifier, str(uuid))
+        if search_map:
+            for key, value in search_map['filter'].items():
+                mask &= self._store.matches(index, key, value)
+            for key, value in search_map.get('exclude', {}).items():
+                mask &= ~self._store.matches(index, key, value)
+        return np.flatnonzero(mask)
+
+    def _group(self, index, rows, buckets):
+        # Rows lacking a bucket field fall out, like in a terms aggregation
+        columns = [self._store.column(index, field)[rows] for field in buckets]
+        present = np.ones(len(rows), dtype=bool)
+        for column in columns:
+            present &= np.not_equal(column, None)
+        rows = rows[present]
+        keys = []
+        codes = []
+        for column in columns:
+            column_keys, column_codes = _factorize(column[present])
+            keys.append(column_keys)
+            codes.append(column_codes)
+        if not len(rows):
+            return rows, [], np.empty(0, dtype=np.intp)
+        combined = np.ravel_multi_index(codes, [len(k) for k in keys])
+        group_ids, groups = np.unique(combined, return_inverse=True)
+        group_keys = [tuple(k[c] for k, c in zip(keys, key_codes))
+                      for key_codes in zip(*np.unravel_index(group_ids,
+                                                             [len(k) for k in keys]))] # noqa
+        return rows, group_keys, groups
+
+    def _reduce(self, values, groups, n_groups, agg, options):
+        # Vectorized per group reduction of the non-missing values
+        valid = ~np.isnan(values)
+        values = values[valid]
+        groups = groups[valid]
+        order = np.lexsort((values, groups))
+        values = values[order]
+        groups = groups[order]
+        counts = np.bincount(groups, minlength=n_groups)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        if agg == 'percentiles':
+            results = {}
+            for percent in options.get('percents', DEFAULT_PERCENTS):
+                rank = percent / 100.0 * np.maximum(counts - 1, 0)
+                low = np.floor(rank).astype(np.intp)
+                high = np.ceil(rank).astype(np.intp)
+                result = np.full(n_groups, np.nan)
+                low_values = values[(starts + low)[filled]]
+                high_values = values[(starts + high)[filled]]
+                result[filled] = low_values + (rank - low)[filled] * \
+                    (high_values - low_values)
+                results[str(float(percent))] = result
+            return results
+        result = np.full(n_groups, np.nan)
+        if agg == 'value_count':
+            return counts.astype(float)
+        if not values.size:
+            return result
+        if agg in ('avg', 'sum'):
+            sums = np.bincount(groups, weights=values, minlength=n_groups)
+            if agg == 'sum':
+                return sums
+            result[filled] = sums[filled] / counts[filled]
+        elif agg == 'max':
+            result[filled] = np.maximum.reduceat(values, starts[filled])
+        elif agg == 'min':
+            result[filled] = np.minimum.reduceat(values, starts[filled])
+        else:
+            raise ValueError("Unsupported aggregation {}".format(agg))
+        return result
+
+    def _build_values_dict(self, search_map, index, uuid, identifier):
+        rows = self._select(index, identifier, uuid, search_map)
+        if not len(rows):
+            return ComputeResult({}, search_map.bucket_names,
+                                 search_map.value_names)
+        rows, group_keys, groups = self._group(index, rows,
+                                               search_map['buckets'])
+        # The first row of every group, for the collate keys of the group
+        _, first_rows = np.unique(groups, return_index=True)
+        docs = self._store.documents(index)
+        # {agg name: per group values} in the order the aggregations are
+        # declared, percentiles expanded to one entry per percent
+        leaves = {}
+        values = {}
+        for _agg_str, agg, key, options in search_map.metrics:
+            if key not in values:
+                values[key] = self._store.numeric_column(index, key)[rows]
+            result = self._reduce(values[key], groups, len(group_keys), agg,
+                                  options)
+            if isinstance(result, dict):
+                for percent, percent_result in result.items():
+                    leaves[percent + _agg_str] = percent_result
+            else:
+                leaves[_agg_str] = result
+        _output_dict = {}
+        for position, group_key in enumerate(group_keys):
+            _level_dict = _output_dict
+            for bucket_name, bucket_key in zip(search_map.bucket_names,
+                                               group_key):
+                _level_dict = _level_dict.setdefault(bucket_name, {})
+                _level_dict = _level_dict.setdefault(bucket_key, {})
+            for _agg_str, result in leaves.items():
+                value = result[position]
+                _level_dict[_agg_str] = {
+                    uuid: None if np.isnan(value) else float(value)}
+            _first_hit = docs[rows[first_rows[position]]]
+            for _collate_key in search_map['collate']:
+                _level_dict[str(_collate_key)] = {}
+                try:
+                    _level_dict[str(_collate_key)][uuid] = \
+                        get(_first_hit, _collate_key)
+                except (KeyError, TypeError):
+                    _logger.debug("key not exists" + str(_collate_key))
+        return ComputeResult(_output_dict, search_map.bucket_names,
+                             search_map.value_names)
+
+    def emit_compute_dict(self, uuid=None, compute_map=None, index=None,
+                          input_dict=None, identifier=None):
+        return self._build_values_dict(compute_map, index, uuid, identifier)
+
+    def emit_compute_dicts(self, requests, identifier=None,
+                           group_identifiers=False):
+        return [self._build_values_dict(compute_map, index, uuid, identifier)
+                for index, uuid, compute_map in requests]
+
+    def emit_sample_dicts(self, requests, identifier=None, chunk_size=None):
+        # Every document is in memory already, and aggregated exactly
+        return self.emit_compute_dicts(requests, identifier=identifier)
+
+    def emit_compare_dict(self, uuid=None, compare_map=None, index=None,
+                          input_dict=None, identifier=None):
+        rows = self._select(index, identifier, uuid)
+        if len(rows):
+            doc = self._store.documents(index)[rows[0]]
+            for compare_key in compare_map[index]:
+                value = get(doc, str(compare_key))
+                if isinstance(value, list):
+                    value = value[0]
+                input_dict[compare_key][uuid] = value
+        return input_dict
+
+    def emit_compare_dicts(self, requests, identifier=None):
+        results = []
+        for index, uuid, compare_map in requests:
+            input_dict = {}
+            for key in compare_map[index]:
+                input_dict[key] = {}
+            results.append(self.emit_compare_dict(uuid=uuid,
+                                                  compare_map=compare_map,
+                                                  index=index,
+                                                  input_dict=input_dict,
+                                                  identifier=identifier))
+        return results
+
+    def emit_compare_metadata_dict(self, uuid=None, compare_map=None,
+                                   index=None, input_dict=None):
+        docs = self._store.documents(index)
+        for row in self._select(index, 'uuid', uuid):
+            compare_by = self.access_nested_field(docs[row],
+                                                  compare_map["element"])
+            if compare_by not in input_dict:
+                input_dict[compare_by] = {}
+            for compare in compare_map["compare"]:
+                # The first document holding a field wins, as with
+                # elasticsearch
+                if compare in input_dict[compare_by]:
+                    continue
+                value = self.access_nested_field(docs[row], compare)
+                if value:
+                    input_dict[compare_by][compare] = value
+        return input_dict
+
+    def emit_compare_metadata_dicts(self, requests):
+        return [self.emit_compare_metadata_dict(uuid=uuid,
+                                                compare_map=compare_map,
+                                                index=index, input_dict={})
+                for index, uuid, compare_map in requests]
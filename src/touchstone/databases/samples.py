@@ -0,0 +1,202 @@
+import logging
+
+import numpy as np
+
+from ..benchmarks.spec import DEFAULT_PERCENTS
+from ..utils.lib import get
+
+
+_logger = logging.getLogger("touchstone")
+
+# Value chunks an accumulator holds before merging them into one
+_MAX_CHUNKS = 64
+
+
+def _raw_field(field):
+    # documents hold the raw value of what elasticsearch maps as .keyword
+    if field.endswith('.keyword'):
+        return field[:-len('.keyword')]
+    return field
+
+
+def _value(doc, field):
+    try:
+        value = get(doc, field)
+    except (KeyError, TypeError):
+        return None
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _number(doc, field):
+    value = _value(doc, field)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return np.nan
+
+
+def sample_fields(search_map):
+    """Document fields the samples of a compute map are built from
+
+    Returns:
+      list: bucket, aggregated and collated fields, each once
+    """
+    fields = [_raw_field(field) for _, field in search_map.bucket_fields]
+    fields.extend(field for _, _, field, _ in search_map.metrics)
+    fields.extend(search_map['collate'])
+    return list(dict.fromkeys(fields))
+
+
+class SampleAccumulator:
+    """Running aggregations of the values of one field in one bucket
+
+    Counts, sums and extremes are kept as scalars, so memory does not grow
+    with the samples. The values themselves are only kept, as float64
+    chunks, when keep_values is set, which exact percentiles and
+    histograms need.
+    """
+
+    __slots__ = ('keep_values', 'count', 'total', 'minimum', 'maximum',
+                 '_chunks')
+
+    def __init__(self, keep_values=False):
+        self.keep_values = keep_values
+        self.count = 0
+        self.total = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self._chunks = []
+
+    def add(self, values):
+        """Add an array of values, NaN standing for missing ones"""
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        self.count += values.size
+        self.total += float(values.sum())
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        if self.keep_values:
+            self._chunks.append(values)
+            if len(self._chunks) > _MAX_CHUNKS:
+                self._chunks = [np.concatenate(self._chunks)]
+
+    def values(self):
+        if not self._chunks:
+            return np.empty(0)
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+    def percentiles(self, percents):
+        """Exact percentiles, interpolated linearly between values"""
+        if not self.count:
+            return [None] * len(percents)
+        return [float(value) for value in
+                np.percentile(self.values(), percents)]
+
+    def histogram(self, bins=10, value_range=None):
+        """Counts of the values in bins, see :func:`numpy.histogram`
+
+        Returns:
+          tuple: (counts, bin edges) arrays
+        """
+        return np.histogram(self.values(), bins=bins, range=value_range)
+
+    def aggregate(self, agg_type, params):
+        """Result of an aggregation, shaped like elasticsearch's"""
+        if agg_type == 'percentiles':
+            percents = params.get('percents', DEFAULT_PERCENTS)
+            return {'values': {str(float(percent)): value for percent, value
+                               in zip(percents,
+                                      self.percentiles(percents))}}
+        if agg_type == 'value_count':
+            return {'value': self.count}
+        if agg_type == 'sum':
+            return {'value': self.total}
+        if not self.count:
+            return {'value': None}
+        if agg_type == 'avg':
+            return {'value': self.total / self.count}
+        if agg_type == 'max':
+            return {'value': self.maximum}
+        if agg_type == 'min':
+            return {'value': self.minimum}
+        raise ValueError("Unsupported aggregation {}".format(agg_type))
+
+
+class SampleAggregator:
+    """Exact aggregations of a compute map over streamed documents
+
+    Documents are added a chunk at a time and only the accumulators, and
+    the first document, of every bucket outlive the chunk.
+
+    Args:
+      search_map (:obj:`QueryTemplate`): the compute map
+    """
+
+    def __init__(self, search_map):
+        self._search_map = search_map
+        self._bucket_fields = [_raw_field(field)
+                               for _, field in search_map.bucket_fields]
+        self._fields = list(dict.fromkeys(
+            field for _, _, field, _ in search_map.metrics))
+        self._keep_values = {field for _, agg_type, field, _
+                             in search_map.metrics
+                             if agg_type == 'percentiles'}
+        self._groups = {}
+        self._first_docs = {}
+        self.samples = 0
+
+    def _key(self, doc):
+        key = tuple(_value(doc, field) for field in self._bucket_fields)
+        # Documents lacking a bucket field fall out, like in a composite
+        # aggregation
+        return None if None in key else key
+
+    def add(self, docs):
+        """Add a chunk of documents"""
+        rows = {}
+        for position, doc in enumerate(docs):
+            key = self._key(doc)
+            if key is not None:
+                rows.setdefault(key, []).append(position)
+        columns = {field: np.fromiter((_number(doc, field) for doc in docs),
+                                      dtype=float, count=len(docs))
+                   for field in self._fields}
+        for key, positions in rows.items():
+            if key not in self._groups:
+                self._groups[key] = {
+                    field: SampleAccumulator(field in self._keep_values)
+                    for field in self._fields}
+                self._first_docs[key] = docs[positions[0]]
+            positions = np.array(positions, dtype=np.intp)
+            for field, accumulator in self._groups[key].items():
+                accumulator.add(columns[field][positions])
+        self.samples += len(docs)
+
+    def buckets(self, first_hit=None):
+        """The accumulated buckets, shaped like composite aggregation
+        buckets and in their order
+
+        Args:
+          first_hit (str): name of the top_hits aggregation holding the
+            first document of every bucket, left out if None
+        """
+        keys = list(self._groups)
+        try:
+            keys.sort()
+        except TypeError:
+            _logger.debug("Bucket keys of mixed types, keeping them in the "
+                          "order they were seen")
+        for key in keys:
+            bucket = {'key': dict(zip(self._search_map.bucket_names, key))}
+            accumulators = self._groups[key]
+            for name, agg_type, field, params in self._search_map.metrics:
+                bucket[name] = accumulators[field].aggregate(agg_type,
+                                                             params)
+            if first_hit is not None:
+                bucket[first_hit] = {'hits': {'hits': [
+                    {'_source': self._first_docs[key]}]}}
+            yield bucket
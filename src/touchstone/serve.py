@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""Resident compare daemon
+
+``touchstone serve`` answers comparisons over a Unix socket, and optionally
+localhost HTTP, keeping pooled clients, compiled benchmark specs and the
+results of immutable runs in memory between requests.
+``touchstone_compare --server`` is its thin client.
+"""
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from touchstone import __version__
+from . import benchmarks
+from . import databases
+from . import writers
+from .compare import (_identifiers, parse_args as parse_compare_args,
+                      prepare, run_comparison, setup_logging)
+
+_logger = logging.getLogger("touchstone")
+
+# Results kept in memory, about one per index, compute map and run
+DEFAULT_CACHE_ENTRIES = 10000
+# Options of touchstone_compare handled by the client, with the number of
+# values each takes
+_CLIENT_OPTIONS = {'--server': 0, '--server-address': 1, '-output-file': 1}
+_FILE_SCHEME = 'file://'
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, 'touchstone-{}.sock'.format(os.getuid()))
+
+
+class RequestError(Exception):
+    """A comparison request the daemon cannot run"""
+
+
+class _RequestParser(argparse.ArgumentParser):
+    """Parses the arguments of a request, raising instead of exiting, never
+    opening the output file, which the client writes, and resolving the
+    benchmark spec and input file against the working directory of the
+    client
+
+    Args:
+      cwd (str): working directory of the client, if known
+    """
+
+    def __init__(self, *args, cwd=None, **kwargs):
+        self._cwd = cwd
+        super().__init__(*args, **kwargs)
+
+    def add_argument(self, *args, **kwargs):
+        dest = kwargs.get('dest')
+        if dest == 'output_file':
+            kwargs['type'] = str
+        elif dest == 'benchmark':
+            kwargs['type'] = partial(self._path, str,
+                                     only=benchmarks.is_spec_file)
+        elif dest == 'input_file':
+            kwargs['type'] = partial(self._path, kwargs['type'])
+        return super().add_argument(*args, **kwargs)
+
+    def _path(self, type, value, only=None):
+        if self._cwd and value != '-' and (only is None or only(value)):
+            value = os.path.join(self._cwd, value)
+        return type(value)
+
+    def error(self, message):
+        raise RequestError(message)
+
+    def exit(self, status=0, message=None):
+        raise RequestError(message or "exited with status {}".format(status))
+
+
+def _file_urls(conn_urls, cwd):
+    # Urls of the file database are paths relative to the client too
+    if not cwd:
+        return conn_urls
+    return [_FILE_SCHEME + os.path.join(cwd, url[len(_FILE_SCHEME):])
+            if url.startswith(_FILE_SCHEME) else os.path.join(cwd, url)
+            for url in conn_urls]
+
+
+class CompareDaemon:
+    """Runs comparisons for clients, keeping what they share resident
+
+    Clients are pooled per connection url and specs compiled once per
+    version of their file, and the results of immutable runs are kept in an
+    LRU shared by every request, in front of the on-disk result cache.
+
+    Args:
+      cache (:obj:`ResultCache`): on-disk result cache, if any
+      max_entries (int): results kept in memory
+    """
+
+    def __init__(self, cache=None, max_entries=DEFAULT_CACHE_ENTRIES):
+        from .databases.cache import MemoryCache
+        self._cache = MemoryCache(cache=cache, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def status(self):
+        return {'version': __version__, 'requests': self.requests,
+                'cached_results': self._cache.entries(),
+                'cache_hits': self._cache.hits}
+
+    def _run(self, args):
+        if args.output_file or args.watch or args.profile or args.server \
+                or args.comparison:
+            raise RequestError("-output-file, --watch, --profile, --server "
+                               "and --comparison are not available from the "
+                               "daemon")
+        database_instance, benchmark_instance, metadata_search_map = \
+            prepare(args)
+        output = io.StringIO()
+        writer = writers.grab(args.output or "table", output_file=output,
+                              identifier=args.identifier,
+                              uuids=_identifiers(args))
+        cache = None
+        if not args.no_cache and database_instance.cache_results:
+            cache = self._cache
+            if args.refresh:
+                from .databases.cache import ResultCache
+                cache = ResultCache(refresh=True)
+        try:
+            regressions = run_comparison(args, database_instance,
+                                         benchmark_instance,
+                                         metadata_search_map, writer, cache)
+            writer.close()
+        finally:
+            if cache is not None and cache is not self._cache:
+                cache.close()
+        return regressions, output.getvalue()
+
+    def compare(self, argv, cwd=None):
+        """Run one comparison
+
+        Args:
+          argv ([str]): touchstone_compare arguments
+          cwd (str): working directory of the client, relative paths are
+            resolved against
+
+        Returns:
+          dict: returncode, output and regressions of the comparison, or
+            returncode and error when it could not be run
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+        try:
+            args = parse_compare_args(
+                argv, parser_class=partial(_RequestParser, cwd=cwd))
+            if args.database == 'file' and args.conn_url:
+                args.conn_url = _file_urls(args.conn_url, cwd)
+            regressions, output = self._run(args)
+            response = {'returncode': 1 if regressions else 0,
+                        'output': output, 'regressions': regressions,
+                        'baseline': args.baseline}
+        except RequestError as error:
+            response = {'returncode': 2, 'error': str(error).strip()}
+        except Exception as error:
+            _logger.error(traceback.format_exc())
+            response = {'returncode': 2, 'error': "{}: {}".format(
+                type(error).__name__, error)}
+        _logger.info("Compared {} in {:.1f} ms".format(
+            " ".join(argv), (time.perf_counter() - start) * 1000.0))
+        return response
+
+    def close(self):
+        self._cache.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "touchstone/" + __version__
+
+    def log_message(self, format, *args):
+        _logger.debug("serve: " + format % args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _local(self):
+        # Web pages can reach localhost too, but neither under a local
+        # host name nor with a JSON body, short of a preflight never
+        # answered here
+        host = urlsplit('//' + (self.headers.get('Host') or '')).hostname
+        return host in (None, 'localhost', '127.0.0.1')
+
+    def do_GET(self):
+        if not self._local():
+            return self._send(403, {'error': "forbidden"})
+        if self.path != '/status':
+            return self._send(404, {'error': "not found"})
+        self._send(200, self.server.compare_daemon.status())
+
+    def do_POST(self):
+        if not self._local() or \
+                self.headers.get_content_type() != 'application/json':
+            return self._send(403, {'error': "forbidden"})
+        if self.path != '/compare':
+            return self._send(404, {'error': "not found"})
+        try:
+            body = json.loads(self.rfile.read(
+                int(self.headers.get('Content-Length', 0))))
+            argv = [str(arg) for arg in body['args']]
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, {'error': 'expected {"args": [...]}'})
+        self._send(200, self.server.compare_daemon.compare(argv,
+                                                           body.get('cwd')))
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def request(address, method, path, body=None, timeout=None):
+    """Send one request to a daemon
+
+    Args:
+      address (str): unix socket path or http://host:port url
+      method (str): GET or POST
+      path (str): /compare or /status
+      body (dict): JSON body of the request, if any
+
+    Returns:
+      dict: JSON body of the response
+    """
+    if address.startswith('http://'):
+        url = urlsplit(address)
+        connection = http.client.HTTPConnection(url.hostname, url.port,
+                                                timeout=timeout)
+    else:
+        connection = _UnixHTTPConnection(address, timeout=timeout)
+    try:
+        connection.request(method, path,
+                           body=None if body is None else json.dumps(body),
+                           headers={'Content-Type': 'application/json'})
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def _forwarded(argv):
+    forwarded = []
+    skip = 0
+    for arg in argv:
+        if skip:
+            skip -= 1
+            continue
+        name = arg.split('=', 1)[0]
+        if name in _CLIENT_OPTIONS:
+            if '=' not in arg:
+                skip = _CLIENT_OPTIONS[name]
+            continue
+        forwarded.append(arg)
+    return forwarded
+
+
+def forward(args, argv):
+    """Run a comparison on a daemon, writing its output like a local run
+
+    Args:
+      args (:obj:`argparse.Namespace`): parsed touchstone_compare arguments
+      argv ([str]): the arguments they were parsed from
+
+    Returns:
+      int: exit code of the comparison, None when no daemon answered
+    """
+    address = args.server_address or default_socket_path()
+    try:
+        response = request(address, 'POST', '/compare',
+                           {'args': _forwarded(argv), 'cwd': os.getcwd()})
+    except (OSError, http.client.HTTPException, ValueError) as error:
+        _logger.warning("No touchstone daemon answered at {} ({}), "
+                        "comparing here".format(address, error))
+        return None
+    if response.get('error'):
+        _logger.error(response['error'])
+    output_file = args.output_file or sys.stdout
+    output_file.write(response.get('output', ''))
+    output_file.flush()
+    if response.get('regressions'):
+        _logger.error("{} metrics regressed against {}".format(
+            response['regressions'], response['baseline']))
+    return response['returncode']
+
+
+def _listening(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog="touchstone",
+        description="touchstone commands besides touchstone_compare")
+    parser.add_argument(
+        "--version",
+        action="version",
+        version="touchstone {ver}".format(ver=__version__))
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+    serve_parser = commands.add_parser(
+        'serve',
+        help="answer touchstone_compare --server requests, keeping clients "
+             "and results resident")
+    serve_parser.add_argument(
+        '--socket',
+        dest="socket",
+        help="unix socket to listen on(default: {})".format(
+            default_socket_path()),
+        type=str,
+        default=default_socket_path())
+    serve_parser.add_argument(
+        '--port',
+        dest="port",
+        help="also listen for http on this port of 127.0.0.1, where any "
+             "local user can reach the daemon(default: off)",
+        type=int)
+    serve_parser.add_argument(
+        '--pool-size',
+        dest="pool_size",
+        help="connections kept alive per database url(default: 10)",
+        type=int,
+        default=10)
+    serve_parser.add_argument(
+        '--cache-entries',
+        dest="cache_entries",
+        help="results kept in memory(default: {})".format(
+            DEFAULT_CACHE_ENTRIES),
+        type=int,
+        default=DEFAULT_CACHE_ENTRIES)
+    serve_parser.add_argument(
+        '--no-cache',
+        dest="no_cache",
+        help="keep results in memory only, not in the local result cache",
+        action="store_true")
+    serve_parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+    serve_parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+    return parser.parse_args(args)
+
+
+def serve(args):
+    """Listen until SIGINT or SIGTERM
+
+    Returns:
+      int: 0, or 1 if another daemon already listens on the socket
+    """
+    if os.path.exists(args.socket):
+        if _listening(args.socket):
+            _logger.error("A daemon already listens on {}".format(
+                args.socket))
+            return 1
+        os.unlink(args.socket)
+    databases.configure_clients(pool_size=args.pool_size)
+    cache = None
+    if not args.no_cache:
+        from .databases.cache import ResultCache
+        cache = ResultCache()
+    compare_daemon = CompareDaemon(cache, max_entries=args.cache_entries)
+    # Only the user running the daemon may talk to it over the socket
+    umask = os.umask(0o177)
+    try:
+        servers = [_UnixHTTPServer(args.socket, _Handler)]
+    finally:
+        os.umask(umask)
+    if args.port:
+        # Unlike the socket, the port is open to every local user
+        _logger.warning("Serving http on 127.0.0.1:{} without "
+                        "authentication".format(args.port))
+        servers.append(ThreadingHTTPServer(('127.0.0.1', args.port),
+                                           _Handler))
+    for server in servers:
+        server.compare_daemon = compare_daemon
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    _logger.info("Listening on {}{}".format(
+        args.socket, " and http://127.0.0.1:{}".format(args.port)
+        if args.port else ""))
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        _logger.info("Stopping")
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    os.unlink(args.socket)
+    compare_daemon.close()
+    databases.close_clients()
+    return 0
+
+
+def main(args):
+    """Main entry point allowing external calls
+
+    Args:
+      args ([str]): command line parameter list
+    """
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    if args.command == 'serve':
+        return serve(args)
+
+
+def render():
+    """Entry point for console_scripts
+    """
+    sys.exit(main(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    render()
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+_logger = logging.getLogger("touchstone")
+
+# Stands in for every span while profiling is off, so instrumented code
+# pays a function call and nothing else
+_NO_SPAN = nullcontext()
+
+_profiler = None
+
+
+class Span:
+    """A timed section of a run
+
+    Attributes:
+      name (str): what was timed, e.g. search
+      category (str): the part of touchstone it belongs to
+      start (float): perf_counter() when the span was entered
+      duration (float): seconds spent in the span
+      thread (int): ident of the thread the span ran in
+      args (dict): counters collected while the span was open, e.g. the
+        took of a search or the bytes of its response
+    """
+
+    __slots__ = ('name', 'category', 'start', 'duration', 'thread', 'args')
+
+    def __init__(self, name, category, start, duration, thread, args):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.duration = duration
+        self.thread = thread
+        self.args = args
+
+
+class Profiler:
+    """Collects the spans of every thread of a run"""
+
+    def __init__(self):
+        self.spans = []
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, category, **args):
+        stack = self._stack()
+        stack.append(args)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self.spans.append(Span(name, category, start, duration,
+                                       threading.get_ident(), args))
+
+    def note(self, **counters):
+        """Add counters to the innermost open span of the calling thread"""
+        stack = self._stack()
+        if stack:
+            for key, value in counters.items():
+                stack[-1][key] = stack[-1].get(key, 0) + value
+
+    def summary(self):
+        """Totals of every span name
+
+        Returns:
+          tuple: (headers, rows), a row per category and name holding the
+            calls, total, mean and max milliseconds and the sums of the
+            numeric counters of its spans
+        """
+        groups = {}
+        counters = []
+        for span in self.spans:
+            groups.setdefault((span.category, span.name), []).append(span)
+            for key, value in span.args.items():
+                if isinstance(value, (int, float)) and \
+                        not isinstance(value, bool) and key not in counters:
+                    counters.append(key)
+        rows = []
+        for (category, name), spans in sorted(groups.items()):
+            durations = [span.duration * 1000.0 for span in spans]
+            row = [category, name, len(spans), round(sum(durations), 2),
+                   round(sum(durations) / len(spans), 2),
+                   round(max(durations), 2)]
+            for counter in counters:
+                values = [span.args[counter] for span in spans
+                          if counter in span.args]
+                row.append(sum(values) if values else None)
+            rows.append(row)
+        headers = ['category', 'span', 'calls', 'total_ms', 'mean_ms',
+                   'max_ms'] + counters
+        return headers, rows
+
+    def format_summary(self):
+        from tabulate import tabulate
+        headers, rows = self.summary()
+        return "Profile of {:.1f} ms:\n{}".format(
+            (time.perf_counter() - self.start) * 1000.0,
+            tabulate(rows, headers=headers))
+
+    def trace(self):
+        """The spans as a Chrome trace, which chrome://tracing and Perfetto
+        open
+
+        Returns:
+          dict: the trace in the JSON object format
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            tid = threads.setdefault(span.thread, len(threads))
+            events.append({'name': span.name, 'cat': span.category,
+                           'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': (span.start - self.start) * 1e6,
+                           'dur': span.duration * 1e6,
+                           'args': span.args})
+        main = threading.main_thread().ident
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': tid, 'args': {
+                               'name': 'main' if thread == main else
+                               'worker-{}'.format(tid)}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.trace(), trace_file, default=str)
+        _logger.info("Wrote profile trace to {}".format(path))
+
+
+def enable():
+    """Start profiling the spans of every thread
+
+    Returns:
+      :obj:`Profiler`
+    """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def enabled():
+    return _profiler is not None
+
+
+def span(name, category='touchstone', **args):
+    """Time a section of code while profiling is on
+
+    Used as a context manager, which yields the counters of the span to
+    be filled in, or None when profiling is off.
+    """
+    if _profiler is None:
+        return _NO_SPAN
+    return _profiler.span(name, category, **args)
+
+
+def note(**counters):
+    """Add counters to the innermost open span, if profiling"""
+    if _profiler is not None:
+        _profiler.note(**counters)
@@ -0,0 +1,87 @@
+import logging
+
+from .lib import iter_bucket_rows
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class RecordSet:
+    """Flat, column oriented results of one compute map
+
+    Every row is a (bucket path, metric, identifier, value) tuple, the
+    bucket path holding the filter values followed by the bucket values.
+    Rows sharing a bucket path and metric are kept next to each other.
+    """
+
+    def __init__(self, columns, identifier):
+        self.columns = list(columns)
+        self.identifier = identifier
+        self.paths = []
+        self.metrics = []
+        self.identifiers = []
+        self.values = []
+
+    @classmethod
+    def from_results(cls, compute, buckets, identifier, results,
+                     identifiers):
+        """Build the record set of a compute map from its nested results
+
+        Args:
+          compute (dict): the compute map
+          buckets (list): bucket names of the compute map
+          identifier (str): name of the identifier field
+          results (list): nested results dicts, e.g. one per identifier
+          identifiers (list): identifiers in the order rows are wanted
+
+        Returns:
+          :obj:`RecordSet`
+        """
+        record_set = cls(list(compute['filter']) + list(buckets), identifier)
+        prefix = tuple(compute['filter'].values())
+        merged = {}
+        for result in results:
+            for bucket_values, metric, values in \
+                    iter_bucket_rows(result, len(buckets)):
+                merged.setdefault((prefix + bucket_values, metric),
+                                  {}).update(values)
+        for (path, metric), values in merged.items():
+            for _identifier in identifiers:
+                if _identifier in values:
+                    record_set.append(path, metric, _identifier,
+                                      values[_identifier])
+        return record_set
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, path, metric, identifier, value):
+        self.paths.append(path)
+        self.metrics.append(metric)
+        self.identifiers.append(identifier)
+        self.values.append(value)
+
+    def header(self):
+        return self.columns + ["key", self.identifier, "value"]
+
+    def rows(self):
+        """Yield every row as a flat list matching header()"""
+        for path, metric, identifier, value in \
+                zip(self.paths, self.metrics, self.identifiers, self.values):
+            yield list(path) + [metric, identifier, value]
+
+    def groups(self):
+        """Yield (path, [(metric, {identifier: value})]) per bucket path"""
+        path = None
+        metrics = []
+        for row in range(len(self)):
+            if self.paths[row] != path:
+                if metrics:
+                    yield path, metrics
+                path = self.paths[row]
+                metrics = []
+            if not metrics or metrics[-1][0] != self.metrics[row]:
+                metrics.append((self.metrics[row], {}))
+            metrics[-1][1][self.identifiers[row]] = self.values[row]
+        if metrics:
+            yield path, metrics
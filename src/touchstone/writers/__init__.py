@@ -0,0 +1,37 @@
+from importlib import import_module
+import logging
+import traceback
+
+from . base_writer import WriterBaseClass ## noqa
+
+
+_logger = logging.getLogger("touchstone")
+
+# Output formats, by name: (module, class). grab only imports the module of
+# the format asked for, and with it e.g. yaml or tabulate.
+WRITERS = {
+    'table': ('table', 'Table'),
+    'json': ('json', 'Json'),
+    'yaml': ('yaml', 'Yaml'),
+    'csv': ('csv', 'Csv'),
+}
+
+
+def grab(writer_type, *args, **kwargs):
+    try:
+        if writer_type in WRITERS:
+            module_name, class_name = WRITERS[writer_type]
+        elif '.' in writer_type:
+            module_name, class_name = writer_type.rsplit('.', 1)
+        else:
+            module_name = writer_type
+            class_name = writer_type.capitalize()
+        writer_module = import_module('touchstone.writers.' + module_name,
+                                      package='writers')
+        writer_class = getattr(writer_module, class_name)
+        instance = writer_class(*args, **kwargs)
+
+    except Exception:
+        _logger.debug("Hit an error finding the right module")
+        _logger.error(traceback.format_exc())
+    return instance
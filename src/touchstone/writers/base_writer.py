@@ -0,0 +1,88 @@
+from abc import ABCMeta, abstractmethod
+import logging
+import sys
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class WriterBaseClass(metaclass=ABCMeta): # noqa
+    """Renders results as soon as compare hands them over
+
+    Writers never see the whole run, every record is written (and flushed)
+    when it is complete so memory stays flat and consumers of the output
+    can start before the run finishes.
+    """
+
+    def __init__(self, output_file=None, identifier='uuid', uuids=None):
+        _logger.debug("Initializing WriterBaseClass instance")
+        self._output_file = output_file or sys.stdout
+        self._identifier = identifier
+        self._uuids = uuids or []
+
+    @abstractmethod
+    def write_metadata(self, uuid, metadata):
+        """Write the metadata found for one uuid
+
+        Args:
+          uuid (str): uuid the metadata belongs to
+          metadata (dict): {where: {field: value}}
+        """
+        pass
+
+    @abstractmethod
+    def write_compare(self, index, compare):
+        """Write the compare fields of one index
+
+        Args:
+          index (str): index the fields were read from
+          compare (dict): {field: {identifier: value}}
+        """
+        pass
+
+    @abstractmethod
+    def write_compute(self, index, compute, records):
+        """Write the results of one compute spec
+
+        Args:
+          index (str): index the spec ran against
+          compute (dict): the compute spec
+          records (:obj:`RecordSet`): results of every identifier
+        """
+        pass
+
+    @abstractmethod
+    def write_comparison(self, index, compute, comparison):
+        """Write the deltas of one compute spec against the baseline
+
+        Args:
+          index (str): index the spec ran against
+          compute (dict): the compute spec
+          comparison (:obj:`Comparison`): deltas and verdicts
+        """
+        pass
+
+    @abstractmethod
+    def write_distribution(self, index, compute, distribution):
+        """Write the distribution of one compute spec over historical runs
+
+        Args:
+          index (str): index the spec ran against
+          compute (dict): the compute spec
+          distribution (:obj:`Distribution`): statistics per metric
+        """
+        pass
+
+    def write_verdict(self, identifier, baseline, regressions):
+        """Write whether one identifier regressed against the baseline,
+        the record closing every run compared by a watch
+
+        Args:
+          identifier (str): identifier value of the run
+          baseline (str): identifier it was compared against
+          regressions (int): metrics that regressed
+        """
+        pass
+
+    def close(self):
+        self._output_file.flush()
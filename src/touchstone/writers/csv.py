@@ -0,0 +1,47 @@
+import csv
+import logging
+
+from .base_writer import WriterBaseClass
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class Csv(WriterBaseClass):
+    """Writes RFC 4180 CSV, a header row precedes every change of columns"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._writer = csv.writer(self._output_file, lineterminator="\n")
+        self._header = None
+
+    def _write_header(self, header):
+        if header != self._header:
+            self._writer.writerow(header)
+            self._header = header
+
+    def write_metadata(self, uuid, metadata):
+        self._write_header(["uuid", "where", "field", "value"])
+        for where, fields in metadata.items():
+            self._writer.writerows([uuid, where, field, value]
+                                   for field, value in fields.items())
+        self._output_file.flush()
+
+    def write_compare(self, index, compare):
+        # compare fields have never been part of the csv output
+        pass
+
+    def write_compute(self, index, compute, records):
+        self._write_header(records.header())
+        self._writer.writerows(records.rows())
+        self._output_file.flush()
+
+    def write_comparison(self, index, compute, comparison):
+        self._write_header(comparison.header())
+        self._writer.writerows(comparison.rows())
+        self._output_file.flush()
+
+    def write_distribution(self, index, compute, distribution):
+        self._write_header(distribution.header())
+        self._writer.writerows(distribution.rows())
+        self._output_file.flush()
@@ -0,0 +1,40 @@
+import json
+import logging
+
+from .base_writer import WriterBaseClass
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class Json(WriterBaseClass):
+    """Writes newline delimited JSON, one record per line"""
+
+    def _write(self, record):
+        self._output_file.write(json.dumps(record) + "\n")
+        self._output_file.flush()
+
+    def write_metadata(self, uuid, metadata):
+        self._write({"uuid": uuid, "metadata": metadata})
+
+    def write_compare(self, index, compare):
+        self._write({"index": index, "compare": compare})
+
+    def write_compute(self, index, compute, records):
+        self._write({"index": index, "columns": records.header(),
+                     "rows": list(records.rows())})
+
+    def write_comparison(self, index, compute, comparison):
+        self._write({"index": index, "baseline": comparison.baseline,
+                     "columns": comparison.header(),
+                     "rows": list(comparison.rows())})
+
+    def write_distribution(self, index, compute, distribution):
+        self._write({"index": index, "history": distribution.runs,
+                     "columns": distribution.header(),
+                     "rows": list(distribution.rows())})
+
+    def write_verdict(self, identifier, baseline, regressions):
+        self._write({self._identifier: identifier, "baseline": baseline,
+                     "regressions": regressions,
+                     "verdict": "regressed" if regressions else "ok"})
@@ -0,0 +1,98 @@
+import logging
+
+from tabulate import tabulate
+
+from .base_writer import WriterBaseClass
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class Table(WriterBaseClass):
+    """Pretty prints tables, the compare summary is printed on close
+
+    Every table is rendered into a list of lines and written at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compare_header_footer = "{}{}".format(("=" * 89), ("=" * 89))
+        self._compare_output = [self._compare_header_footer]
+        self._identifier_header = "{:50} |".format(self._identifier) + \
+            "".join(" {:60} |".format(uuid[:16]) for uuid in self._uuids)
+
+    def _write_lines(self, lines):
+        self._output_file.write("\n".join(lines) + "\n")
+
+    def write_metadata(self, uuid, metadata):
+        super_header = "\n{} UUID: {} {}".format(("=" * 67), uuid, ("=" * 67))
+        stockpile_metadata = {}
+        stockpile_metadata["where"] = []
+        for where in metadata.keys():
+            # Skip if there is no associated metadata
+            if not metadata[where].items():
+                continue
+            stockpile_metadata["where"].append(where)
+            for k, v in metadata[where].items():
+                if k not in stockpile_metadata:
+                    stockpile_metadata[k] = []
+                stockpile_metadata[k].append(v)
+        self._write_lines([super_header,
+                           tabulate(stockpile_metadata, headers="keys",
+                                    tablefmt="pretty")])
+
+    def write_compare(self, index, compare):
+        for key, values in compare.items():
+            self._compare_output.append(
+                "{:50} |".format(key) +
+                "".join(" {0:<60} |".format(values.get(uuid, "no_match"))
+                        for uuid in self._uuids))
+
+    def write_compute(self, index, compute, records):
+        filters = len(compute['filter'])
+        _compute_header = "{:50} |".format("bucket_name") + \
+            "".join(" {:20} |".format(key) for key in compute['filter']) + \
+            "".join(" {:60} |".format(key)
+                    for key in records.columns[filters:]) + ' ' * 62 + '|'
+        lines = []
+        for path, metrics in records.groups():
+            # Only metrics found for more than one identifier are compared
+            metrics = [(metric, values) for metric, values in metrics
+                       if len(values) > 1]
+            if not metrics:
+                continue
+            lines.append("=" * 178)
+            lines.append(_compute_header)
+            lines.append(
+                "{:50} |".format("bucket_value") +
+                "".join(" {:20} |".format(value)
+                        for value in path[:filters]) +
+                "".join(" {:60} |".format(value)
+                        for value in path[filters:]) + ' ' * 62 + '|')
+            lines.append(self._identifier_header)
+            for metric, values in metrics:
+                lines.append(
+                    "{:50} |".format(metric) +
+                    "".join(" {:60} |".format(str(values.get(uuid,
+                                                             "no_match")))
+                            for uuid in self._uuids))
+        if lines:
+            self._write_lines(lines)
+
+    def write_comparison(self, index, compute, comparison):
+        self._write_lines([
+            "=" * 178,
+            tabulate(comparison.rows(), headers=comparison.header(),
+                     tablefmt="pretty", missingval="no_match")])
+
+    def write_distribution(self, index, compute, distribution):
+        self._write_lines([
+            "=" * 178,
+            "history: {}".format(", ".join(distribution.runs)),
+            tabulate(distribution.rows(), headers=distribution.header(),
+                     tablefmt="pretty")])
+
+    def close(self):
+        self._compare_output.append(self._compare_header_footer)
+        self._write_lines(self._compare_output)
+        super().close()
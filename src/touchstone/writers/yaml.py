@@ -0,0 +1,37 @@
+import logging
+
+import yaml
+
+from .base_writer import WriterBaseClass
+
+
+_logger = logging.getLogger("touchstone")
+
+
+class Yaml(WriterBaseClass):
+    """Writes a YAML stream, one document per record"""
+
+    def _write(self, record):
+        yaml.dump(record, self._output_file, explicit_start=True,
+                  allow_unicode=True)
+        self._output_file.flush()
+
+    def write_metadata(self, uuid, metadata):
+        self._write({"uuid": uuid, "metadata": metadata})
+
+    def write_compare(self, index, compare):
+        self._write({"index": index, "compare": compare})
+
+    def write_compute(self, index, compute, records):
+        self._write({"index": index, "columns": records.header(),
+                     "rows": list(records.rows())})
+
+    def write_comparison(self, index, compute, comparison):
+        self._write({"index": index, "baseline": comparison.baseline,
+                     "columns": comparison.header(),
+                     "rows": list(comparison.rows())})
+
+    def write_distribution(self, index, compute, distribution):
+        self._write({"index": index, "history": distribution.runs,
+                     "columns": distribution.header(),
+                     "rows": list(distribution.rows())})
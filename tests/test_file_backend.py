@@ -0,0 +1,129 @@
+"""Checks of the group-by engine of the offline file database on small
+exported result files"""
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+from touchstone.benchmarks.spec import DEFAULT_PERCENTS, compile_compute
+from touchstone.databases.file import File
+
+
+def _write(path, docs):
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(str(path), 'wt') as f:
+        for doc in docs:
+            f.write(json.dumps(doc) + '\n')
+
+
+def _compute(aggregations, buckets=('test_type.keyword',), **extra):
+    return compile_compute(dict({'filter': {}, 'buckets': list(buckets),
+                                 'aggregations': aggregations,
+                                 'collate': []}, **extra))
+
+
+def _values(database, compute, uuid='u1', index='results'):
+    return database.emit_compute_dict(uuid=uuid, compute_map=compute,
+                                      index=index, identifier='uuid').values
+
+
+LATENCIES = {'stream': [4.0, 1.0, 3.0, 2.0], 'rr': [10.0, 30.0]}
+
+
+@pytest.fixture
+def database(tmp_path):
+    docs = []
+    for test_type, latencies in LATENCIES.items():
+        for iteration, latency in enumerate(latencies):
+            docs.append({'uuid': 'u1', 'test_type': test_type,
+                         'protocol': 'tcp', 'iteration': iteration,
+                         'latency': latency, 'run': {'kind': test_type}})
+    # Other runs, documents lacking the bucket field and values that are
+    # not numbers never count
+    docs.append({'uuid': 'u2', 'test_type': 'stream', 'latency': 100.0})
+    docs.append({'uuid': 'u1', 'latency': 100.0})
+    docs.append({'uuid': 'u1', 'test_type': 'rr', 'latency': 'n/a'})
+    _write(tmp_path / 'results.json', docs)
+    # Exported search hits belong to the index they were searched in
+    _write(tmp_path / 'export.jsonl.gz',
+           [{'_index': 'results', '_id': '1',
+             '_source': {'uuid': 'u3', 'test_type': 'rr', 'latency': 5.0}}])
+    return File(conn_url='file://' + str(tmp_path))
+
+
+def test_metrics_by_bucket(database):
+    compute = _compute({'latency': ['avg', 'max', 'min', 'sum',
+                                    'value_count']})
+    values = _values(database, compute)
+    assert values == {'test_type': {
+        'rr': {'avg(latency)': {'u1': 20.0}, 'max(latency)': {'u1': 30.0},
+               'min(latency)': {'u1': 10.0}, 'sum(latency)': {'u1': 40.0},
+               'value_count(latency)': {'u1': 2.0}},
+        'stream': {'avg(latency)': {'u1': 2.5}, 'max(latency)': {'u1': 4.0},
+                   'min(latency)': {'u1': 1.0},
+                   'sum(latency)': {'u1': 10.0},
+                   'value_count(latency)': {'u1': 4.0}}}}
+
+
+def test_nested_buckets(database):
+    compute = _compute({'latency': ['max']},
+                       buckets=['protocol.keyword', 'test_type.keyword'])
+    values = _values(database, compute)
+    assert values == {'protocol': {'tcp': {'test_type': {
+        'rr': {'max(latency)': {'u1': 30.0}},
+        'stream': {'max(latency)': {'u1': 4.0}}}}}}
+
+
+def test_percentiles_interpolate_linearly(database):
+    compute = _compute({'latency': [{'percentiles': {'percents': [50, 90]}},
+                                    'percentiles']})
+    values = _values(database, compute)['test_type']
+    for test_type, latencies in LATENCIES.items():
+        for percent in [50, 90]:
+            assert values[test_type]['{}percentiles(latency)'.format(
+                float(percent))]['u1'] == \
+                pytest.approx(np.percentile(latencies, percent))
+    assert compute.value_names[2:] == tuple(
+        '{}percentiles(latency)'.format(float(percent))
+        for percent in DEFAULT_PERCENTS)
+    assert '1.0percentiles(latency)' in values['stream']
+
+
+def test_filter_and_exclude(database):
+    compute = _compute({'latency': ['max']},
+                       buckets=['iteration'], filter={'test_type': 'stream'},
+                       exclude={'iteration': 3})
+    values = _values(database, compute)
+    assert values == {'iteration': {
+        0: {'max(latency)': {'u1': 4.0}}, 1: {'max(latency)': {'u1': 1.0}},
+        2: {'max(latency)': {'u1': 3.0}}}}
+
+
+def test_collate_from_the_first_document_of_each_bucket(database):
+    compute = _compute({'latency': ['max']}, collate=['run.kind',
+                                                      'missing'])
+    values = _values(database, compute)['test_type']
+    assert values['rr']['run.kind'] == {'u1': 'rr'}
+    assert values['stream']['run.kind'] == {'u1': 'stream'}
+    assert values['rr']['missing'] == {}
+
+
+def test_exported_hits_and_unknown_runs(database):
+    compute = _compute({'latency': ['avg']})
+    assert _values(database, compute, uuid='u3') == {
+        'test_type': {'rr': {'avg(latency)': {'u3': 5.0}}}}
+    result = database.emit_compute_dict(uuid='u4', compute_map=compute,
+                                        index='results', identifier='uuid')
+    assert result.values == {}
+    assert result.buckets == ('test_type',)
+    assert result.aggregations == ('avg(latency)',)
+
+
+def test_compare_takes_the_first_document(database):
+    input_dict = database.emit_compare_dict(
+        uuid='u1', compare_map={'results': ['protocol', 'test_type']},
+        index='results', input_dict={'protocol': {}, 'test_type': {}},
+        identifier='uuid')
+    assert input_dict == {'protocol': {'u1': 'tcp'},
+                          'test_type': {'u1': 'stream'}}
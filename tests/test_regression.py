@@ -0,0 +1,126 @@
+"""Checks of touchstone.analysis.regression: metric directions, thresholds,
+verdicts and the exit status of compare runs against a baseline"""
+import json
+import logging
+
+import pytest
+
+from touchstone.analysis.regression import CHANGED, IMPROVEMENT, \
+    NO_MATCH, REGRESSION, UNCHANGED, Thresholds, compare_records, \
+    direction, metric_directions
+from touchstone.utils.records import RecordSet
+
+
+@pytest.mark.parametrize("metric, expected", [
+    ('avg(norm_ltcy)', -1),
+    ('95.0percentiles(latency_ms)', -1),
+    ('max(norm_byte)', 1),
+    ('data.OVERALL.Throughput(ops/sec)', 1),
+    ('tps_incl_con_est', 1),
+    # latencies win over throughputs
+    ('avg(throughput_latency)', -1),
+    ('avg(value)', 0),
+])
+def test_direction_from_the_name(metric, expected):
+    assert direction(metric) == expected
+
+
+def test_declared_directions_win_over_the_name():
+    assert direction('avg(value)', [('*(value)', -1)]) == -1
+    assert direction('avg(norm_ltcy)', [('*ltcy*', 1)]) == 1
+    # the last matching pattern wins, others are left to their name
+    assert direction('avg(value)', [('*', 1), ('avg(*)', -1)]) == -1
+    assert direction('avg(norm_byte)', [('*(value)', -1)]) == 1
+
+
+def test_undirected_metrics_warn_once(caplog):
+    metrics = ['avg(undirected_a)', 'avg(norm_ltcy)', 'avg(undirected_a)']
+    with caplog.at_level(logging.WARNING, logger='touchstone'):
+        assert list(metric_directions(metrics)) == [0, -1, 0]
+        assert list(metric_directions(metrics)) == [0, -1, 0]
+        assert list(metric_directions(metrics,
+                                      [('*(undirected_a)', 1)])) == [1, -1, 1]
+    warnings = [record for record in caplog.records
+                if 'undirected_a' in record.getMessage()]
+    assert len(warnings) == 1
+
+
+def test_thresholds():
+    thresholds = Thresholds(5.0, [('*ltcy*', 10.0), ('avg(*ltcy)', 20.0)])
+    assert thresholds.threshold('avg(norm_byte)') == 5.0
+    assert thresholds.threshold('max(norm_ltcy)') == 10.0
+    assert thresholds.threshold('avg(norm_ltcy)') == 20.0
+    assert Thresholds().threshold('anything') == 5.0
+
+
+def _records():
+    records = RecordSet(['test_type'], 'uuid')
+    for metric, values in [
+            ('avg(norm_ltcy)', {'a': 10.0, 'b': 12.0, 'c': 10.2}),
+            ('avg(norm_byte)', {'a': 100.0, 'b': 80.0, 'c': 130.0}),
+            ('avg(undirected_b)', {'a': 1.0, 'b': 2.0}),
+            ('max(norm_byte)', {'a': 0.0, 'b': 0.0, 'c': 1.0})]:
+        for identifier, value in values.items():
+            records.append(('stream',), metric, identifier, value)
+    return records
+
+
+def test_verdicts():
+    comparison = compare_records(_records(), 'a', ['a', 'b', 'c'],
+                                 Thresholds(5.0, [('*byte*', 25.0)]))
+    assert comparison.candidates == ['b', 'c']
+    assert comparison.thresholds.tolist() == [5.0, 25.0, 5.0, 25.0]
+    assert comparison.verdicts.tolist() == [
+        [REGRESSION, UNCHANGED],
+        [UNCHANGED, IMPROVEMENT],
+        [CHANGED, NO_MATCH],
+        [UNCHANGED, IMPROVEMENT]]
+    assert comparison.regressions == 1
+    assert len(comparison) == 8
+    rows = list(comparison.rows())
+    assert comparison.header() == [
+        'test_type', 'key', 'baseline', 'uuid', 'baseline_value', 'value',
+        'delta', 'delta_pct', 'threshold_pct', 'verdict']
+    assert rows[0] == ['stream', 'avg(norm_ltcy)', 'a', 'b', 10.0, 12.0,
+                       2.0, pytest.approx(20.0), 5.0, REGRESSION]
+    assert rows[2][7] == pytest.approx(-20.0)
+    # candidates missing a value have no delta
+    assert rows[5][5:8] == [None, None, None]
+
+
+def test_declared_directions_flag_regressions():
+    comparison = compare_records(_records(), 'a', ['a', 'b', 'c'],
+                                 Thresholds(5.0),
+                                 directions=[('*(undirected_b)', -1)])
+    assert comparison.verdicts[2].tolist() == [REGRESSION, NO_MATCH]
+
+
+@pytest.fixture
+def kube_burner(tmp_path):
+    # avg(value) of metric0 grows 50% from u1 to u2, metric1 stays put
+    with open(str(tmp_path / 'ripsaw-kube-burner.json'), 'w') as f:
+        for uuid, scale in [('u1', 1.0), ('u2', 1.5), ('u3', 1.0)]:
+            for value in [2.0, 4.0]:
+                f.write(json.dumps({'uuid': uuid, 'metricName': 'metric0',
+                                    'value': value * scale}) + '\n')
+                f.write(json.dumps({'uuid': uuid, 'metricName': 'metric1',
+                                    'value': value}) + '\n')
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("uuids, status", [(['u1', 'u2'], 1),
+                                           (['u1', 'u3'], 0),
+                                           (['u2', 'u1'], 0)])
+def test_exit_status(kube_burner, capsys, uuids, status):
+    from touchstone.compare import main
+
+    assert main(['kubeburner', 'file', 'ripsaw', '-url', kube_burner,
+                 '-u'] + uuids + ['--baseline', uuids[0], '-o', 'json']) == \
+        status
+    comparison, = [record for record in
+                   map(json.loads, capsys.readouterr().out.splitlines())
+                   if 'baseline' in record]
+    verdicts = {(row[0], row[1]): row[-1] for row in comparison['rows']}
+    if status:
+        assert verdicts[('metric0', 'avg(value)')] == REGRESSION
+    assert verdicts[('metric1', 'avg(value)')] == UNCHANGED
@@ -0,0 +1,67 @@
+"""Checks of the comparison daemon of touchstone.serve on the file database"""
+import gc
+import json
+import os
+import shutil
+import warnings
+
+import pytest
+
+from touchstone.benchmarks.spec import spec_path
+from touchstone.serve import CompareDaemon
+
+
+@pytest.fixture
+def client_dir(tmp_path):
+    (tmp_path / 'db').mkdir()
+    with open(str(tmp_path / 'db' / 'ripsaw-kube-burner.json'), 'w') as f:
+        for uuid, value in [('u1', 1.0), ('u1', 3.0), ('u2', 2.0)]:
+            f.write(json.dumps({'uuid': uuid, 'metricName': 'metric0',
+                                'value': value}) + '\n')
+    (tmp_path / 'metadata.json').write_text('{"metadata": {}}')
+    shutil.copy(spec_path('kubeburner'), str(tmp_path / 'kube-burner.json'))
+    return str(tmp_path)
+
+
+def _compare(daemon, client_dir, *extra):
+    response = daemon.compare(['kube-burner.json', 'file', 'ripsaw', '-url',
+                               'db', '-u', 'u1', 'u2', '-o', 'csv'] +
+                              list(extra), cwd=client_dir)
+    assert response['returncode'] == 0, response
+    return response['output']
+
+
+def test_input_file_is_closed(client_dir):
+    daemon = CompareDaemon()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        output = _compare(daemon, client_dir, '-input-file', 'metadata.json')
+        gc.collect()
+    assert 'metric0,max(value),u1,3.0' in output.splitlines()
+    assert not [warning for warning in caught
+                if issubclass(warning.category, ResourceWarning)]
+    response = daemon.compare(['kube-burner.json', 'file', 'ripsaw', '-url',
+                               'db', '-u', 'u1', '-input-file',
+                               'missing.json'], cwd=client_dir)
+    assert response['returncode'] == 2
+    assert 'missing.json' in response['error']
+
+
+def test_edited_specs_are_reloaded(client_dir):
+    daemon = CompareDaemon()
+    assert 'metric0,max(value),u1,3.0' in \
+        _compare(daemon, client_dir).splitlines()
+    path = os.path.join(client_dir, 'kube-burner.json')
+    with open(path) as f:
+        spec = json.load(f)
+    compute, = spec['elasticsearch']['ripsaw']['ripsaw-kube-burner'][
+        'compute']
+    compute['aggregations']['value'] = ['sum']
+    with open(path, 'w') as f:
+        json.dump(spec, f)
+    # even when the edit keeps the modification time of a coarse clock
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    lines = _compare(daemon, client_dir).splitlines()
+    assert 'metric0,sum(value),u1,4.0' in lines
+    assert not [line for line in lines if 'max(value)' in line]
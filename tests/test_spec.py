@@ -0,0 +1,141 @@
+"""Checks of touchstone.benchmarks.spec: validation of benchmark specs and
+the query templates compute maps compile into"""
+import copy
+import json
+import os
+import pickle
+
+import pytest
+
+from touchstone.benchmarks.spec import DEFAULT_PERCENTS, SPEC_DIR, \
+    QueryTemplate, SpecError, compile_compute, load_spec, validate_spec
+
+
+COMPUTE = {
+    'filter': {'test_type.keyword': 'stream'},
+    'buckets': ['protocol.keyword', 'message_size'],
+    'aggregations': {'norm_byte': ['max', {'avg': {}}],
+                     'norm_ltcy': [{'percentiles': {'percents': [50, 99]}},
+                                   'percentiles']},
+    'collate': ['data.total'],
+    'lower_is_better': ['*ltcy*'],
+}
+
+SPEC = {'elasticsearch': {
+    'metadata': {'cpuinfo-metadata': {'element': 'pod_name',
+                                      'compare': ['value.CPU(s)']}},
+    'ripsaw': {'ripsaw-uperf-results': {'compare': ['uuid'],
+                                        'compute': [COMPUTE]}}}}
+
+
+@pytest.mark.parametrize("name", sorted(os.listdir(SPEC_DIR)))
+def test_shipped_specs_validate(name):
+    spec = load_spec(os.path.join(SPEC_DIR, name))
+    for harnesses in spec.values():
+        for harness, indices in harnesses.items():
+            if harness == 'metadata':
+                continue
+            for search_map in indices.values():
+                assert all(isinstance(compute, QueryTemplate)
+                           for compute in search_map['compute'])
+
+
+def _invalid(change):
+    spec = copy.deepcopy(SPEC)
+    change(spec['elasticsearch']['ripsaw']['ripsaw-uperf-results'])
+    return spec
+
+
+@pytest.mark.parametrize("change, where, message", [
+    (lambda index: index['compute'][0].update(bucket=['x']),
+     'compute[0]', "unknown keys ['bucket']"),
+    (lambda index: index['compute'][0].pop('aggregations'),
+     'compute[0]', "missing keys ['aggregations']"),
+    (lambda index: index['compute'][0].update(buckets='protocol'),
+     'compute[0].buckets', "expected a list of field names"),
+    (lambda index: index['compute'][0].update(filter={'a': [1]}),
+     'compute[0].filter', "expected a dict of field to value"),
+    (lambda index: index['compute'][0]['aggregations'].update(x=[]),
+     'compute[0].aggregations.x', "expected a non empty list"),
+    (lambda index: index['compute'][0]['aggregations'].update(
+        x=[{'percentiles': {'percents': ['50']}}]),
+     'compute[0].aggregations.x[0]', "percents must be a list of numbers"),
+    (lambda index: index['compute'][0]['aggregations'].update(
+        x=[{'avg': 'field'}]),
+     'compute[0].aggregations.x[0]', "parameters of avg must be a dict"),
+    (lambda index: index['compute'][0].update(higher_is_better='*'),
+     'compute[0].higher_is_better', "expected a list of value name"),
+    (lambda index: index.update(compare='uuid'),
+     'ripsaw-uperf-results.compare', "expected a list of field names"),
+    (lambda index: index.update(compute={}),
+     'ripsaw-uperf-results.compute', "expected a list of compute dicts"),
+])
+def test_invalid_specs_name_the_entry(change, where, message):
+    with pytest.raises(SpecError) as error:
+        validate_spec(_invalid(change))
+    assert str(error.value).startswith(
+        'spec.elasticsearch.ripsaw.ripsaw-uperf-results')
+    assert where + ': ' + message in str(error.value)
+
+
+def test_metadata_needs_an_element():
+    spec = copy.deepcopy(SPEC)
+    del spec['elasticsearch']['metadata']['cpuinfo-metadata']['element']
+    with pytest.raises(SpecError, match=r'cpuinfo-metadata\.element'):
+        validate_spec(spec)
+    validate_spec(SPEC)
+
+
+def test_load_spec(tmp_path):
+    path = tmp_path / 'uperf.json'
+    path.write_text(json.dumps(SPEC))
+    spec = load_spec(str(path))
+    compute, = spec['elasticsearch']['ripsaw']['ripsaw-uperf-results'][
+        'compute']
+    assert compute == COMPUTE
+    assert compute is compile_compute(COMPUTE)
+    broken = tmp_path / 'broken.json'
+    broken.write_text('{"elasticsearch": ')
+    with pytest.raises(SpecError, match='broken.json'):
+        load_spec(str(broken))
+
+
+def test_query_template():
+    template = compile_compute(COMPUTE)
+    assert template.bucket_fields == (('protocol', 'protocol.keyword'),
+                                      ('message_size', 'message_size'))
+    assert template.bucket_names == ('protocol', 'message_size')
+    assert template.metrics == (
+        ('max(norm_byte)', 'max', 'norm_byte', {}),
+        ('avg(norm_byte)', 'avg', 'norm_byte', {}),
+        ('percentiles(norm_ltcy)', 'percentiles', 'norm_ltcy',
+         {'percents': [50, 99]}),
+        ('percentiles(norm_ltcy)', 'percentiles', 'norm_ltcy', {}))
+    assert template.aggregation_names == (
+        'max(norm_byte)', 'avg(norm_byte)', 'percentiles(norm_ltcy)',
+        'percentiles(norm_ltcy)')
+    assert template.value_names == (
+        ('max(norm_byte)', 'avg(norm_byte)', '50.0percentiles(norm_ltcy)',
+         '99.0percentiles(norm_ltcy)') +
+        tuple('{}percentiles(norm_ltcy)'.format(float(percent))
+              for percent in DEFAULT_PERCENTS))
+    assert template.directions == (('*ltcy*', -1),)
+    assert template.key == json.dumps(COMPUTE)
+
+
+def test_query_templates_are_shared_read_only_values():
+    template = compile_compute(COMPUTE)
+    assert compile_compute(copy.deepcopy(COMPUTE)) is template
+    assert compile_compute(template) is template
+    other = QueryTemplate(dict(COMPUTE, collate=[]))
+    assert template != other
+    assert template == QueryTemplate(copy.deepcopy(COMPUTE))
+    assert len({template, QueryTemplate(copy.deepcopy(COMPUTE)), other}) == 2
+    assert template == COMPUTE
+    unpickled = pickle.loads(pickle.dumps(template))
+    assert unpickled == template
+    assert unpickled.value_names == template.value_names
+    with pytest.raises(TypeError):
+        template['collate'] = []
+    with pytest.raises(TypeError):
+        template.update(collate=[])
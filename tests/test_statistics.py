@@ -0,0 +1,125 @@
+"""Reference checks of the hand-rolled tests of touchstone.analysis.statistics
+
+Welch p-values are checked against closed forms of the Student t
+distribution and the two sided 5% critical values of published t tables,
+Mann-Whitney against the exact permutation distribution of U.
+"""
+import itertools
+import json
+import math
+
+import numpy as np
+import pytest
+
+from touchstone.analysis.statistics import mannwhitney_pvalue, welch_pvalues
+
+
+def _welch(sample1, sample2):
+    sample1 = np.asarray(sample1, dtype=float)
+    sample2 = np.asarray(sample2, dtype=float)
+    return float(welch_pvalues(
+        sample1.mean(), sample1.var(ddof=1), np.float64(len(sample1)),
+        sample2.mean(), sample2.var(ddof=1), np.float64(len(sample2))))
+
+
+@pytest.mark.parametrize("t", [0.5, 1.0, 3.0, 12.0])
+def test_welch_two_degrees_of_freedom(t):
+    # Equal variances and two values per sample give df = 2, where the two
+    # sided p-value is 1 - t / sqrt(2 + t^2)
+    se = 1.0
+    shift = t * math.sqrt(2 * se)
+    sample1 = [-1.0, 1.0]
+    sample2 = [shift - 1.0, shift + 1.0]
+    assert _welch(sample1, sample2) == pytest.approx(
+        1 - t / math.sqrt(2 + t ** 2), rel=1e-9)
+
+
+@pytest.mark.parametrize("t", [0.5, 1.0, 6.314])
+def test_welch_one_degree_of_freedom(t):
+    # Without variance in the second sample df = 1, the Cauchy distribution
+    sample1 = [-1.0, 1.0]
+    sample2 = [t, t]
+    assert _welch(sample1, sample2) == pytest.approx(
+        1 - 2 / math.pi * math.atan(t), rel=1e-9)
+
+
+@pytest.mark.parametrize("n, critical", [(3, 2.776445), (6, 2.228139),
+                                         (16, 2.042272)])
+def test_welch_critical_values(n, critical):
+    # Equal variances and sizes give df = 2 (n - 1), here 4, 10 and 30
+    sample1 = np.arange(n, dtype=float)
+    se = sample1.var(ddof=1) / n
+    sample2 = sample1 + critical * math.sqrt(2 * se)
+    assert _welch(sample1, sample2) == pytest.approx(0.05, abs=1e-6)
+
+
+def test_welch_without_variance():
+    assert _welch([3.0, 3.0], [3.0, 3.0]) == 1.0
+    assert _welch([3.0, 3.0], [4.0, 4.0]) == 0.0
+
+
+@pytest.mark.parametrize("sample1, sample2", [
+    ([1.0, 2.0, 3.0], [4.0, 5.0, 6.0, 7.0]),
+    ([1.0, 2.0, 2.0, 3.0], [2.0, 3.0, 3.0, 5.0]),
+    ([1.0, 1.0, 4.0, 6.0, 6.0], [1.0, 4.0, 4.0, 7.0]),
+])
+def test_mannwhitney_matches_permutations(sample1, sample2):
+    # The normal approximation uses the mean and variance of U over every
+    # assignment of the pooled values to the two samples, ties included
+    values = np.concatenate([sample1, sample2])
+    n1 = len(sample1)
+    ranks = np.array([(values < value).sum() + ((values == value).sum() + 1)
+                      / 2.0 for value in values])
+    us = np.array([ranks[list(group)].sum() - n1 * (n1 + 1) / 2.0
+                   for group in itertools.combinations(range(len(values)),
+                                                       n1)])
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2.0
+    z = (u - us.mean()) / us.std()
+    assert mannwhitney_pvalue(np.array(sample1), np.array(sample2)) == \
+        pytest.approx(math.erfc(abs(z) / math.sqrt(2)), rel=1e-9)
+
+
+def test_mannwhitney_separated_samples():
+    # U = 0 for n1 = n2 = 3, z = -4.5 / sqrt(5.25)
+    assert mannwhitney_pvalue(np.array([1.0, 2.0, 3.0]),
+                              np.array([4.0, 5.0, 6.0])) == \
+        pytest.approx(0.049535, abs=1e-6)
+
+
+def test_mannwhitney_identical_samples():
+    assert mannwhitney_pvalue(np.array([2.0, 2.0]),
+                              np.array([2.0, 2.0])) == 1.0
+
+
+def test_statistics_of_collated_iterations(tmp_path, capsys):
+    # Every iteration of a ycsb run is one summary document, so the samples
+    # are the collated values of each iteration's own document
+    from touchstone.compare import main
+
+    throughputs = {'u1': [100.0, 102.0, 98.0], 'u2': [50.0, 51.0, 49.0]}
+    with open(str(tmp_path / 'ripsaw-ycsb-summary.json'), 'w') as f:
+        for uuid, values in throughputs.items():
+            for iteration, value in enumerate(values):
+                f.write(json.dumps({
+                    'uuid': uuid, 'user': 'perf', 'recordcount': 1000,
+                    'operationcount': 5000, 'driver': 'mongodb',
+                    'phase': 'run',
+                    'workload_type': 'workloada', 'iteration': iteration,
+                    'data': {'OVERALL': {'Throughput(ops/sec)': value}}}))
+                f.write('\n')
+    main(['ycsb', 'file', 'ripsaw', '-url', str(tmp_path), '-u', 'u1', 'u2',
+          '-o', 'json', '--statistics'])
+    records = [json.loads(line)
+               for line in capsys.readouterr().out.splitlines()
+               if line.startswith('{')]
+    statistics, = [record for record in records if 'baseline' in record]
+    rows = {row['uuid']: row for row in
+            (dict(zip(statistics['columns'], row))
+             for row in statistics['rows'])
+            if row['key'] == 'data.OVERALL.Throughput(ops/sec)'}
+    assert rows['u1']['samples'] == 3
+    assert rows['u1']['mean'] == pytest.approx(100.0)
+    assert rows['u1']['stddev'] == pytest.approx(2.0)
+    assert rows['u2']['stddev'] == pytest.approx(1.0)
+    assert 0.0 < rows['u2']['welch_p'] < 0.05
+    assert rows['u2']['verdict'] == 'regression'